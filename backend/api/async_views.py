@@ -0,0 +1,173 @@
+"""
+Асинхронные (ASGI) представления корзины и меню ресторанов.
+
+Работают без пула потоков: Redis через redis.asyncio на общем пуле подключений,
+база через асинхронный ORM. Ответы совпадают с синхронными представлениями из views.py.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from redis import RedisError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .exceptions import infrastructure_error
+from .menu import aget_menus
+from .pagination import RestaurantPagination
+from .serializers import AddOrDeleteToCartSerializer, CartBatchSerializer, RestaurantSerializer
+from config.db_router import read_from_replica
+from config.redis import get_async_redis_client
+from core.models import Restaurant
+from core.services.cart import AsyncCartPricing, AsyncCartStore
+from core.services.dish_search import filter_by_dish_name
+
+ard = get_async_redis_client()
+
+
+def json_response(data, status: int = 200) -> JsonResponse:
+    # кодировщик DRF, чтобы Decimal и прочие типы выводились так же, как в синхронных представлениях
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+class AsyncAPIView(View):
+    """
+    Базовое асинхронное представление: проверка сессионной аутентификации, разбор JSON тела запроса
+    и ответы на ошибки Redis и базы, как у api.exceptions.exception_handler.
+    При replica_reads чтения GET-запросов идут в реплику, как у ReplicaReadMixin
+    """
+    replica_reads = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if self.replica_reads and request.method in ('GET', 'HEAD'):
+                with read_from_replica():
+                    return await self.handle(request, *args, **kwargs)
+            return await self.handle(request, *args, **kwargs)
+        except (RedisError, DatabaseError) as e:
+            data, status, headers = infrastructure_error(e)
+            response = json_response(data, status=status)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+    async def handle(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return json_response({'detail': 'Учетные данные не были предоставлены.'}, status=403)
+        return await super().dispatch(request, *args, **kwargs)
+
+    @staticmethod
+    def get_json(request) -> dict:
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+
+
+class AsyncRestaurantListView(AsyncAPIView):
+    replica_reads = True
+
+    async def get(self, request) -> HttpResponse:
+        """
+        Постраничный список ресторанов с меню из кэша JSON-фрагментов
+        """
+        restaurant_id = request.GET.get('restaurant_id')
+        dish_name = request.GET.get('dish_name')
+        if restaurant_id and not restaurant_id.isdigit():
+            return json_response({'detail': 'Указан не корректный ID ресторана'}, status=403)
+
+        paginator = RestaurantPagination()
+        if dish_name:
+            data = await sync_to_async(self.search)(request, paginator, dish_name, restaurant_id)
+            if data is None:
+                return self.not_found()
+            return json_response(data)
+
+        queryset = Restaurant.objects.all()
+        if restaurant_id:
+            queryset = queryset.filter(id=restaurant_id)
+        page = await paginator.apaginate_keys(queryset, request)
+        if not page and not request.GET.get(paginator.cursor_query_param):
+            return self.not_found()
+
+        menus = await aget_menus([pk for _, pk in page])
+        body = f'{{"next":{json.dumps(paginator.get_next_link())},"results":[{",".join(menus)}]}}'
+        return HttpResponse(body, content_type='application/json')
+
+    @staticmethod
+    def search(request, paginator: RestaurantPagination, dish_name: str, restaurant_id: str | None) -> dict | None:
+        # поиск идёт через FTS5 на сыром курсоре, у которого нет асинхронного API
+        queryset = Restaurant.objects.all()
+        if restaurant_id:
+            queryset = queryset.filter(id=restaurant_id)
+        queryset = filter_by_dish_name(queryset, dish_name, int(restaurant_id) if restaurant_id else None)
+        page = paginator.paginate_queryset(queryset.distinct(), request)
+        if not page and not request.GET.get(paginator.cursor_query_param):
+            return None
+        return {'next': paginator.get_next_link(), 'results': RestaurantSerializer(page, many=True).data}
+
+    @staticmethod
+    def not_found() -> JsonResponse:
+        return json_response(
+            {'detail': 'Ресторан не найден или у вас нет разрешения на его просмотр.'}, status=403
+        )
+
+
+class AsyncCartView(AsyncAPIView):
+
+    async def get(self, request) -> JsonResponse:
+        """
+        Получает все товары в корзине пользователя и рассчитывает общую стоимость.
+        """
+        priced = await AsyncCartPricing(ard).price_cart(request.user.id)
+        return json_response({'total_price': priced.total, 'positions': priced.positions})
+
+
+class AsyncCartAddView(AsyncAPIView):
+
+    async def post(self, request) -> JsonResponse:
+        """
+        Добавление блюда в корзину пользователя.
+        """
+        serializer = AddOrDeleteToCartSerializer(data=self.get_json(request))
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=400)
+        dish_id = serializer.validated_data['dish_id']
+        quantity = serializer.validated_data['quantity']
+        if await AsyncCartStore(ard).add(request.user.id, dish_id, quantity) is None:
+            return json_response({'dish_id': ['Dish not found']}, status=400)
+        return json_response({})
+
+
+class AsyncCartDeleteView(AsyncAPIView):
+
+    async def post(self, request) -> JsonResponse:
+        """
+        Удаление блюда из корзины пользователя.
+        """
+        serializer = AddOrDeleteToCartSerializer(data=self.get_json(request))
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=400)
+        dish_id = serializer.validated_data['dish_id']
+        quantity = serializer.validated_data['quantity']
+        if await AsyncCartStore(ard).remove(request.user.id, dish_id, quantity) is None:
+            return json_response({'detail': 'Блюдо отсутствует в корзине'}, status=404)
+        return json_response({})
+
+
+class AsyncCartBatchView(AsyncAPIView):
+
+    async def post(self, request) -> JsonResponse:
+        """
+        Применение набора операций add/remove/set к корзине пользователя одним запросом.
+        """
+        serializer = CartBatchSerializer(data=self.get_json(request))
+        # проверка существования блюд читает базу синхронным ORM
+        if not await sync_to_async(serializer.is_valid)():
+            return json_response(serializer.errors, status=400)
+        cart = await AsyncCartStore(ard).apply(request.user.id, serializer.validated_data['operations'])
+        positions = [{'dish_id': dish_id, 'quantity': quantity} for dish_id, quantity in cart.items()]
+        return json_response({'positions': positions})
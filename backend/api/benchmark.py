@@ -0,0 +1,435 @@
+"""
+Инструменты нагрузочного тестирования API: сбор статистики задержек и смешанная нагрузка через тестовый клиент
+"""
+
+import copy
+import gzip
+import json
+import queue
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple
+from urllib.parse import parse_qsl, urlencode
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from redis import ConnectionPool
+
+from config.metrics import percentile
+from config.redis import InstrumentedRedis
+from users.models import CustomUser
+
+# Доля операций в смешанной нагрузке, близкая к реальному трафику: в основном просмотр меню и корзины
+DEFAULT_MIX = {
+    'restaurants': 30,
+    'restaurant': 10,
+    'search': 10,
+    'cart': 15,
+    'cart_add': 20,
+    'cart_delete': 5,
+    'checkout': 4,
+    'orders': 6,
+}
+
+
+class BenchmarkStats:
+    """
+    Потокобезопасный сбор задержек, ошибок и числа SQL-запросов по точкам входа
+    """
+
+    def __init__(self, sample_size: int | None = None, seed: int = 0):
+        """
+        :param sample_size: если задан, задержки по каждой точке входа хранятся в выборке фиксированного
+            размера (reservoir sampling), и память не растёт с числом запросов
+        """
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.sample_size = sample_size
+        self.latencies = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+
+    def finish(self) -> None:
+        self.finished_at = time.perf_counter()
+
+    def record(self, endpoint: str, duration: float, status_code: int, queries: int = 0) -> None:
+        with self._lock:
+            self.counts[endpoint] += 1
+            latencies = self.latencies[endpoint]
+            if self.sample_size is None or len(latencies) < self.sample_size:
+                latencies.append(duration)
+            else:
+                slot = self._rng.randrange(self.counts[endpoint])
+                if slot < self.sample_size:
+                    latencies[slot] = duration
+            self.queries[endpoint] += queries
+            if status_code >= 500 or status_code == 0:
+                self.errors[endpoint] += 1
+
+    def report(self) -> dict:
+        """
+        Сводка по каждой точке входа и по всей нагрузке: p50/p95/p99 в миллисекундах,
+        RPS, доля ошибок и среднее число SQL-запросов на запрос
+        """
+        elapsed = (self.finished_at or time.perf_counter()) - (self.started_at or time.perf_counter())
+        endpoints = {}
+        all_latencies = []
+        for endpoint, latencies in sorted(self.latencies.items()):
+            values = sorted(latencies)
+            all_latencies.extend(values)
+            endpoints[endpoint] = self._summary(
+                values, self.counts[endpoint], self.errors[endpoint], self.queries[endpoint], elapsed
+            )
+        total = self._summary(
+            sorted(all_latencies), sum(self.counts.values()), sum(self.errors.values()), sum(self.queries.values()),
+            elapsed,
+        )
+        return {'elapsed': elapsed, 'total': total, 'endpoints': endpoints}
+
+    @staticmethod
+    def _summary(values: list[float], count: int, errors: int, queries: int, elapsed: float) -> dict:
+        return {
+            'requests': count,
+            'errors': errors,
+            'error_rate': errors / count if count else 0.0,
+            'rps': count / elapsed if elapsed > 0 else 0.0,
+            'p50': percentile(values, 0.50) * 1000,
+            'p95': percentile(values, 0.95) * 1000,
+            'p99': percentile(values, 0.99) * 1000,
+            'queries': queries / count if count else 0.0,
+        }
+
+
+def format_report(report: dict) -> str:
+    rows = list(report['endpoints'].items()) + [('TOTAL', report['total'])]
+    width = max(16, *(len(endpoint) + 2 for endpoint, _ in rows))
+    header = f"{'endpoint':<{width}}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}" \
+             f"{'p99 ms':>10}{'queries':>9}"
+    lines = [header, '-' * len(header)]
+    for endpoint, row in rows:
+        lines.append(
+            f"{endpoint:<{width}}{row['requests']:>10}{row['errors']:>8}{row['rps']:>10.1f}{row['p50']:>10.2f}"
+            f"{row['p95']:>10.2f}{row['p99']:>10.2f}{row['queries']:>9.2f}"
+        )
+    lines.append(f"elapsed: {report['elapsed']:.2f} s")
+    return '\n'.join(lines)
+
+
+@contextmanager
+def fake_redis():
+    """
+    Подменяет Redis на fakeredis в памяти процесса для клиента из config.redis,
+    представлений и кэша Django, чтобы нагрузку можно было запускать без сервера Redis
+    """
+    from unittest.mock import patch
+
+    import fakeredis
+
+    # каждый запуск получает свой пустой сервер, данные прошлых прогонов не смешиваются
+    server = fakeredis.FakeServer()
+    pool = ConnectionPool.from_url(settings.URL_REDIS, connection_class=fakeredis.FakeConnection, server=server)
+    caches = copy.deepcopy(settings.CACHES)
+    for alias in caches.values():
+        if alias['BACKEND'] == 'django_redis.cache.RedisCache':
+            options = alias.setdefault('OPTIONS', {})
+            options.setdefault('CONNECTION_POOL_KWARGS', {}).update(
+                connection_class=fakeredis.FakeConnection, server=server,
+            )
+
+    with patch('config.redis.redis_connection_pool', pool), \
+            patch('api.views.rd', InstrumentedRedis(connection_pool=pool)), \
+            override_settings(CACHES=caches):
+        yield
+
+
+class WorkloadDriver:
+    """
+    Смешанная нагрузка на API внутри процесса через тестовый клиент Django:
+    у каждого пользователя свой клиент с сессией, пользователи распределены между потоками
+    """
+
+    def __init__(self, users: list, dish_ids: list[int], restaurant_ids: list[int], search_terms: list[str],
+                 mix: dict[str, int] | None = None, seed: int = 0):
+        self.users = users
+        self.dish_ids = dish_ids
+        self.restaurant_ids = restaurant_ids
+        self.search_terms = search_terms
+        self.mix = mix or DEFAULT_MIX
+        self.seed = seed
+
+    def run(self, requests: int, concurrency: int = 1) -> BenchmarkStats:
+        stats = BenchmarkStats()
+        concurrency = max(min(concurrency, len(self.users)), 1)
+        shares = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+        stats.start()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(self._worker, worker, self.users[worker::concurrency], shares[worker], stats)
+                for worker in range(concurrency)
+            ]
+            for future in futures:
+                future.result()
+        stats.finish()
+        return stats
+
+    def _worker(self, worker: int, users: list, requests: int, stats: BenchmarkStats) -> None:
+        rng = random.Random(self.seed + worker)
+        clients = []
+        for user in users:
+            client = Client(SERVER_NAME='localhost')
+            client.force_login(user)
+            clients.append(client)
+
+        operations, weights = zip(*self.mix.items())
+        try:
+            for _ in range(requests):
+                operation = rng.choices(operations, weights)[0]
+                client = rng.choice(clients)
+                method, path, data = self.build_request(operation, rng)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    if method == 'GET':
+                        response = client.get(path, data)
+                    else:
+                        response = client.post(path, data, content_type='application/json')
+                    duration = time.perf_counter() - started
+                stats.record(operation, duration, response.status_code, len(queries))
+        finally:
+            connection.close()
+
+    def build_request(self, operation: str, rng: random.Random) -> tuple[str, str, dict]:
+        if operation == 'restaurants':
+            return 'GET', '/api/v1/restaurants/', {}
+        if operation == 'restaurant':
+            return 'GET', '/api/v1/restaurants/', {'restaurant_id': rng.choice(self.restaurant_ids)}
+        if operation == 'search':
+            return 'GET', '/api/v1/restaurants/', {'dish_name': rng.choice(self.search_terms)}
+        if operation == 'cart':
+            return 'GET', '/api/v1/cart/', {}
+        if operation == 'cart_add':
+            return 'POST', '/api/v1/cart/dish/add/', {'dish_id': rng.choice(self.dish_ids), 'quantity': 1}
+        if operation == 'cart_delete':
+            return 'POST', '/api/v1/cart/dish/delete/', {'dish_id': rng.choice(self.dish_ids), 'quantity': 1}
+        if operation == 'checkout':
+            return 'POST', '/api/v1/orders/', {}
+        if operation == 'orders':
+            return 'GET', '/api/v1/orders/', {}
+        raise ValueError(f'Unknown operation: {operation}')
+
+
+NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+class LogEntry(NamedTuple):
+    """
+    Запрос из журнала трафика
+    """
+    method: str
+    path: str
+    query: dict
+    body: object
+    user: str | None
+    timestamp: float | None
+    endpoint: str
+
+
+def parse_log_record(record: object) -> LogEntry | None:
+    """
+    Разбор одной записи журнала вида
+    {"ts": 1718000000.25, "method": "POST", "path": "/api/v1/cart/dish/add/", "query": {}, "body": {...},
+    "user": "bench_1", "endpoint": "cart_add"}.
+    Обязателен только path; ts - секунды эпохи или дата в ISO 8601. Записи другого вида пропускаются
+    :return: запрос или None, если запись не описывает HTTP-запрос
+    """
+    if not isinstance(record, dict) or not isinstance(record.get('path'), str) or \
+            not record['path'].startswith('/'):
+        return None
+    method = str(record.get('method', 'GET')).upper()
+    timestamp = record.get('ts')
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            return None
+    elif timestamp is not None and not isinstance(timestamp, (int, float)):
+        return None
+    path, _, query_string = record['path'].partition('?')
+    query = record.get('query') or {}
+    if query_string:
+        query = {**dict(parse_qsl(query_string)), **query}
+    endpoint = record.get('endpoint') or f'{method} {NUMERIC_SEGMENT.sub("/{id}", path)}'
+    return LogEntry(method, path, query, record.get('body'), record.get('user'), timestamp, endpoint)
+
+
+def iter_log(path: str) -> Iterator[LogEntry | None]:
+    """
+    Построчное чтение журнала в формате JSONL (файлы .gz читаются без распаковки на диск).
+    Журнал не загружается в память целиком; на месте нераспознанных строк отдаётся None
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as log:
+        for line in log:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield parse_log_record(record)
+
+
+class ReplayError(Exception):
+    """
+    Поток воспроизведения журнала завершился с ошибкой, исходное исключение - в __cause__
+    """
+
+
+class LogReplayer:
+    """
+    Воспроизведение журнала трафика через тестовый клиент Django.
+
+    Запросы одного пользователя всегда попадают в один поток и выполняются в порядке журнала,
+    поэтому, например, добавление в корзину и оформление заказа не меняются местами.
+    Между чтением журнала и потоками стоят очереди ограниченного размера, задержки хранятся
+    в выборке фиксированного размера, а клиенты пользователей - в LRU ограниченного размера,
+    так что память не зависит от длины журнала и числа пользователей в нём.
+    Если поток завершился с ошибкой, чтение журнала останавливается на первой записи для этого потока,
+    а run выбрасывает ReplayError.
+    """
+
+    # Как часто (секунды) чтение журнала, ожидающее места в очереди, проверяет, что её поток жив
+    LIVENESS_INTERVAL = 0.5
+
+    def __init__(self, concurrency: int = 1, speed: float = 0.0, default_user: str | None = None,
+                 sample_size: int = 10000, queue_size: int = 100, max_clients: int = 1000):
+        """
+        :param speed: 0 - без пауз, 1 - с интервалами из журнала, 2 - вдвое быстрее записанного и т.д.
+        :param default_user: пользователь для записей без поля user, без него такие запросы анонимные
+        :param max_clients: сколько авторизованных клиентов держит каждый поток, вытесняются давно не использованные
+        """
+        self.concurrency = max(concurrency, 1)
+        self.speed = speed
+        self.default_user = default_user
+        self.sample_size = sample_size
+        self.queue_size = queue_size
+        self.max_clients = max(max_clients, 1)
+        self.skipped = 0
+
+    def run(self, entries: Iterable[LogEntry | None], limit: int | None = None) -> BenchmarkStats:
+        stats = BenchmarkStats(sample_size=self.sample_size)
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(self.concurrency)]
+        failures = [None] * self.concurrency
+        workers = [
+            threading.Thread(target=self._worker, args=(entries_queue, stats, failures, index))
+            for index, entries_queue in enumerate(queues)
+        ]
+
+        stats.start()
+        for worker in workers:
+            worker.start()
+        try:
+            replayed = 0
+            first_timestamp = None
+            anonymous = 0
+            for entry in entries:
+                if entry is None:
+                    self.skipped += 1
+                    continue
+                if limit is not None and replayed >= limit:
+                    break
+                if self.speed > 0 and entry.timestamp is not None:
+                    if first_timestamp is None:
+                        first_timestamp = entry.timestamp
+                    delay = stats.started_at + (entry.timestamp - first_timestamp) / self.speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                username = entry.user or self.default_user
+                if username:
+                    worker = zlib.crc32(username.encode()) % self.concurrency
+                else:
+                    worker, anonymous = anonymous % self.concurrency, anonymous + 1
+                if not self._put(queues[worker], workers[worker], entry):
+                    break
+                replayed += 1
+        finally:
+            for entries_queue, worker in zip(queues, workers):
+                self._put(entries_queue, worker, None)
+            for worker in workers:
+                worker.join()
+        stats.finish()
+        failure = next((failure for failure in failures if failure is not None), None)
+        if failure is not None:
+            raise ReplayError(f'Поток воспроизведения завершился с ошибкой: {failure!r}') from failure
+        return stats
+
+    def _put(self, entries: queue.Queue, worker: threading.Thread, entry: LogEntry | None) -> bool:
+        """
+        Передаёт запись потоку, пока он жив: завершившийся поток очередь не разбирает,
+        и ожидание места в ней без проверки длилось бы вечно
+        :return: False, если поток уже завершился
+        """
+        while worker.is_alive():
+            try:
+                entries.put(entry, timeout=self.LIVENESS_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, entries: queue.Queue, stats: BenchmarkStats, failures: list, index: int) -> None:
+        clients = OrderedDict()
+        try:
+            while (entry := entries.get()) is not None:
+                username = entry.user or self.default_user
+                client = clients.get(username)
+                if client is None:
+                    client = clients[username] = self.make_client(username)
+                    if len(clients) > self.max_clients:
+                        clients.popitem(last=False)
+                else:
+                    clients.move_to_end(username)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    try:
+                        status_code = self.send(client, entry).status_code
+                    except Exception:
+                        status_code = 0
+                    duration = time.perf_counter() - started
+                stats.record(entry.endpoint, duration, status_code, len(queries))
+        except Exception as e:
+            failures[index] = e
+        finally:
+            connection.close()
+
+    @staticmethod
+    def make_client(username: str | None) -> Client:
+        client = Client(SERVER_NAME='localhost', raise_request_exception=False)
+        user = CustomUser.objects.filter(username=username).first() if username else None
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    @staticmethod
+    def send(client: Client, entry: LogEntry):
+        if entry.method == 'GET':
+            return client.get(entry.path, entry.query)
+        path = f'{entry.path}?{urlencode(entry.query, doseq=True)}' if entry.query else entry.path
+        body = json.dumps(entry.body) if entry.body is not None else ''
+        return client.generic(entry.method, path, body, content_type='application/json')
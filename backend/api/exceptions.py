@@ -0,0 +1,53 @@
+"""
+Обработка исключений API
+"""
+
+import logging
+import math
+
+from django.conf import settings
+from django.db import DatabaseError
+from redis import RedisError
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import exception_handler as drf_exception_handler
+
+from config.redis import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+def infrastructure_error(exc: Exception) -> tuple[dict, int, dict] | None:
+    """
+    Ответ на ошибку Redis или базы, общий для представлений DRF и асинхронных представлений.
+    Недоступность Redis отдаётся клиенту как 503 с Retry-After вместо 500, ошибка базы - как 500
+    без текста исключения, в котором могут быть SQL и параметры подключения
+    :return: данные, статус и заголовки ответа или None для остальных исключений
+    """
+    if isinstance(exc, RedisError):
+        if not isinstance(exc, CircuitOpenError):
+            logger.warning('Ошибка Redis при обработке запроса', exc_info=exc)
+        return (
+            {'detail': 'Сервис временно недоступен, повторите запрос позже'},
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            {'Retry-After': str(math.ceil(settings.REDIS_CIRCUIT_RESET_TIMEOUT))},
+        )
+    if isinstance(exc, DatabaseError):
+        logger.error('Ошибка базы при обработке запроса', exc_info=exc)
+        return (
+            {'detail': 'Внутренняя ошибка сервера, повторите запрос позже'},
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            {},
+        )
+    return None
+
+
+def exception_handler(exc: Exception, context: dict) -> Response | None:
+    """
+    Ошибки Redis и базы обрабатываются infrastructure_error, остальные исключения - DRF
+    """
+    error = infrastructure_error(exc)
+    if error is not None:
+        data, code, headers = error
+        return Response(data, status=code, headers=headers)
+    return drf_exception_handler(exc, context)
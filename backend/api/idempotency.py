@@ -0,0 +1,125 @@
+"""
+Идемпотентность повторяемых запросов по заголовку Idempotency-Key
+"""
+
+import json
+import logging
+import time
+import uuid
+from typing import Callable
+
+from django.conf import settings
+from redis import Redis, RedisError
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Снимает блокировку, только если она принадлежит этому запросу: блокировка могла истечь
+# и достаться параллельному дублю
+# KEYS[1] - блокировка; ARGV[1] - токен запроса
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Сохраняет ответ и снимает свою блокировку одним скриптом, поэтому нет момента, когда блокировка
+# уже снята, а ответа ещё нет
+# KEYS[1] - ответ, KEYS[2] - блокировка; ARGV[1] - ответ, ARGV[2] - время хранения ответа, ARGV[3] - токен запроса
+COMPLETE_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+if redis.call('GET', KEYS[2]) == ARGV[3] then
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+
+class IdempotentRequest:
+    """
+    Выполняет обработчик запроса не больше одного раза на ключ пользователя.
+
+    Успешный ответ сохраняется в Redis на IDEMPOTENCY_TTL секунд, и повтор запроса с тем же ключом
+    возвращает его одной командой GET, без обращения к базе и повторного списания средств.
+    Параллельные дубли сводятся к одному выполнению короткой блокировкой SET NX: дубль ждёт
+    ответа первого запроса до IDEMPOTENCY_WAIT секунд, после чего получает 409.
+    Ответы с ошибкой не сохраняются, такой запрос можно повторить с тем же ключом.
+    Если успешный ответ сохранить не удалось, блокировка остаётся на IDEMPOTENCY_TTL секунд,
+    и повтор получает 409, а не выполняется второй раз
+    """
+
+    def __init__(self, client: Redis, user_id: int, key: str):
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({IDEMPOTENCY_HEADER: f'Ключ должен быть длиной от 1 до {MAX_KEY_LENGTH} символов'})
+        self.client = client
+        self.response_key = f'idempotency:{user_id}:{key}'
+        self.lock_key = f'idempotency:lock:{user_id}:{key}'
+        self.token = uuid.uuid4().hex
+        self._release = client.register_script(RELEASE_LOCK_SCRIPT)
+        self._complete = client.register_script(COMPLETE_SCRIPT)
+
+    def run(self, handler: Callable[[], Response]) -> Response:
+        """
+        :param handler: обработчик запроса, вызывается только при первом запросе с ключом
+        :return: ответ обработчика или сохранённый ответ первого запроса
+        """
+        response = self.stored_response()
+        if response is not None:
+            return response
+
+        if not self.client.set(self.lock_key, self.token, nx=True, ex=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            return self.wait_response()
+
+        try:
+            response = handler()
+        except BaseException:
+            self._release(keys=[self.lock_key], args=[self.token])
+            raise
+        if status.is_success(response.status_code):
+            self.complete(response)
+        else:
+            self._release(keys=[self.lock_key], args=[self.token])
+        return response
+
+    def complete(self, response: Response) -> None:
+        """
+        Сохраняет успешный ответ и снимает блокировку. Запрос уже выполнен, поэтому ошибка Redis не меняет ответ
+        клиенту: блокировка продлевается на время хранения ответа, чтобы повтор не выполнил запрос второй раз
+        """
+        payload = json.dumps({'status': response.status_code, 'data': response.data}, cls=JSONEncoder)
+        try:
+            self._complete(keys=[self.response_key, self.lock_key], args=[payload, settings.IDEMPOTENCY_TTL, self.token])
+        except RedisError:
+            logger.warning('Не удалось сохранить ответ по ключу %s', self.response_key, exc_info=True)
+            try:
+                self.client.set(self.lock_key, self.token, ex=settings.IDEMPOTENCY_TTL)
+            except RedisError:
+                logger.exception('Не удалось продлить блокировку по ключу %s', self.response_key)
+
+    def stored_response(self) -> Response | None:
+        payload = self.client.get(self.response_key)
+        if payload is None:
+            return None
+        stored = json.loads(payload)
+        return Response(stored['data'], status=stored['status'], headers={'Idempotent-Replayed': 'true'})
+
+    def wait_response(self) -> Response:
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            response = self.stored_response()
+            if response is not None:
+                return response
+            if not self.client.exists(self.lock_key):
+                break
+        return self.stored_response() or Response(
+            {'detail': 'Запрос с этим ключом идемпотентности ещё выполняется или завершился ошибкой'},
+            status=status.HTTP_409_CONFLICT,
+        )
@@ -0,0 +1,48 @@
+import json
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import DEFAULT_MIX, WorkloadDriver, fake_redis, format_report
+from core.models import Dish, Restaurant
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогоняет смешанную нагрузку на API внутри процесса и выводит p50/p95/p99, RPS "
+        "и число SQL-запросов по точкам входа. Данные готовятся командой generate_dataset"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Общее число запросов')
+        parser.add_argument('--concurrency', type=int, default=1, help='Число параллельных потоков')
+        parser.add_argument('--users', type=int, default=20, help='Число пользователей из набора данных')
+        parser.add_argument('--prefix', default='bench', help='Префикс пользователей из generate_dataset')
+        parser.add_argument('--warmup', type=int, default=100, help='Число запросов прогрева, в отчёт не входят')
+        parser.add_argument('--mix', help='Доли операций в JSON, по умолчанию ' + json.dumps(DEFAULT_MIX))
+        parser.add_argument('--fake-redis', action='store_true', help='Использовать fakeredis вместо сервера Redis')
+        parser.add_argument('--json', action='store_true', help='Вывести отчёт в JSON')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        users = list(CustomUser.objects.filter(username__startswith=f"{options['prefix']}_")[:options['users']])
+        dish_ids = list(Dish.objects.values_list('id', flat=True))
+        restaurant_ids = list(Restaurant.objects.values_list('id', flat=True))
+        if not users or not dish_ids:
+            raise CommandError('Нет данных для нагрузки, сначала выполните generate_dataset')
+
+        names = Dish.objects.values_list('name', flat=True)[:1000]
+        search_terms = sorted({word[:4] for name in names for word in name.split() if len(word) > 3})
+        mix = json.loads(options['mix']) if options['mix'] else None
+        driver = WorkloadDriver(users, dish_ids, restaurant_ids, search_terms, mix=mix, seed=options['seed'])
+
+        with fake_redis() if options['fake_redis'] else nullcontext():
+            if options['warmup']:
+                driver.run(options['warmup'], options['concurrency'])
+            report = driver.run(options['requests'], options['concurrency']).report()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(format_report(report))
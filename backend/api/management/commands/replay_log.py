@@ -0,0 +1,53 @@
+import json
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import LogReplayer, ReplayError, fake_redis, format_report, iter_log
+
+
+class Command(BaseCommand):
+    help = (
+        "Воспроизводит журнал запросов в формате JSONL против API внутри процесса и выводит "
+        "распределение задержек и долю ошибок по точкам входа. Журнал читается построчно"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к журналу .jsonl или .jsonl.gz')
+        parser.add_argument('--concurrency', type=int, default=1, help='Число параллельных потоков')
+        parser.add_argument('--speed', type=float, default=0.0,
+                            help='0 - как можно быстрее, 1 - с записанными интервалами, 2 - вдвое быстрее')
+        parser.add_argument('--user', help='Пользователь для записей без поля user')
+        parser.add_argument('--limit', type=int, help='Воспроизвести не больше указанного числа запросов')
+        parser.add_argument('--sample-size', type=int, default=10000,
+                            help='Размер выборки задержек на точку входа для расчёта перцентилей')
+        parser.add_argument('--max-clients', type=int, default=1000,
+                            help='Сколько авторизованных клиентов пользователей держит каждый поток')
+        parser.add_argument('--fake-redis', action='store_true', help='Использовать fakeredis вместо сервера Redis')
+        parser.add_argument('--json', action='store_true', help='Вывести отчёт в JSON')
+
+    def handle(self, *args, **options):
+        replayer = LogReplayer(
+            concurrency=options['concurrency'],
+            speed=options['speed'],
+            default_user=options['user'],
+            sample_size=options['sample_size'],
+            max_clients=options['max_clients'],
+        )
+        try:
+            with fake_redis() if options['fake_redis'] else nullcontext():
+                report = replayer.run(iter_log(options['path']), limit=options['limit']).report()
+        except OSError as e:
+            raise CommandError(f'Не удалось прочитать журнал: {e}')
+        except ReplayError as e:
+            raise CommandError(str(e))
+
+        if not report['total']['requests']:
+            raise CommandError(f'В журнале нет запросов для воспроизведения (пропущено строк: {replayer.skipped})')
+
+        report['skipped'] = replayer.skipped
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(format_report(report))
+            self.stdout.write(f'skipped lines: {replayer.skipped}')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from redis import RedisError
+
+from api.menu import get_menus
+from config.redis import get_redis_client
+from core.models import Dish, Restaurant
+from core.services.cart import CartPricing, CartStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверяет доступность базы и Redis и прогревает кэши меню ресторанов, множество ID блюд "
+        "и каталог цен перед приёмом трафика. Завершается с ошибкой, если база или Redis недоступны"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Сколько ресторанов и блюд прогревать за раз')
+
+    def handle(self, *args, **options):
+        client = get_redis_client()
+        try:
+            connection.ensure_connection()
+            client.ping()
+        except (DatabaseError, RedisError) as e:
+            raise CommandError(f'Сервис не готов к приёму трафика: {e}')
+
+        chunk_size = options['chunk_size']
+        try:
+            CartStore(client).warm_dish_ids()
+
+            pricing = CartPricing(client)
+            dish_ids = list(Dish.objects.order_by('id').values_list('id', flat=True))
+            for start in range(0, len(dish_ids), chunk_size):
+                pricing.resolve_dishes(dish_ids[start:start + chunk_size])
+
+            restaurant_ids = list(Restaurant.objects.order_by('id').values_list('id', flat=True))
+            for start in range(0, len(restaurant_ids), chunk_size):
+                get_menus(restaurant_ids[start:start + chunk_size])
+        except RedisError as e:
+            raise CommandError(f'Не удалось прогреть кэши: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Кэши прогреты: ресторанов {len(restaurant_ids)}, блюд {len(dish_ids)}'
+        ))
@@ -0,0 +1,167 @@
+"""
+Кэш меню ресторанов: для каждого ресторана хранится готовый JSON-фрагмент ответа,
+страница списка ресторанов собирается из фрагментов, из базы читаются только ключи страницы.
+Фрагменты строятся по основной базе, даже если ключи страницы прочитаны из реплики: иначе отстающее
+от записи меню попало бы в кэш на MENU_CACHE_TTL после того, как refresh_menu уже его обновил.
+
+Пока Redis кэша недоступен, фрагменты хранятся в локальном кэше процесса local_menus
+"""
+
+import logging
+import sys
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis.exceptions import ConnectionInterrupted
+from redis import RedisError
+from rest_framework.renderers import JSONRenderer
+
+from config.db_router import read_from_primary
+from config.local_cache import LocalCache
+from config.redis import CircuitOpenError
+from core.models import Restaurant
+from .serializers import RestaurantSerializer
+
+logger = logging.getLogger(__name__)
+
+# django-redis оборачивает ошибки соединения в ConnectionInterrupted
+CACHE_ERRORS = (ConnectionInterrupted, RedisError)
+
+local_menus = LocalCache(settings.MENU_LOCAL_CACHE_SIZE, settings.MENU_LOCAL_CACHE_TTL)
+
+
+def menu_key(restaurant_id: int) -> str:
+    return f'menu:restaurant:{restaurant_id}'
+
+
+def render_menu(restaurant: Restaurant) -> str:
+    return JSONRenderer().render(RestaurantSerializer(restaurant).data).decode()
+
+
+def log_cache_error(message: str, *args) -> None:
+    """
+    Пишет в журнал ошибку Redis кэша, кроме отказов разомкнутой цепи: при них Redis не вызывался,
+    и журнал не засоряется одной и той же ошибкой на каждом запросе
+    """
+    exc = sys.exc_info()[1]
+    if not isinstance(exc, CircuitOpenError) and not isinstance(exc.__cause__, CircuitOpenError):
+        logger.warning(message, *args, exc_info=True)
+
+
+def read_cache(keys: list[str]) -> tuple[dict, bool]:
+    """
+    Читает значения из кэша Django, а если Redis кэша недоступен - из локального кэша процесса
+    :return: найденные значения и признак доступности Redis кэша
+    """
+    try:
+        return cache.get_many(keys), True
+    except CACHE_ERRORS:
+        log_cache_error('Redis кэша недоступен, меню берётся из локального кэша')
+    return local_values(keys), False
+
+
+def write_cache(values: dict, available: bool) -> None:
+    """
+    Сохраняет значения на MENU_CACHE_TTL секунд в кэш Django или, если Redis кэша недоступен, в локальный кэш
+    процесса. Срок жизни ограничивает устаревание меню, сброс которого не дошёл до недоступного Redis кэша
+    """
+    if available:
+        try:
+            cache.set_many(values, settings.MENU_CACHE_TTL)
+            return
+        except CACHE_ERRORS:
+            log_cache_error('Не удалось сохранить меню в Redis кэша')
+    for key, value in values.items():
+        local_menus.set(key, value)
+
+
+async def aread_cache(keys: list[str]) -> tuple[dict, bool]:
+    try:
+        return await cache.aget_many(keys), True
+    except CACHE_ERRORS:
+        log_cache_error('Redis кэша недоступен, меню берётся из локального кэша')
+    return local_values(keys), False
+
+
+async def awrite_cache(values: dict, available: bool) -> None:
+    if available:
+        try:
+            await cache.aset_many(values, settings.MENU_CACHE_TTL)
+            return
+        except CACHE_ERRORS:
+            log_cache_error('Не удалось сохранить меню в Redis кэша')
+    for key, value in values.items():
+        local_menus.set(key, value)
+
+
+def local_values(keys: list[str]) -> dict:
+    values = {key: local_menus.get(key) for key in keys}
+    return {key: value for key, value in values.items() if value is not None}
+
+
+def get_menus(restaurant_ids: list[int]) -> list[str]:
+    """
+    Возвращает JSON-фрагменты меню ресторанов в порядке restaurant_ids,
+    недостающие в кэше фрагменты строятся двумя запросами и сохраняются
+    """
+    keys = {restaurant_id: menu_key(restaurant_id) for restaurant_id in restaurant_ids}
+    cached, available = read_cache(list(keys.values()))
+
+    missing = [restaurant_id for restaurant_id, key in keys.items() if key not in cached]
+    if missing:
+        with read_from_primary():
+            built = {
+                menu_key(restaurant.id): render_menu(restaurant)
+                for restaurant in Restaurant.objects.filter(id__in=missing).prefetch_related('dishes')
+            }
+        write_cache(built, available)
+        cached.update(built)
+
+    return [cached[key] for key in keys.values() if key in cached]
+
+
+async def aget_menus(restaurant_ids: list[int]) -> list[str]:
+    """
+    Асинхронный вариант get_menus, недостающие фрагменты строятся через асинхронный ORM
+    """
+    keys = {restaurant_id: menu_key(restaurant_id) for restaurant_id in restaurant_ids}
+    cached, available = await aread_cache(list(keys.values()))
+
+    missing = [restaurant_id for restaurant_id, key in keys.items() if key not in cached]
+    if missing:
+        queryset = Restaurant.objects.filter(id__in=missing).prefetch_related('dishes')
+        with read_from_primary():
+            built = {menu_key(restaurant.id): render_menu(restaurant) async for restaurant in queryset}
+        await awrite_cache(built, available)
+        cached.update(built)
+
+    return [cached[key] for key in keys.values() if key in cached]
+
+
+def refresh_menu(restaurant_id: int) -> None:
+    """
+    Перестраивает фрагмент меню одного ресторана, удалённый ресторан убирается из кэша
+    """
+    with read_from_primary():
+        restaurant = Restaurant.objects.filter(id=restaurant_id).prefetch_related('dishes').first()
+    if restaurant is None:
+        drop_menu(restaurant_id)
+        return
+    local_menus.delete(menu_key(restaurant_id))
+    try:
+        cache.set(menu_key(restaurant_id), render_menu(restaurant), settings.MENU_CACHE_TTL)
+    except CACHE_ERRORS:
+        log_cache_error('Не удалось обновить меню ресторана %s в Redis кэша', restaurant_id)
+
+
+def drop_menu(restaurant_id: int) -> None:
+    """
+    Сбрасывает фрагмент меню ресторана в кэше Django и в локальном кэше процесса,
+    ошибки Redis не должны ломать сохранение ресторана или блюда
+    """
+    key = menu_key(restaurant_id)
+    local_menus.delete(key)
+    try:
+        cache.delete(key)
+    except CACHE_ERRORS:
+        log_cache_error('Не удалось сбросить меню ресторана %s в Redis кэша', restaurant_id)
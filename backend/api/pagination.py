@@ -0,0 +1,115 @@
+"""
+Keyset-пагинация (по курсору) по паре (created_at, id)
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Callable
+
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Страница выбирается условием WHERE (created_at, id) > (курсор) и LIMIT, а не OFFSET,
+    поэтому стоимость запроса не растёт с номером страницы
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    descending = False
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.request = None
+        self.next_key = None
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, key: tuple[datetime, int]) -> str:
+        created_at, pk = key
+        raw = json.dumps([created_at.isoformat(), pk]).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, request) -> tuple[datetime, int] | None:
+        encoded = request.GET.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def page_queryset(self, queryset: QuerySet, request) -> QuerySet:
+        """
+        Записи после курсора в порядке ключа, с одной лишней записью: она показывает, есть ли следующая страница
+        """
+        self.request = request
+        cursor = self.decode_cursor(request)
+
+        if cursor is not None:
+            created_at, pk = cursor
+            if self.descending:
+                condition = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            else:
+                condition = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            queryset = queryset.filter(condition)
+
+        ordering = ('-created_at', '-id') if self.descending else ('created_at', 'id')
+        return queryset.order_by(*ordering)[:self.get_page_size(request) + 1]
+
+    def split_page(self, rows: list, key: Callable) -> list:
+        """
+        Отбрасывает лишнюю запись page_queryset и запоминает ключ последней записи страницы для ссылки на следующую
+        """
+        page_size = self.get_page_size(self.request)
+        page = rows[:page_size]
+        self.next_key = key(page[-1]) if len(rows) > page_size else None
+        return page
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None) -> list:
+        rows = list(self.page_queryset(queryset, request))
+        return self.split_page(rows, lambda row: (row.created_at, row.id))
+
+    def paginate_keys(self, queryset: QuerySet, request) -> list[tuple[datetime, int]]:
+        """
+        Страница ключей (created_at, id): при индексе по (created_at, id) запрос читает только индекс
+        """
+        return self.split_page(list(self.page_queryset(queryset.values_list('created_at', 'id'), request)), tuple)
+
+    async def apaginate_keys(self, queryset: QuerySet, request) -> list[tuple[datetime, int]]:
+        """
+        Асинхронный вариант paginate_keys
+        """
+        rows = [key async for key in self.page_queryset(queryset.values_list('created_at', 'id'), request)]
+        return self.split_page(rows, tuple)
+
+    def get_next_link(self) -> str | None:
+        if self.next_key is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_key))
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
+class RestaurantPagination(KeysetPagination):
+    page_size = 20
+
+
+class OrderPagination(KeysetPagination):
+    page_size = 10
+    descending = True
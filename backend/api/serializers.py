@@ -1,18 +1,32 @@
+from datetime import timedelta
+
+from django.utils import timezone
 from rest_framework import serializers
 from _decimal import Decimal
 
 
-from core.models import Dish, Restaurant, Order
+from config.metrics import serializer_timer
+from core.models import Dish, Restaurant, Order, RestaurantDailyStats, UserDailyStats
 from core.models.order_item import OrderItem
 
 
-class DishSerializer(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """
+    Учитывает время сериализации в метриках запроса (заголовок Server-Timing)
+    """
+
+    def to_representation(self, instance) -> dict:
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+class DishSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Dish
         fields = ['id', 'name', 'price']
 
 
-class RestaurantSerializer(serializers.ModelSerializer):
+class RestaurantSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     dishes = DishSerializer(many=True, read_only=True)
 
     class Meta:
@@ -20,19 +34,20 @@ class RestaurantSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'dishes']
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     price = serializers.SerializerMethodField()
+    name = serializers.CharField(source='dish_name', read_only=True)
 
     class Meta:
         model = OrderItem
-        fields = ['id', 'dish', 'price', 'quantity']
+        fields = ['id', 'dish', 'name', 'price', 'quantity']
 
     def get_price(self, obj: OrderItem) -> Decimal:
-        # Метод для вычисления цены товара как произведение цены блюда и его количества
-        return obj.quantity * obj.dish.price
+        # Метод для вычисления цены товара как произведение цены блюда на момент заказа и его количества
+        return obj.price
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
     time = serializers.SerializerMethodField()
@@ -42,8 +57,8 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'time', 'total_price', 'items']
 
     def get_total_price(self, obj: Order) -> Decimal:
-        # Метод для вычисления цены всего заказа как суммы цен всех позиций
-        return sum(item.quantity * item.dish.price for item in obj.items.all())
+        # Сумма заказа фиксируется при оформлении
+        return obj.total
 
     def get_time(self, obj: Order) -> int:
         return int(obj.created_at.timestamp())
@@ -52,13 +67,73 @@ class OrderSerializer(serializers.ModelSerializer):
 
 
 class AddOrDeleteToCartSerializer(serializers.Serializer):
-    dish_id = serializers.IntegerField()
+    # существование блюда проверяется скриптом корзины в Redis, без запроса к базе
+    dish_id = serializers.IntegerField(min_value=1)
     quantity = serializers.IntegerField(min_value=1, default=1)
 
-    def validate_dish_id(self, value: int) -> int:
-        # Метод провеляет существует ли данная позиция
-        if not Dish.objects.filter(id=value).exists():
-            raise serializers.ValidationError("Dish not found")
+
+class CartOperationSerializer(serializers.Serializer):
+    OPERATIONS = ('add', 'remove', 'set')
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    dish_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, attrs: dict) -> dict:
+        # нулевое количество допустимо только для set, оно удаляет позицию из корзины
+        if attrs['op'] != 'set' and attrs['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Ensure this value is greater than or equal to 1.'})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+    def validate_operations(self, value: list[dict]) -> list[dict]:
+        # Метод проверяет существование всех добавляемых блюд одним запросом,
+        # удалять из корзины можно и блюда, которых уже нет в базе
+        dish_ids = {
+            operation['dish_id'] for operation in value
+            if operation['op'] == 'add' or (operation['op'] == 'set' and operation['quantity'])
+        }
+        existing = set(Dish.objects.filter(id__in=dish_ids).values_list('id', flat=True))
+        missing = sorted(dish_ids - existing)
+        if missing:
+            raise serializers.ValidationError(f"Dish not found: {', '.join(map(str, missing))}")
         return value
 
 
+class StatsPeriodSerializer(serializers.Serializer):
+    """
+    Период статистики по дням, по умолчанию последние DEFAULT_DAYS дней включая сегодняшний
+    """
+    DEFAULT_DAYS = 30
+    MAX_DAYS = 366
+
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, attrs: dict) -> dict:
+        date_to = attrs.get('date_to') or timezone.localdate()
+        date_from = attrs.get('date_from') or date_to - timedelta(days=self.DEFAULT_DAYS - 1)
+        if date_from > date_to:
+            raise serializers.ValidationError({'date_from': 'Начало периода позже его окончания'})
+        if (date_to - date_from).days >= self.MAX_DAYS:
+            raise serializers.ValidationError({'date_from': f'Период не может быть длиннее {self.MAX_DAYS} дней'})
+        return {**attrs, 'date_from': date_from, 'date_to': date_to}
+
+
+class RestaurantStatsPeriodSerializer(StatsPeriodSerializer):
+    restaurant = serializers.IntegerField(min_value=1, required=False)
+
+
+class UserDailyStatsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = UserDailyStats
+        fields = ['day', 'orders_count', 'total']
+
+
+class RestaurantDailyStatsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = RestaurantDailyStats
+        fields = ['restaurant', 'day', 'orders_count', 'items_count', 'total']
@@ -0,0 +1,37 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Dish, Restaurant
+from .menu import drop_menu, refresh_menu
+
+
+def schedule_menu_refresh(restaurant_id: int) -> None:
+    """
+    Сразу сбрасывает фрагмент меню, а после фиксации транзакции строит его заново,
+    чтобы следующий запрос списка ресторанов не обращался к базе
+    """
+    drop_menu(restaurant_id)
+    transaction.on_commit(partial(refresh_menu, restaurant_id))
+
+
+@receiver(post_save, sender=Restaurant)
+def restaurant_saved(sender, instance: Restaurant, **kwargs) -> None:
+    schedule_menu_refresh(instance.id)
+
+
+@receiver(post_delete, sender=Restaurant)
+def restaurant_deleted(sender, instance: Restaurant, **kwargs) -> None:
+    schedule_menu_refresh(instance.id)
+
+
+@receiver(post_save, sender=Dish)
+@receiver(post_delete, sender=Dish)
+def dish_changed(sender, instance: Dish, **kwargs) -> None:
+    # прежний ресторан блюда запоминает core.signals.dish_saving
+    previous_id = getattr(instance, '_previous_restaurant_id', None)
+    if previous_id is not None and previous_id != instance.restaurant_id:
+        schedule_menu_refresh(previous_id)
+    schedule_menu_refresh(instance.restaurant_id)
@@ -1,13 +1,55 @@
+import json
+import os
+import tempfile
+import time
 from _decimal import Decimal
-from unittest.mock import patch
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import MagicMock, patch
 
+import fakeredis
+from asgiref.sync import async_to_sync
+from django_redis.exceptions import ConnectionInterrupted
+from redis import (
+    BlockingConnectionPool, ConnectionPool, ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError,
+)
 from rest_framework.test import APITestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from core.models import Restaurant, Dish, Order, OrderItem
+from config.db_router import ReplicaRouter, read_from_replica, replica_reads
+from config.middleware import latency_histogram
+from config.local_cache import LocalCache
+from config.redis import (
+    CircuitBreaker, CircuitOpenError, InstrumentedRedis, ResilientConnectionFactory, circuit_breaker,
+    create_connection_pool,
+)
+from api.benchmark import (
+    BenchmarkStats, LogReplayer, ReplayError, WorkloadDriver, fake_redis as fake_redis_server, iter_log,
+    parse_log_record, percentile,
+)
+from api.menu import aget_menus
+from api.views import OrderViewSet
+from core.models import CheckoutDebit, Restaurant, RestaurantDailyStats, Dish, Order, OrderItem, UserDailyStats
+from core.services.cart import CartPricing, CATALOG_KEY, PricedCart, DISH_IDS_KEY, priced_cart_key, sync_dish
+from core.services.checkout import OrderWriter, QueuedCheckout
 from users.models import CustomUser
 
 
+def fake_redis() -> fakeredis.FakeRedis:
+    """
+    Изолированный Redis в памяти с поддержкой Lua-скриптов
+    """
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+
 class AuthTests(APITestCase):
 
     def setUp(self):
@@ -38,6 +80,7 @@ class AuthTests(APITestCase):
 class RestaurantViewSetTest(APITestCase):
 
     def setUp(self):
+        cache.clear()
         self.user = CustomUser.objects.create_user(username='testuser', password='password123')
         # Создаем рестораны
         self.restaurant1 = Restaurant.objects.create(name="Restaurant 1")
@@ -67,9 +110,92 @@ class RestaurantViewSetTest(APITestCase):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 2)
-        self.assertEqual(response.data[0]['name'], 'Restaurant 1')
-        self.assertEqual(response.data[1]['name'], 'Restaurant 2')
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(response.json()['results'][0]['name'], 'Restaurant 1')
+        self.assertEqual(response.json()['results'][1]['name'], 'Restaurant 2')
+
+    def test_list_restaurants_from_menu_cache(self):
+        """
+        Проверяет, что повторный запрос списка ресторанов собирается из кэша, из базы читаются только ключи страницы.
+        """
+        url = reverse('restaurant-list')
+        self.client.force_authenticate(user=self.user)
+        first = self.client.get(url, format='json')
+        with self.assertNumQueries(1):
+            second = self.client.get(url, format='json')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(second.json()['results'][1]['dishes'][0], {'id': self.dish4.id, 'name': 'Burger', 'price': '8.00'})
+
+    def test_list_restaurants_reads_page_keys(self):
+        """
+        Проверяет, что из базы читаются только ключи запрошенной страницы, а не всех ресторанов.
+        """
+        url = reverse('restaurant-list')
+        self.client.force_authenticate(user=self.user)
+        self.client.get(url, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page_size': 1, 'restaurant_id': self.restaurant2.id}, format='json')
+        self.assertEqual(response.json()['results'][0]['name'], 'Restaurant 2')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('LIMIT 2', queries[0]['sql'])
+        self.assertIn(f'"core_restaurant"."id" = {self.restaurant2.id}', queries[0]['sql'])
+
+    @patch('core.signals.get_redis_client', new=fake_redis)
+    def test_menu_cache_refreshed_on_dish_change(self):
+        """
+        Проверяет перестроение меню ресторана при изменении блюда и добавлении ресторана.
+        """
+        url = reverse('restaurant-list')
+        self.client.force_authenticate(user=self.user)
+        self.client.get(url, format='json')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish4.price = Decimal("9.50")
+            self.dish4.save()
+            Restaurant.objects.create(name="Restaurant 3")
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertEqual(response.json()['results'][1]['dishes'][0]['price'], '9.50')
+
+    @patch('core.signals.get_redis_client', new=fake_redis)
+    def test_menu_cache_refreshed_on_dish_move(self):
+        """
+        Проверяет перестроение меню обоих ресторанов при переносе блюда в другой ресторан.
+        """
+        url = reverse('restaurant-list')
+        self.client.force_authenticate(user=self.user)
+        self.client.get(url, format='json')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish4.restaurant = self.restaurant1
+            self.dish4.save()
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
+        self.assertIn('Burger', [dish['name'] for dish in response.json()['results'][0]['dishes']])
+        self.assertNotIn('Burger', [dish['name'] for dish in response.json()['results'][1]['dishes']])
+
+    @override_settings(MENU_CACHE_TTL=60)
+    @patch('core.signals.get_redis_client', new=fake_redis)
+    def test_menu_missed_refresh_expires(self):
+        """
+        Проверяет, что меню, сброс которого не дошёл до недоступного Redis кэша, устаревает не дольше MENU_CACHE_TTL.
+        """
+        url = reverse('restaurant-list')
+        self.client.force_authenticate(user=self.user)
+        self.client.get(url, format='json')
+
+        broken = ConnectionInterrupted(connection=None)
+        with patch.object(cache, 'set', side_effect=broken), patch.object(cache, 'delete', side_effect=broken), \
+                self.assertLogs('api.menu', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            self.dish4.price = Decimal("9.50")
+            self.dish4.save()
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.json()['results'][1]['dishes'][0]['price'], '8.00')
+
+        with patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 61):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.json()['results'][1]['dishes'][0]['price'], '9.50')
 
     def test_filter_restaurants_by_dish_name(self):
         """
@@ -80,9 +206,51 @@ class RestaurantViewSetTest(APITestCase):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(len(response.data[0]['dishes']), 2)
-        self.assertEqual(response.data[0]['name'], 'Restaurant 1')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(len(response.data['results'][0]['dishes']), 2)
+        self.assertEqual(response.data['results'][0]['name'], 'Restaurant 1')
+
+    def test_filter_restaurants_by_dish_name_prefix_and_case(self):
+        """
+        Проверяет поиск по началу слова без учёта регистра, в том числе для кириллицы.
+        """
+        borsch = Dish.objects.create(name="Борщ украинский", price=Decimal("7.00"), restaurant=self.restaurant2)
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(f"{reverse('restaurant-list')}?dish_name=pIZ", format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results'][0]['dishes']), 2)
+
+        response = self.client.get(f"{reverse('restaurant-list')}?dish_name=борщ УКР", format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['name'], 'Restaurant 2')
+        self.assertEqual([dish['id'] for dish in response.data['results'][0]['dishes']], [borsch.id])
+
+    def test_filter_restaurants_by_dish_name_ranked(self):
+        """
+        Проверяет, что блюда в результатах поиска упорядочены по релевантности.
+        """
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(f"{reverse('restaurant-list')}?dish_name=Pizza", format='json')
+        self.assertEqual([dish['name'] for dish in response.data['results'][0]['dishes']], ['Pizza', 'Pizza Colcone'])
+
+    def test_filter_restaurants_by_dish_name_paginated(self):
+        """
+        Проверяет, что поиск не ограничен числом найденных блюд и следующие страницы не пустые.
+        """
+        restaurants = Restaurant.objects.bulk_create([Restaurant(name=f"Soup House {i}") for i in range(25)])
+        Dish.objects.bulk_create([
+            Dish(name=f"Soup {i}", price=Decimal("5.00"), restaurant=restaurant)
+            for restaurant in restaurants for i in range(10)
+        ])
+        self.client.force_authenticate(user=self.user)
+
+        first = self.client.get(f"{reverse('restaurant-list')}?dish_name=soup", format='json').json()
+        second = self.client.get(first['next'], format='json').json()
+        self.assertEqual(len(first['results']), 20)
+        self.assertEqual(len(second['results']), 5)
+        self.assertIsNone(second['next'])
+        self.assertTrue(all(len(restaurant['dishes']) == 10 for restaurant in second['results']))
 
     def test_filter_restaurants_by_restaurant_id(self):
         """
@@ -93,8 +261,8 @@ class RestaurantViewSetTest(APITestCase):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], 'Restaurant 2')
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(response.json()['results'][0]['name'], 'Restaurant 2')
 
     def test_filter_restaurants_by_dish_name_and_restaurant_id(self):
         """
@@ -105,8 +273,8 @@ class RestaurantViewSetTest(APITestCase):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], 'Restaurant 2')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Restaurant 2')
 
     def test_filter_restaurants_no_results(self):
         """
@@ -144,6 +312,32 @@ class RestaurantViewSetTest(APITestCase):
         self.assertEqual(response.status_code, 403)
         self.assertEqual(response.data['detail'], 'Указан не корректный ID ресторана')
 
+    def test_list_restaurants_pagination(self):
+        """
+        Проверяет постраничный обход ресторанов по курсору.
+        """
+        for i in range(3, 26):
+            Restaurant.objects.create(name=f"Restaurant {i}")
+        self.client.force_authenticate(user=self.user)
+
+        names = []
+        url = f"{reverse('restaurant-list')}?page_size=10"
+        while url:
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['results']), 10)
+            names.extend(restaurant['name'] for restaurant in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(names, [f"Restaurant {i}" for i in range(1, 26)])
+
+    def test_list_restaurants_invalid_cursor(self):
+        """
+        Проверяет ответ на некорректный курсор.
+        """
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(f"{reverse('restaurant-list')}?cursor=abc", format='json')
+        self.assertEqual(response.status_code, 404)
+
 
 class CartViewSetTest(APITestCase):
 
@@ -167,41 +361,76 @@ class CartViewSetTest(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, 403)
 
-    @patch('api.views.rd')
-    def test_add_dish_to_cart(self, mock_redis):
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_add_dish_to_cart(self, redis_client):
         """
         Проверка добавления блюда в корзину пользователя.
         """
-        mock_redis.hincrby.return_value = None
         url = reverse('cart-add')
         data = {'dish_id': self.dish.id, 'quantity': 1}
         self.client.force_authenticate(user=self.user)
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, 200)
-        mock_redis.hincrby.assert_called_with(f'cart:{self.user.id}', self.dish.id, 1)
+        self.assertEqual(redis_client.hget(f'cart:{self.user.id}', self.dish.id), b'1')
+        self.assertTrue(redis_client.sismember(DISH_IDS_KEY, self.dish.id))
 
-    @patch('api.views.rd')
-    def test_delete_dish_from_cart(self, mock_redis):
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_add_dish_to_cart_without_db_queries(self, redis_client):
+        """
+        Проверка, что при прогретом множестве ID блюд добавление в корзину не обращается к базе.
+        """
+        redis_client.sadd(DISH_IDS_KEY, self.dish.id)
+        url = reverse('cart-add')
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(0):
+            self.client.post(url, {'dish_id': self.dish.id, 'quantity': 2}, format='json')
+            response = self.client.post(url, {'dish_id': self.dish.id, 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(redis_client.hget(f'cart:{self.user.id}', self.dish.id), b'5')
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_add_unknown_dish_to_cart(self, redis_client):
+        """
+        Проверка добавления в корзину несуществующего блюда.
+        """
+        url = reverse('cart-add')
+        data = {'dish_id': self.dish.id + 100, 'quantity': 1}
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(redis_client.exists(f'cart:{self.user.id}'))
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_delete_dish_from_cart(self, redis_client):
         """
         Проверка удаления блюда из корзины пользователя.
         """
-        mock_redis.hget.return_value = b'2'
-        mock_redis.hdel.return_value = None
-        mock_redis.hincrby.return_value = None
+        redis_client.hset(f'cart:{self.user.id}', self.dish.id, 2)
 
         url = reverse('cart-delete')
         data = {'dish_id': self.dish.id, 'quantity': 1}
         self.client.force_authenticate(user=self.user)
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, 200)
-        mock_redis.hincrby.assert_called_with(f'cart:{self.user.id}', self.dish.id, -1)
+        self.assertEqual(redis_client.hget(f'cart:{self.user.id}', self.dish.id), b'1')
 
-    @patch('api.views.rd')
-    def test_list_cart(self, mock_redis):
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_delete_dish_missing_in_cart(self, redis_client):
+        """
+        Проверка удаления блюда, которого нет в корзине пользователя.
+        """
+        url = reverse('cart-delete')
+        data = {'dish_id': self.dish.id, 'quantity': 1}
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_list_cart(self, redis_client):
         """
         Проверка получения всех товаров в корзине пользователя и расчета общей стоимости.
         """
-        mock_redis.hgetall.return_value = {str(self.dish.id).encode(): b'2'}
+        redis_client.hset(f'cart:{self.user.id}', self.dish.id, 2)
 
         url = reverse('cart-list')
         self.client.force_authenticate(user=self.user)
@@ -212,20 +441,162 @@ class CartViewSetTest(APITestCase):
         self.assertEqual(response.data['positions'][0]['name'], 'Test Dish')
         self.assertEqual(response.data['positions'][0]['quantity'], 2)
 
-    @patch('api.views.rd')
-    def test_delete_dish_from_cart_remove_all(self, mock_redis):
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_list_cart_constant_queries(self, redis_client):
+        """
+        Проверка, что стоимость корзины рассчитывается одним запросом к базе независимо от числа позиций.
+        """
+        dishes = [
+            Dish.objects.create(name=f"Dish {i}", price=Decimal("1.50"), restaurant=self.restaurant)
+            for i in range(30)
+        ]
+        redis_client.hset(f'cart:{self.user.id}', mapping={dish.id: 2 for dish in dishes})
+
+        url = reverse('cart-list')
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_price'], Decimal('90.00'))
+        self.assertEqual(len(response.data['positions']), 30)
+        self.assertEqual(redis_client.hlen(CATALOG_KEY), 30)
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_list_cart_from_price_cache(self, redis_client):
+        """
+        Проверка, что при заполненном кэше цен корзина рассчитывается без обращения к базе.
+        """
+        redis_client.hset(f'cart:{self.user.id}', 100500, 3)
+        redis_client.hset(CATALOG_KEY, 100500, '{"name": "Cached Dish", "price": "5.00", "restaurant_id": 1}')
+
+        url = reverse('cart-list')
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_price'], Decimal('15.00'))
+        self.assertEqual(response.data['positions'][0]['name'], 'Cached Dish')
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_list_cart_reuses_price_snapshot(self, redis_client):
+        """
+        Проверка, что снимок цен корзины используется до изменения версии каталога
+        и не сбрасывается изменением количества блюд.
+        """
+        redis_client.hset(f'cart:{self.user.id}', self.dish.id, 2)
+        url = reverse('cart-list')
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(1):
+            self.client.get(url, format='json')
+        self.assertTrue(redis_client.exists(priced_cart_key(self.user.id)))
+
+        # цены берутся из снимка, а не из кэша каталога
+        redis_client.delete(CATALOG_KEY)
+        redis_client.hincrby(f'cart:{self.user.id}', self.dish.id, 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.data['total_price'], Decimal('30.00'))
+
+        Dish.objects.filter(pk=self.dish.pk).update(price=Decimal('4.00'))
+        sync_dish(redis_client, self.dish.id, True, [self.restaurant.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.data['total_price'], Decimal('12.00'))
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_price_snapshot_checks_cart_restaurants_only(self, redis_client):
+        """
+        Проверка, что изменение блюд другого ресторана не сбрасывает снимок цен корзины,
+        а перенос блюда из ресторана корзины сбрасывает.
+        """
+        other_restaurant = Restaurant.objects.create(name='Other Restaurant')
+        other_dish = Dish.objects.create(name='Other Dish', price=Decimal('3.00'), restaurant=other_restaurant)
+        redis_client.hset(f'cart:{self.user.id}', self.dish.id, 2)
+        url = reverse('cart-list')
+        self.client.force_authenticate(user=self.user)
+        self.client.get(url, format='json')
+
+        redis_client.delete(CATALOG_KEY)
+        sync_dish(redis_client, other_dish.id, True, [other_restaurant.id])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.data['total_price'], Decimal('20.00'))
+
+        # цена изменилась вместе с переносом: сбрасываются снимки обоих ресторанов
+        Dish.objects.filter(pk=self.dish.pk).update(price=Decimal('4.00'), restaurant=other_restaurant)
+        sync_dish(redis_client, self.dish.id, True, [other_restaurant.id, self.restaurant.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.data['total_price'], Decimal('8.00'))
+
+    def test_stale_price_not_cached(self):
+        """
+        Проверка, что цена, прочитанная из базы до изменения блюда, не попадает в кэш каталога.
+        """
+        redis_client = fake_redis()
+        sync_dish(redis_client, self.dish.id, True, [self.restaurant.id])
+        dishes = CartPricing(redis_client).resolve_dishes([self.dish.id], version=0)
+        self.assertEqual(dishes[self.dish.id].price, Decimal('10.00'))
+        self.assertFalse(redis_client.hexists(CATALOG_KEY, self.dish.id))
+
+        CartPricing(redis_client).resolve_dishes([self.dish.id])
+        self.assertTrue(redis_client.hexists(CATALOG_KEY, self.dish.id))
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_delete_dish_from_cart_remove_all(self, redis_client):
         """
         Проверка удаления блюда из корзины пользователя, когда количество удаляемого блюда равно количеству в корзине.
         """
-        mock_redis.hget.return_value = b'2'
-        mock_redis.hdel.return_value = None
+        redis_client.hset(f'cart:{self.user.id}', self.dish.id, 2)
 
         url = reverse('cart-delete')
         data = {'dish_id': self.dish.id, 'quantity': 2}
         self.client.force_authenticate(user=self.user)
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, 200)
-        mock_redis.hdel.assert_called_with(f'cart:{self.user.id}', self.dish.id)
+        self.assertFalse(redis_client.hexists(f'cart:{self.user.id}', self.dish.id))
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_batch_cart_operations(self, redis_client):
+        """
+        Проверка применения набора операций к корзине одним запросом.
+        """
+        other_dish = Dish.objects.create(name="Other Dish", price=Decimal("5.00"), restaurant=self.restaurant)
+        redis_client.hset(f'cart:{self.user.id}', mapping={self.dish.id: 3, 999: 1})
+
+        url = reverse('cart-batch')
+        data = {'operations': [
+            {'op': 'add', 'dish_id': other_dish.id, 'quantity': 2},
+            {'op': 'add', 'dish_id': other_dish.id},
+            {'op': 'remove', 'dish_id': self.dish.id, 'quantity': 1},
+            {'op': 'set', 'dish_id': 999, 'quantity': 0},
+        ]}
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(1):
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {item['dish_id']: item['quantity'] for item in response.data['positions']},
+            {self.dish.id: 2, other_dish.id: 3},
+        )
+        self.assertEqual(redis_client.hgetall(f'cart:{self.user.id}'),
+                         {str(self.dish.id).encode(): b'2', str(other_dish.id).encode(): b'3'})
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_batch_cart_unknown_dish(self, redis_client):
+        """
+        Проверка, что при неизвестном блюде не применяется ни одна операция пакета.
+        """
+        url = reverse('cart-batch')
+        data = {'operations': [
+            {'op': 'add', 'dish_id': self.dish.id, 'quantity': 1},
+            {'op': 'set', 'dish_id': self.dish.id + 100, 'quantity': 2},
+        ]}
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('operations', response.data)
+        self.assertFalse(redis_client.exists(f'cart:{self.user.id}'))
 
 
 class OrderViewSetTest(APITestCase):
@@ -241,13 +612,12 @@ class OrderViewSetTest(APITestCase):
         self.dish2 = Dish.objects.create(name="Test Dish 2", price=Decimal("20.00"), restaurant=self.restaurant)
         self.client.force_authenticate(user=self.user)
 
-    @patch('api.views.rd')
-    def test_create_order(self, mock_redis):
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_create_order(self, redis_client):
         """
         Проверка создания заказа и списания средств с баланса пользователя.
         """
-        mock_redis.hgetall.return_value = {str(self.dish1.id).encode(): b'2', str(self.dish2.id).encode(): b'1'}
-        mock_redis.delete.return_value = None
+        redis_client.hset(f'cart:{self.user.id}', mapping={self.dish1.id: 2, self.dish2.id: 1})
 
         url = reverse('order-list')
         response = self.client.post(url, format='json')
@@ -259,13 +629,69 @@ class OrderViewSetTest(APITestCase):
         order = Order.objects.get(user=self.user)
         self.assertEqual(order.items.count(), 2)
 
-    @patch('api.views.rd')
-    def test_create_order_insufficient_funds(self, mock_redis):
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_create_order_constant_queries(self, redis_client):
+        """
+        Проверка, что число запросов при оформлении заказа не зависит от количества позиций в корзине.
+        """
+        dishes = [
+            Dish.objects.create(name=f"Dish {i}", price=Decimal("1.00"), restaurant=self.restaurant)
+            for i in range(30)
+        ]
+        redis_client.hset(f'cart:{self.user.id}', mapping={dish.id: 1 for dish in dishes})
+
+        url = reverse('order-list')
+        # выборка цен (кэш каталога пуст), savepoint, заказ, позиции одним INSERT,
+        # агрегаты пользователя и ресторанов, списание баланса, release savepoint
+        with self.assertNumQueries(8):
+            response = self.client.post(url, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.items.count(), 30)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal("70.00"))
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_create_order_from_price_snapshot(self, redis_client):
+        """
+        Проверка, что после просмотра корзины оформление заказа не читает цены из базы.
+        """
+        redis_client.hset(f'cart:{self.user.id}', mapping={self.dish1.id: 2, self.dish2.id: 1})
+        self.client.get(reverse('cart-list'), format='json')
+
+        # savepoint, заказ, позиции одним INSERT, агрегаты пользователя и ресторанов, списание баланса,
+        # release savepoint
+        with self.assertNumQueries(7):
+            response = self.client.post(reverse('order-list'), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get(user=self.user).total, Decimal('40.00'))
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_order_history_keeps_checkout_prices(self, redis_client):
+        """
+        Проверка, что изменение цены и названия блюда не меняет историю заказов.
+        """
+        redis_client.hset(f'cart:{self.user.id}', self.dish1.id, 3)
+        url = reverse('order-list')
+        self.client.post(url, format='json')
+
+        self.dish1.price = Decimal("99.00")
+        self.dish1.name = "Renamed Dish"
+        self.dish1.save()
+
+        response = self.client.get(url, format='json')
+        order = response.data['last_orders'][0]
+        self.assertEqual(order['total_price'], Decimal('30.00'))
+        self.assertEqual(order['items'][0]['price'], Decimal('30.00'))
+        self.assertEqual(order['items'][0]['name'], 'Test Dish 1')
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_create_order_insufficient_funds(self, redis_client):
         """
         Проверка создания заказа при недостатке средств на балансе пользователя.
         """
-        mock_redis.hgetall.return_value = {str(self.dish1.id).encode(): b'10'}  # Total price = 100.00
-        mock_redis.delete.return_value = None
+        redis_client.hset(f'cart:{self.user.id}', self.dish1.id, 10)  # Total price = 100.00
 
         self.user.balance = Decimal("50.00")
         self.user.save()
@@ -275,13 +701,36 @@ class OrderViewSetTest(APITestCase):
         self.assertEqual(response.status_code, 500)
         self.assertIn('error', response.data)
         self.assertEqual(response.data['error'], 'Сумма списания превышает средства на балансе')
+        self.assertFalse(Order.objects.filter(user=self.user).exists())
+        self.assertTrue(redis_client.exists(f'cart:{self.user.id}'))
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_create_order_infrastructure_errors(self, redis_client):
+        """
+        Проверка, что ошибки базы и Redis при оформлении не отдают клиенту текст исключения.
+        """
+        redis_client.hset(f'cart:{self.user.id}', self.dish1.id, 1)
+        url = reverse('order-list')
+        with patch('api.views.record_orders', side_effect=OperationalError('no such table: secret_table')), \
+                self.assertLogs('api.exceptions', level='ERROR'):
+            response = self.client.post(url, format='json')
+        self.assertEqual(response.status_code, 500)
+        self.assertNotIn('secret_table', str(response.data))
+        self.assertFalse(Order.objects.exists())
+
+        with patch('api.views.CartPricing.price_cart', side_effect=RedisConnectionError('redis://:password@host')), \
+                self.assertLogs('api.exceptions', level='WARNING'):
+            response = self.client.post(url, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertNotIn('password', str(response.data))
 
     @patch('api.views.rd')
     def test_list_orders(self, mock_redis):
         """
         Проверка получения последних 10 заказов пользователя и расчета общей стоимости.
         """
-        order = Order.objects.create(user=self.user)
+        order = Order.objects.create(user=self.user, total=Decimal('20.00'))
         OrderItem.objects.create(order=order, dish=self.dish1, quantity=2)
 
         url = reverse('order-list')
@@ -290,16 +739,830 @@ class OrderViewSetTest(APITestCase):
         self.assertEqual(response.data['total_count'], 1)
         self.assertEqual(response.data['total_sum'], 20.00)
         self.assertEqual(len(response.data['last_orders']), 1)
+        self.assertIsNone(response.data['next'])
+
+    @patch('api.views.rd')
+    def test_list_orders_constant_queries(self, mock_redis):
+        """
+        Проверка, что история заказов читается двумя запросами без соединения с блюдами
+        независимо от числа заказов и позиций.
+        """
+        for _ in range(10):
+            order = Order.objects.create(user=self.user, total=Decimal('40.00'))
+            OrderItem.objects.create(order=order, dish=self.dish1, quantity=2)
+            OrderItem.objects.create(order=order, dish=self.dish2, quantity=1)
+
+        url = reverse('order-list')
+        # страница заказов и все их позиции
+        with self.assertNumQueries(2) as context:
+            response = self.client.get(url, format='json')
+        self.assertFalse(any('core_dish' in query['sql'] for query in context.captured_queries))
+        self.assertEqual(response.data['total_count'], 10)
+        self.assertEqual(response.data['total_sum'], Decimal('400.00'))
+        self.assertEqual(response.data['last_orders'][0]['total_price'], Decimal('40.00'))
+        self.assertEqual({item['price'] for item in response.data['last_orders'][0]['items']},
+                         {Decimal('20.00')})
 
     @patch('api.views.rd')
-    def test_create_order_no_items_in_cart(self, mock_redis):
+    def test_list_orders_pagination(self, mock_redis):
+        """
+        Проверка постраничного получения истории заказов от новых к старым.
+        """
+        orders = [Order.objects.create(user=self.user) for _ in range(12)]
+        for order in orders:
+            OrderItem.objects.create(order=order, dish=self.dish1, quantity=1)
+
+        response = self.client.get(reverse('order-list'), format='json')
+        self.assertEqual(response.data['total_count'], 10)
+        first_page = [order['id'] for order in response.data['last_orders']]
+        self.assertEqual(first_page, [order.id for order in reversed(orders)][:10])
+
+        response = self.client.get(response.data['next'], format='json')
+        self.assertEqual([order['id'] for order in response.data['last_orders']], [orders[1].id, orders[0].id])
+        self.assertIsNone(response.data['next'])
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_create_order_no_items_in_cart(self, redis_client):
         """
         Проверка создания заказа, когда в корзине пользователя нет товаров.
         """
-        mock_redis.hgetall.return_value = {}
 
         url = reverse('order-list')
         response = self.client.post(url, format='json')
         self.assertEqual(response.status_code, 500)
         self.assertIn('error', response.data)
         self.assertEqual(response.data['error'], 'Нет позиций в корзине для создания заказа')
+
+
+class OrderStatsApiTest(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123',
+                                                   balance=Decimal('100.00'))
+        self.admin = CustomUser.objects.create_superuser(username='admin', password='password123')
+        self.restaurant = Restaurant.objects.create(name="Test Restaurant")
+        self.dish = Dish.objects.create(name="Test Dish", price=Decimal("10.00"), restaurant=self.restaurant)
+        self.client.force_authenticate(user=self.user)
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_user_stats_updated_at_checkout(self, redis_client):
+        for quantity in (2, 1):
+            redis_client.hset(f'cart:{self.user.id}', self.dish.id, quantity)
+            self.client.post(reverse('order-list'), format='json')
+
+        # статистика читается одним запросом к дневным агрегатам
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('order-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['orders_count'], 2)
+        self.assertEqual(response.data['total'], Decimal('30.00'))
+        self.assertEqual(response.data['days'], [
+            {'day': timezone.localdate().isoformat(), 'orders_count': 2, 'total': '30.00'},
+        ])
+
+        yesterday = timezone.localdate() - timedelta(days=1)
+        response = self.client.get(reverse('order-stats'), {'date_to': yesterday.isoformat()})
+        self.assertEqual(response.data['orders_count'], 0)
+        self.assertEqual(response.data['date_to'], yesterday.isoformat())
+
+    def test_invalid_period(self):
+        response = self.client.get(reverse('order-stats'), {'date_from': '2026-02-01', 'date_to': '2026-01-01'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('order-stats'), {'date_from': '2024-01-01', 'date_to': '2026-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('api.views.rd', new_callable=fake_redis)
+    def test_restaurant_stats_for_admin(self, redis_client):
+        other = Restaurant.objects.create(name="Other Restaurant")
+        other_dish = Dish.objects.create(name="Other Dish", price=Decimal("5.00"), restaurant=other)
+        redis_client.hset(f'cart:{self.user.id}', mapping={self.dish.id: 3, other_dish.id: 2})
+        self.client.post(reverse('order-list'), format='json')
+
+        self.assertEqual(self.client.get(reverse('restaurant-stats')).status_code, 403)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(reverse('restaurant-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['restaurants'], [
+            {'restaurant': self.restaurant.id, 'orders_count': 1, 'items_count': 3, 'total': Decimal('30.00')},
+            {'restaurant': other.id, 'orders_count': 1, 'items_count': 2, 'total': Decimal('10.00')},
+        ])
+
+        response = self.client.get(reverse('restaurant-stats'), {'restaurant': other.id})
+        self.assertEqual([day['restaurant'] for day in response.data['days']], [other.id])
+
+
+@override_settings(CHECKOUT_MODE='queue')
+class QueuedCheckoutTest(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123',
+                                                   balance=Decimal('100.00'))
+        self.restaurant = Restaurant.objects.create(name="Test Restaurant")
+        self.dish1 = Dish.objects.create(name="Test Dish 1", price=Decimal("10.00"), restaurant=self.restaurant)
+        self.dish2 = Dish.objects.create(name="Test Dish 2", price=Decimal("20.00"), restaurant=self.restaurant)
+        self.redis = fake_redis()
+        patcher = patch('api.views.rd', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.writer = OrderWriter(self.redis, 'test')
+        self.writer.ensure_group()
+        self.client.force_authenticate(user=self.user)
+
+    def test_checkout_is_queued_and_written_by_worker(self):
+        self.redis.hset(f'cart:{self.user.id}', mapping={self.dish1.id: 2, self.dish2.id: 1})
+
+        # чтение блюд, списание вместе с записью CheckoutDebit в точке сохранения
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse('order-list'), format='json')
+        self.assertEqual(response.status_code, 202)
+        reference = response.data['order']
+
+        # средства списаны и корзина очищена до записи заказа в базу
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('60.00'))
+        self.assertFalse(self.redis.exists(f'cart:{self.user.id}'))
+        self.assertFalse(Order.objects.exists())
+        response = self.client.get(reverse('order-order-status', args=[reference]))
+        self.assertEqual(response.data['status'], 'pending')
+
+        self.assertEqual(self.writer.process(), 1)
+        order = Order.objects.get()
+        self.assertEqual(order.total, Decimal('40.00'))
+        self.assertEqual(order.items.count(), 2)
+        response = self.client.get(reverse('order-order-status', args=[reference]))
+        self.assertEqual(response.data, {'order': reference, 'status': 'done', 'order_id': order.id})
+
+    def test_checkout_insufficient_funds_restores_cart(self):
+        self.redis.hset(f'cart:{self.user.id}', mapping={self.dish2.id: 6})
+
+        response = self.client.post(reverse('order-list'), format='json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data['error'], 'Сумма списания превышает средства на балансе')
+        self.assertEqual(self.redis.hgetall(f'cart:{self.user.id}'), {str(self.dish2.id).encode(): b'6'})
+        self.assertEqual(self.redis.xlen('orders:stream'), 0)
+
+    def test_checkout_empty_cart(self):
+        response = self.client.post(reverse('order-list'), format='json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data['error'], 'Нет позиций в корзине для создания заказа')
+
+    def assert_rolled_back(self):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('100.00'))
+        self.assertEqual(self.redis.hgetall(f'cart:{self.user.id}'), {str(self.dish1.id).encode(): b'2'})
+        self.assertEqual(self.redis.keys('cart:reserved:*'), [])
+        self.assertEqual(self.redis.zcard('checkout:pending'), 0)
+        self.assertEqual(self.redis.xlen('orders:stream'), 0)
+        self.assertFalse(CheckoutDebit.objects.exists())
+
+    def test_checkout_errors_roll_back(self):
+        failures = {
+            'pricing': patch('core.services.checkout.CartPricing.price_quantities',
+                             side_effect=RedisTimeoutError('Timeout reading from socket')),
+            'debit': patch('users.models.CustomUser.debit_balance',
+                           side_effect=OperationalError('database is locked')),
+            'enqueue': patch('core.services.checkout.QueuedCheckout.enqueue',
+                             side_effect=RedisConnectionError('Connection reset by peer')),
+        }
+        # ошибка Redis - 503, ошибка базы - 500, текст исключения клиенту не отдаётся
+        expected = {'pricing': 503, 'debit': 500, 'enqueue': 503}
+        for step, failure in failures.items():
+            with self.subTest(step=step):
+                self.redis.hset(f'cart:{self.user.id}', self.dish1.id, 2)
+                with failure, self.assertLogs('api.exceptions', level='WARNING'):
+                    response = self.client.post(reverse('order-list'), format='json')
+                self.assertEqual(response.status_code, expected[step])
+                self.assertNotIn('locked', response.data['detail'])
+                self.assert_rolled_back()
+                self.redis.delete(f'cart:{self.user.id}')
+
+    def test_enqueued_despite_error_not_written(self):
+        # заказ поставлен в поток, но ответ Redis потерян: средства возвращены, обработчик заказ не записывает
+        enqueue = QueuedCheckout.enqueue
+
+        def enqueue_and_fail(*args):
+            enqueue(*args)
+            raise RedisTimeoutError('Timeout reading from socket')
+
+        self.redis.hset(f'cart:{self.user.id}', self.dish1.id, 2)
+        with patch('core.services.checkout.QueuedCheckout.enqueue', autospec=True, side_effect=enqueue_and_fail), \
+                self.assertLogs('api.exceptions', level='WARNING'):
+            response = self.client.post(reverse('order-list'), format='json')
+        self.assertEqual(response.status_code, 503)
+
+        self.assertEqual(self.writer.process(), 1)
+        self.assertFalse(Order.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('100.00'))
+
+    def test_interrupted_checkout_reconciled(self):
+        # процесс упал после списания: ни возврат, ни постановка в очередь не выполнены
+        self.redis.hset(f'cart:{self.user.id}', self.dish1.id, 2)
+        with patch('core.services.checkout.QueuedCheckout.enqueue', side_effect=RedisConnectionError), \
+                patch('core.services.checkout.QueuedCheckout.cancel', return_value=False), \
+                self.assertLogs('api.exceptions', level='WARNING'):
+            self.client.post(reverse('order-list'), format='json')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('80.00'))
+        self.assertTrue(self.redis.ttl(self.redis.keys('cart:reserved:*')[0]) > 0)
+
+        reference = self.redis.zrange('checkout:pending', 0, -1)[0].decode().split(':')[1]
+        checkout = QueuedCheckout(self.redis)
+        self.assertEqual(checkout.reconcile(max_age=60), 0)
+        self.assertEqual(checkout.reconcile(max_age=0), 1)
+        self.assert_rolled_back()
+        response = self.client.get(reverse('order-order-status', args=[reference]))
+        self.assertEqual(response.data['status'], 'failed')
+
+    def test_reconcile_retries_failed_refund(self):
+        self.redis.hset(f'cart:{self.user.id}', self.dish1.id, 2)
+        with patch('core.services.checkout.QueuedCheckout.enqueue', side_effect=RedisConnectionError), \
+                patch('core.services.checkout.refund_balance', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('core.services.checkout', level='WARNING'):
+            self.client.post(reverse('order-list'), format='json')
+            # база недоступна и при проходе сверки: оформление остаётся незавершённым
+            self.assertEqual(QueuedCheckout(self.redis).reconcile(max_age=0), 0)
+        self.assertEqual(self.redis.zcard('checkout:pending'), 1)
+
+        self.assertEqual(QueuedCheckout(self.redis).reconcile(max_age=0), 1)
+        self.assert_rolled_back()
+
+    def test_order_status_of_other_user(self):
+        self.redis.hset(f'cart:{self.user.id}', mapping={self.dish1.id: 1})
+        reference = self.client.post(reverse('order-list'), format='json').data['order']
+
+        other = CustomUser.objects.create_user(username='other', password='password123')
+        self.client.force_authenticate(user=other)
+        response = self.client.get(reverse('order-order-status', args=[reference]))
+        self.assertEqual(response.status_code, 404)
+
+
+class IdempotentCheckoutTest(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123',
+                                                   balance=Decimal('100.00'))
+        restaurant = Restaurant.objects.create(name="Test Restaurant")
+        self.dish = Dish.objects.create(name="Test Dish", price=Decimal("10.00"), restaurant=restaurant)
+        self.redis = fake_redis()
+        patcher = patch('api.views.rd', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_authenticate(user=self.user)
+
+    def checkout(self, key: str):
+        return self.client.post(reverse('order-list'), format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_returns_stored_response(self):
+        self.redis.hset(f'cart:{self.user.id}', self.dish.id, 2)
+        response = self.checkout('retry-1')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            response = self.checkout('retry-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('80.00'))
+
+    @override_settings(CHECKOUT_MODE='queue')
+    def test_retry_returns_same_queued_order(self):
+        self.redis.hset(f'cart:{self.user.id}', self.dish.id, 1)
+        first = self.checkout('retry-2')
+        second = self.checkout('retry-2')
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.redis.xlen('orders:stream'), 1)
+
+    def test_error_response_not_stored(self):
+        response = self.checkout('retry-3')
+        self.assertEqual(response.status_code, 500)
+
+        self.redis.hset(f'cart:{self.user.id}', self.dish.id, 1)
+        response = self.checkout('retry-3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT=0.1)
+    def test_concurrent_duplicate_rejected(self):
+        self.redis.hset(f'cart:{self.user.id}', self.dish.id, 1)
+        # первый запрос с этим ключом ещё выполняется
+        self.redis.set(f'idempotency:lock:{self.user.id}:retry-4', 1)
+        response = self.checkout('retry-4')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_lock_of_other_request_kept(self):
+        lock_key = f'idempotency:lock:{self.user.id}:retry-5'
+        original = OrderViewSet.checkout
+
+        def checkout(view, request):
+            # блокировка истекла, пока выполнялся запрос, и её взял дубль
+            self.redis.set(lock_key, 'other')
+            return original(view, request)
+
+        with patch.object(OrderViewSet, 'checkout', checkout):
+            response = self.checkout('retry-5')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.redis.get(lock_key), b'other')
+
+    @override_settings(IDEMPOTENCY_WAIT=0.1)
+    def test_unsaved_response_blocks_retry(self):
+        self.redis.hset(f'cart:{self.user.id}', self.dish.id, 1)
+        with patch('api.idempotency.COMPLETE_SCRIPT', "return redis.error_reply('OOM')"), \
+                self.assertLogs('api.idempotency', level='WARNING'):
+            response = self.checkout('retry-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.redis.ttl(f'idempotency:lock:{self.user.id}:retry-6'), 60)
+
+        self.redis.hset(f'cart:{self.user.id}', self.dish.id, 1)
+        response = self.checkout('retry-6')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_scoped_by_user(self):
+        self.redis.hset(f'cart:{self.user.id}', self.dish.id, 1)
+        self.assertEqual(self.checkout('shared').status_code, 200)
+
+        other = CustomUser.objects.create_user(username='other', password='password123')
+        self.client.force_authenticate(user=other)
+        response = self.checkout('shared')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data['error'], 'Нет позиций в корзине для создания заказа')
+
+    def test_invalid_key(self):
+        response = self.checkout('x' * 256)
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123')
+        self.restaurant = Restaurant.objects.create(name="Test Restaurant")
+        self.dish = Dish.objects.create(name="Test Dish", price=Decimal("10.00"), restaurant=self.restaurant)
+        self.redis = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+        patcher = patch('api.async_views.ard', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_not_authenticated(self):
+        response = await self.async_client.get(reverse('async-cart-list'))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_cart_add_delete_and_list(self):
+        """
+        Проверка асинхронных изменения и получения корзины.
+        """
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(
+            reverse('async-cart-add'), {'dish_id': self.dish.id, 'quantity': 3}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.post(
+            reverse('async-cart-delete'), {'dish_id': self.dish.id, 'quantity': 1}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = await self.async_client.get(reverse('async-cart-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_price'], 20.0)
+        self.assertEqual(response.json()['positions'][0]['quantity'], 2)
+
+    async def test_cart_add_unknown_dish(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(
+            reverse('async-cart-add'), {'dish_id': self.dish.id + 100}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_restaurants_from_menu_cache(self):
+        """
+        Проверка асинхронного списка ресторанов и поиска по блюду.
+        """
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('async-restaurant-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['dishes'][0]['name'], 'Test Dish')
+
+        response = await self.async_client.get(f"{reverse('async-restaurant-list')}?dish_name=test")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+        response = await self.async_client.get(f"{reverse('async-restaurant-list')}?dish_name=sushi")
+        self.assertEqual(response.status_code, 403)
+
+    async def test_cart_batch(self):
+        await self.async_client.aforce_login(self.user)
+        await self.redis.hset(f'cart:{self.user.id}', mapping={self.dish.id: 3, 999: 1})
+        data = {'operations': [
+            {'op': 'add', 'dish_id': self.dish.id, 'quantity': 2},
+            {'op': 'remove', 'dish_id': self.dish.id, 'quantity': 1},
+            {'op': 'set', 'dish_id': 999, 'quantity': 0},
+        ]}
+        response = await self.async_client.post(reverse('async-cart-batch'), data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['positions'], [{'dish_id': self.dish.id, 'quantity': 4}])
+
+        data = {'operations': [{'op': 'add', 'dish_id': self.dish.id + 100}]}
+        response = await self.async_client.post(reverse('async-cart-batch'), data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_redis_error_unavailable(self):
+        await self.async_client.aforce_login(self.user)
+        with patch.object(self.redis, 'pipeline', side_effect=RedisConnectionError('redis://:password@host')), \
+                self.assertLogs('api.exceptions', level='WARNING'):
+            response = await self.async_client.get(reverse('async-cart-list'))
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertNotIn('password', response.json()['detail'])
+
+    async def test_restaurants_read_from_replica(self):
+        await self.async_client.aforce_login(self.user)
+        routed = []
+
+        async def menus(restaurant_ids):
+            routed.append(replica_reads.get())
+            return []
+
+        with patch('api.async_views.aget_menus', side_effect=menus):
+            await self.async_client.get(reverse('async-restaurant-list'))
+            await self.async_client.get(reverse('async-cart-list'))
+        self.assertEqual(routed, [True])
+
+class BenchmarkTest(TransactionTestCase):
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 0.50), 50.0)
+        self.assertEqual(percentile(values, 0.99), 99.0)
+        self.assertEqual(percentile([], 0.95), 0.0)
+
+    def test_stats_report(self):
+        stats = BenchmarkStats()
+        stats.start()
+        stats.record('cart', 0.010, 200, queries=1)
+        stats.record('cart', 0.030, 500, queries=3)
+        stats.finish()
+        report = stats.report()
+        self.assertEqual(report['endpoints']['cart']['requests'], 2)
+        self.assertEqual(report['endpoints']['cart']['error_rate'], 0.5)
+        self.assertEqual(report['endpoints']['cart']['queries'], 2.0)
+        self.assertAlmostEqual(report['total']['p99'], 30.0)
+
+    def test_generated_dataset_workload(self):
+        call_command('generate_dataset', restaurants=3, dishes=4, users=2, orders=2, stdout=StringIO(),
+                     stderr=StringIO())
+        self.assertEqual(Dish.objects.count(), 12)
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertEqual(sum(UserDailyStats.objects.values_list('orders_count', flat=True)), 4)
+        self.assertEqual(
+            RestaurantDailyStats.objects.aggregate(total=Sum('total'))['total'],
+            Order.objects.aggregate(total=Sum('total'))['total'],
+        )
+
+        users = list(CustomUser.objects.filter(username__startswith='bench_'))
+        driver = WorkloadDriver(
+            users,
+            list(Dish.objects.values_list('id', flat=True)),
+            list(Restaurant.objects.values_list('id', flat=True)),
+            ['spic', 'бург'],
+        )
+        with fake_redis_server():
+            report = driver.run(requests=40).report()
+        self.assertEqual(report['total']['requests'], 40)
+        self.assertEqual(set(report['endpoints']) - set(driver.mix), set())
+
+
+class PerformanceMiddlewareTest(APITestCase):
+
+    def setUp(self):
+        latency_histogram.clear()
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123')
+        self.admin = CustomUser.objects.create_user(username='admin', password='password123', is_staff=True)
+        restaurant = Restaurant.objects.create(name="Restaurant 1")
+        self.dish = Dish.objects.create(name="Pizza", price=Decimal("10.00"), restaurant=restaurant)
+        self.client.force_authenticate(user=self.user)
+
+    def server_timing(self, response) -> dict:
+        timing = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            timing[name] = dict(param.split('=', 1) for param in params)
+        return timing
+
+    def test_server_timing_counts_queries(self):
+        order = Order.objects.create(user=self.user, total=Decimal("10.00"))
+        OrderItem.objects.create(order=order, dish=self.dish, quantity=1)
+
+        response = self.client.get(reverse('order-list'))
+        timing = self.server_timing(response)
+        self.assertEqual(timing['sql']['desc'], '"2 queries"')
+        self.assertGreater(float(timing['serializer']['dur']), 0)
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['sql']['dur']))
+
+    def test_server_timing_counts_redis_commands(self):
+        pool = ConnectionPool(connection_class=fakeredis.FakeConnection, server=fakeredis.FakeServer())
+        with patch('api.views.rd', InstrumentedRedis(connection_pool=pool)):
+            response = self.client.post(reverse('cart-add'), {'dish_id': self.dish.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        timing = self.server_timing(response)
+        redis_commands = int(timing['redis']['desc'].strip('"').split()[0])
+        self.assertGreaterEqual(redis_commands, 1)
+
+    def test_metrics_admin_only(self):
+        self.client.get(reverse('order-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['GET order-list']['count'], 1)
+        self.assertEqual(response.data['GET order-list']['sql_queries'], 1.0)
+
+        response = self.client.delete(reverse('metrics'))
+        self.assertEqual(response.status_code, 204)
+        # сам запрос сброса записывается уже в очищенное окно
+        self.assertEqual(list(latency_histogram.snapshot()), ['DELETE metrics'])
+
+
+class LogReplayTest(TransactionTestCase):
+
+    def setUp(self):
+        signals_redis = patch('core.signals.get_redis_client', new=fake_redis)
+        signals_redis.start()
+        self.addCleanup(signals_redis.stop)
+        self.user = CustomUser.objects.create_user(username='replay_user', password='password123',
+                                                   balance=Decimal("100.00"))
+        restaurant = Restaurant.objects.create(name="Restaurant 1")
+        self.dish = Dish.objects.create(name="Pizza", price=Decimal("10.00"), restaurant=restaurant)
+
+    def write_log(self, records: list) -> str:
+        log = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+        self.addCleanup(os.remove, log.name)
+        with log:
+            for record in records:
+                log.write((record if isinstance(record, str) else json.dumps(record)) + '\n')
+        return log.name
+
+    def test_parse_log_record(self):
+        entry = parse_log_record({'path': f'/api/v1/restaurants/{self.dish.id}/?restaurant_id=1',
+                                  'ts': '2024-06-01T12:00:00+00:00'})
+        self.assertEqual(entry.method, 'GET')
+        self.assertEqual(entry.query, {'restaurant_id': '1'})
+        self.assertEqual(entry.endpoint, 'GET /api/v1/restaurants/{id}/')
+        self.assertEqual(entry.timestamp, 1717243200.0)
+        # записи бэклога задач и прочие строки без path не являются запросами
+        self.assertIsNone(parse_log_record({'request_id': 'user-001', 'title': 'x', 'body': 'y'}))
+
+    def test_replay_log(self):
+        path = self.write_log([
+            {'request_id': 'user-001', 'title': 'not a request'},
+            'not json',
+            {'method': 'POST', 'path': '/api/v1/cart/dish/add/', 'body': {'dish_id': self.dish.id},
+             'user': 'replay_user'},
+            {'path': '/api/v1/cart/', 'user': 'replay_user'},
+            {'method': 'POST', 'path': '/api/v1/orders/', 'user': 'replay_user'},
+            {'path': '/api/v1/orders/'},
+        ])
+        with fake_redis_server():
+            replayer = LogReplayer(concurrency=2)
+            report = replayer.run(iter_log(path)).report()
+
+        self.assertEqual(replayer.skipped, 2)
+        self.assertEqual(report['total']['requests'], 4)
+        self.assertEqual(report['total']['errors'], 0, report['endpoints'])
+        self.assertEqual(set(report['endpoints']), {
+            'POST /api/v1/cart/dish/add/', 'GET /api/v1/cart/', 'POST /api/v1/orders/', 'GET /api/v1/orders/',
+        })
+        # запросы пользователя выполнены по порядку: заказ оформлен из добавленного в корзину блюда
+        self.assertEqual(Order.objects.get(user=self.user).total, Decimal("10.00"))
+
+    def test_replay_stops_when_worker_fails(self):
+        path = self.write_log([{'path': '/api/v1/cart/', 'user': 'replay_user'}] * 50)
+        replayer = LogReplayer(queue_size=1)
+        replayer.LIVENESS_INTERVAL = 0.01
+        with fake_redis_server(), patch.object(LogReplayer, 'make_client', side_effect=OperationalError('db down')), \
+                self.assertRaises(ReplayError) as raised:
+            replayer.run(iter_log(path))
+        self.assertIsInstance(raised.exception.__cause__, OperationalError)
+
+    def test_replay_bounds_user_clients(self):
+        other = CustomUser.objects.create_user(username='other_user', password='password123')
+        path = self.write_log([
+            {'path': '/api/v1/cart/', 'user': 'replay_user'},
+            {'path': '/api/v1/cart/', 'user': other.username},
+            {'path': '/api/v1/cart/', 'user': other.username},
+            {'path': '/api/v1/cart/', 'user': 'replay_user'},
+        ])
+        make_client = LogReplayer.make_client
+        with fake_redis_server(), patch.object(LogReplayer, 'make_client', side_effect=make_client) as made:
+            report = LogReplayer(max_clients=1).run(iter_log(path)).report()
+        self.assertEqual(report['total']['errors'], 0, report['endpoints'])
+        # клиент replay_user вытеснен клиентом other_user и создан заново
+        self.assertEqual([call.args[0] for call in made.call_args_list], ['replay_user', 'other_user', 'replay_user'])
+
+    def test_replay_recorded_timing(self):
+        path = self.write_log([
+            {'path': '/api/v1/cart/', 'ts': 100.0},
+            {'path': '/api/v1/cart/', 'ts': 100.4},
+        ])
+        with fake_redis_server():
+            report = LogReplayer(speed=2).run(iter_log(path)).report()
+        self.assertEqual(report['total']['requests'], 2)
+        self.assertGreaterEqual(report['elapsed'], 0.2)
+
+    def test_stats_sample_size(self):
+        stats = BenchmarkStats(sample_size=10)
+        for i in range(1000):
+            stats.record('cart', i / 1000, 200)
+        report = stats.report()
+        self.assertEqual(len(stats.latencies['cart']), 10)
+        self.assertEqual(report['endpoints']['cart']['requests'], 1000)
+
+    def test_replay_log_command(self):
+        path = self.write_log([{'path': '/api/v1/cart/', 'user': 'replay_user'}])
+        out = StringIO()
+        call_command('replay_log', path, fake_redis=True, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['total']['requests'], 1)
+        self.assertEqual(report['skipped'], 0)
+
+
+class ReplicaRoutingTest(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123')
+        self.client.force_authenticate(user=self.user)
+        self.router = ReplicaRouter()
+
+    def test_reads_stay_on_primary_without_replica(self):
+        with read_from_replica():
+            self.assertIsNone(self.router.db_for_read(Restaurant))
+
+    def test_reads_routed_to_replica(self):
+        with patch.dict(settings.DATABASES, replica={}), \
+                patch.object(connections['default'], 'in_atomic_block', False):
+            self.assertIsNone(self.router.db_for_read(Restaurant))
+            with read_from_replica():
+                self.assertEqual(self.router.db_for_read(Restaurant), 'replica')
+                self.assertEqual(self.router.db_for_write(Order), 'default')
+
+    def test_reads_in_primary_transaction_stay_on_primary(self):
+        with patch.dict(settings.DATABASES, replica={}), read_from_replica(), transaction.atomic():
+            self.assertIsNone(self.router.db_for_read(Order))
+
+    def test_views_read_from_replica(self):
+        routed = []
+        with patch('api.views.get_menus', side_effect=lambda ids: routed.append(replica_reads.get()) or []):
+            self.client.get(reverse('restaurant-list'))
+        empty_cart = PricedCart({}, {}, Decimal('0.00'), [])
+        with patch('api.views.CartPricing.price_cart', side_effect=lambda user_id: routed.append(replica_reads.get())
+                   or empty_cart):
+            self.client.post(reverse('order-list'))
+        # список ресторанов читается из реплики, оформление заказа - только основная база
+        self.assertEqual(routed, [True, False])
+
+    def test_menus_cached_from_primary(self):
+        restaurant = Restaurant.objects.create(name='Restaurant 1')
+        cache.clear()
+        routed = []
+        with patch('api.menu.render_menu', side_effect=lambda restaurant: routed.append(replica_reads.get()) or '{}'):
+            self.assertEqual(self.client.get(reverse('restaurant-list')).status_code, 200)
+            cache.clear()
+            with read_from_replica():
+                async_to_sync(aget_menus)([restaurant.id])
+        # ключи страницы читаются из реплики, а попадающее в кэш меню - из основной базы
+        self.assertEqual(routed, [False, False])
+
+
+class WarmupCommandTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.restaurant = Restaurant.objects.create(name="Restaurant 1")
+        self.dish = Dish.objects.create(name="Pizza", price=Decimal("10.00"), restaurant=self.restaurant)
+        self.redis = fake_redis()
+
+    def test_warmup_fills_caches(self):
+        out = StringIO()
+        with patch('api.management.commands.warmup.get_redis_client', return_value=self.redis):
+            call_command('warmup', stdout=out)
+        self.assertIn('ресторанов 1, блюд 1', out.getvalue())
+        self.assertTrue(self.redis.sismember(DISH_IDS_KEY, self.dish.id))
+        self.assertTrue(self.redis.hexists('catalog:dishes', self.dish.id))
+        self.assertIsNotNone(cache.get(f'menu:restaurant:{self.restaurant.id}'))
+
+        # после прогрева первый запрос списка ресторанов не обращается к базе за меню:
+        # сессия, пользователь и ключи страницы
+        user = CustomUser.objects.create_user(username='testuser', password='password123')
+        self.client.force_login(user)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('restaurant-list'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_warmup_fails_without_redis(self):
+        broken = MagicMock()
+        broken.ping.side_effect = RedisConnectionError('Connection refused')
+        with patch('api.management.commands.warmup.get_redis_client', return_value=broken):
+            with self.assertRaises(CommandError):
+                call_command('warmup', stdout=StringIO())
+
+
+@override_settings(REDIS_CIRCUIT_FAILURES=2, REDIS_CIRCUIT_RESET_TIMEOUT=60, REDIS_RETRIES=0,
+                   REDIS_CONNECT_TIMEOUT=0.1, REDIS_SOCKET_TIMEOUT=0.1)
+class RedisResilienceTest(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123')
+        self.client.force_authenticate(user=self.user)
+
+    @staticmethod
+    def unreachable_redis() -> InstrumentedRedis:
+        # на порту 1 соединение сразу отклоняется
+        return InstrumentedRedis(connection_pool=create_connection_pool('redis://127.0.0.1:1/0'))
+
+    def test_circuit_opens_after_failures(self):
+        client = self.unreachable_redis()
+        for _ in range(2):
+            with self.assertRaises(RedisConnectionError) as context:
+                client.get('key')
+            self.assertNotIsInstance(context.exception, CircuitOpenError)
+
+        with patch.object(client.connection_pool, 'get_connection') as get_connection:
+            with self.assertRaises(CircuitOpenError):
+                client.get('key')
+            with self.assertRaises(CircuitOpenError):
+                client.pipeline().get('key').execute()
+        get_connection.assert_not_called()
+        self.assertEqual(circuit_breaker(client.connection_pool).state, 'open')
+
+    @override_settings(REDIS_RETRIES=2, REDIS_CIRCUIT_FAILURES=100)
+    def test_only_read_commands_retried(self):
+        client = self.unreachable_redis()
+        connection = client.connection_pool.make_connection()
+        with patch.object(client.connection_pool, 'get_connection', return_value=connection), \
+                patch('redis.client.Redis._send_command_parse_response',
+                   side_effect=RedisTimeoutError('Timeout reading from socket')) as send:
+            with self.assertRaises(RedisTimeoutError):
+                client.hgetall('cart:1')
+            self.assertEqual(send.call_count, 3)
+
+            # команду записи или скрипт Redis мог уже выполнить: повтор изменил бы корзину второй раз
+            send.reset_mock()
+            for command in (lambda: client.hincrby('cart:1', '1', 1), lambda: client.evalsha('sha', 1, 'cart:1'),
+                            lambda: client.xadd('orders:stream', {'reference': '1'})):
+                with self.assertRaises(RedisTimeoutError):
+                    command()
+            self.assertEqual(send.call_count, 3)
+
+    def test_half_open_trial_closes_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        with self.assertRaises(RedisConnectionError):
+            breaker.call(MagicMock(side_effect=RedisConnectionError))
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertEqual(breaker.call(lambda: 'PONG'), 'PONG')
+        self.assertEqual(breaker.state, 'closed')
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        with self.assertRaises(RedisConnectionError):
+            breaker.call(MagicMock(side_effect=RedisConnectionError))
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(lambda: 'PONG')
+
+    def test_cache_connection_factory(self):
+        factory = ResilientConnectionFactory({'CONNECTION_POOL_KWARGS': {'max_connections': 7}})
+        pool = factory.get_connection_pool(factory.make_connection_params('redis://127.0.0.1:1/0'))
+        self.assertIsInstance(pool, BlockingConnectionPool)
+        self.assertEqual(pool.max_connections, 7)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 0.1)
+        self.assertEqual(pool.connection_kwargs['health_check_interval'], settings.REDIS_HEALTH_CHECK_INTERVAL)
+
+    def test_cart_returns_503_without_redis(self):
+        with patch('api.views.rd', self.unreachable_redis()), self.assertLogs('api.exceptions', 'WARNING'):
+            response = self.client.get(reverse('cart-list'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_menu_falls_back_to_local_cache(self):
+        restaurant = Restaurant.objects.create(name="Restaurant 1")
+        Dish.objects.create(name="Pizza", price=Decimal("10.00"), restaurant=restaurant)
+        broken_cache = MagicMock()
+        broken_cache.get_many.side_effect = ConnectionInterrupted(connection=None)
+        url = reverse('restaurant-list')
+
+        with patch('api.menu.cache', broken_cache), patch('api.menu.local_menus', LocalCache(100, 60)), \
+                self.assertLogs('api.menu', 'WARNING'):
+            first = self.client.get(url)
+            # меню собирается из локального кэша процесса, из базы читаются только ключи страницы
+            with self.assertNumQueries(1):
+                second = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(second.json()['results'][0]['dishes'][0]['name'], 'Pizza')
+        broken_cache.set_many.assert_not_called()
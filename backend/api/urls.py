@@ -1,6 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RestaurantViewSet, CartViewSet, OrderViewSet, LoginView, LogoutView
+from .async_views import (
+    AsyncCartAddView, AsyncCartBatchView, AsyncCartDeleteView, AsyncCartView, AsyncRestaurantListView,
+)
+from .views import (
+    RestaurantViewSet, CartViewSet, OrderViewSet, LoginView, LogoutView, MetricsView, RestaurantStatsView,
+)
 
 router = DefaultRouter()
 router.register(r'restaurants', RestaurantViewSet, basename='restaurant')
@@ -10,5 +15,13 @@ router.register(r'orders', OrderViewSet, basename='order')
 urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('stats/restaurants/', RestaurantStatsView.as_view(), name='restaurant-stats'),
+    # асинхронные варианты самых нагруженных точек входа для запуска под ASGI
+    path('async/restaurants/', AsyncRestaurantListView.as_view(), name='async-restaurant-list'),
+    path('async/cart/', AsyncCartView.as_view(), name='async-cart-list'),
+    path('async/cart/dish/add/', AsyncCartAddView.as_view(), name='async-cart-add'),
+    path('async/cart/dish/delete/', AsyncCartDeleteView.as_view(), name='async-cart-delete'),
+    path('async/cart/batch/', AsyncCartBatchView.as_view(), name='async-cart-batch'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,18 +1,34 @@
-from _decimal import Decimal
+import json
+from decimal import Decimal
 
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.db import transaction
-from django.db.models import Sum, F, Prefetch, QuerySet
+from django.db.models import QuerySet
+from django.http import HttpResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.views import APIView
 
-from .serializers import RestaurantSerializer, OrderSerializer, AddOrDeleteToCartSerializer
+from .idempotency import IDEMPOTENCY_HEADER, IdempotentRequest
+from .menu import get_menus
+from .pagination import OrderPagination, RestaurantPagination
+from .serializers import (
+    RestaurantSerializer, OrderSerializer, AddOrDeleteToCartSerializer, CartBatchSerializer,
+    RestaurantDailyStatsSerializer, RestaurantStatsPeriodSerializer, StatsPeriodSerializer, UserDailyStatsSerializer,
+)
+from config.db_router import read_from_replica
+from config.middleware import latency_histogram
 from config.redis import get_redis_client
-from core.models import Restaurant, Dish, Order
+from core.models import Restaurant, Order, OrderItem, RestaurantDailyStats, UserDailyStats
+from core.services.cart import CartPricing, CartStore, cart_key
+from core.services.checkout import CheckoutError, QueuedCheckout, get_order_status
+from core.services.dish_search import filter_by_dish_name
+from core.services.order_stats import record_orders
+from users.sessions import forget_user
 
 rd = get_redis_client()
 
@@ -42,13 +58,75 @@ class LogoutView(APIView):
         :param request:
         :return: статус разавторизации
         """
+        forget_user(request.user.id)
         logout(request)
         return Response({'detail': 'Successfully logged out'}, status=status.HTTP_200_OK)
 
 
-class RestaurantViewSet(viewsets.ReadOnlyModelViewSet):
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request) -> Response:
+        """
+        Сводка скользящей гистограммы задержек по точкам входа текущего процесса
+        :param request:
+        :return: перцентили задержки и средние счётчики SQL, Redis и сериализации
+        """
+        return Response(latency_histogram.snapshot())
+
+    def delete(self, request) -> Response:
+        """
+        Сброс накопленных замеров
+        """
+        latency_histogram.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ReplicaReadMixin:
+    """
+    Чтения GET-запросов представления выполняются в реплике базы, если она настроена
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            with read_from_replica():
+                return super().dispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+
+class RestaurantViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Restaurant.objects.all()
     serializer_class = RestaurantSerializer
+    pagination_class = RestaurantPagination
+
+    def list(self, request, *args, **kwargs) -> HttpResponse:
+        """
+        Постраничный список ресторанов с меню. Без поиска по блюду из базы читаются только ключи страницы
+        по покрывающему индексу, меню собираются из закэшированных JSON-фрагментов
+        """
+        if request.query_params.get('dish_name'):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.queryset
+        restaurant_id = self.get_restaurant_id()
+        if restaurant_id is not None:
+            queryset = queryset.filter(id=restaurant_id)
+
+        page = self.paginator.paginate_keys(queryset, request)
+        menus = get_menus([pk for _, pk in page])
+        if not page and not request.query_params.get(self.paginator.cursor_query_param):
+            raise PermissionDenied(detail="Ресторан не найден или у вас нет разрешения на его просмотр.")
+        body = f'{{"next":{json.dumps(self.paginator.get_next_link())},"results":[{",".join(menus)}]}}'
+        return HttpResponse(body, content_type='application/json')
+
+    def get_restaurant_id(self) -> int | None:
+        # добавлена простая проверка ID ресторана, по факту можно использовать django filter
+        restaurant_id = self.request.query_params.get('restaurant_id')
+        if not restaurant_id:
+            return None
+        if not restaurant_id.isdigit():
+            raise PermissionDenied(detail="Указан не корректный ID ресторана")
+        return int(restaurant_id)
 
     def get_queryset(self) -> QuerySet:
         """
@@ -56,23 +134,14 @@ class RestaurantViewSet(viewsets.ReadOnlyModelViewSet):
         """
         queryset = super().get_queryset()
         dish_name = self.request.query_params.get('dish_name')
-        restaurant_id = self.request.query_params.get('restaurant_id')
-
-        # добавлена простая проверка ID ресторана, по факту можно использовать django filter
-
-        if restaurant_id:
-            if not restaurant_id.isdigit():
-                raise PermissionDenied(detail="Указан не корректный ID ресторана")
+        restaurant_id = self.get_restaurant_id()
 
+        if restaurant_id is not None:
             queryset = queryset.filter(id=restaurant_id)
 
-        # Фильтрация по имени блюда
+        # Поиск по имени блюда через полнотекстовый индекс, блюда упорядочены по релевантности
         if dish_name:
-            queryset = queryset.filter(
-                dishes__name__icontains=dish_name
-            ).prefetch_related(
-                Prefetch("dishes", queryset=Dish.objects.filter(name__icontains=dish_name))
-            )
+            queryset = filter_by_dish_name(queryset, dish_name, restaurant_id)
 
         # Проверка наличия объектов
         if not queryset.exists():
@@ -86,23 +155,8 @@ class CartViewSet(viewsets.ViewSet):
         """
         Получает все товары в корзине пользователя и рассчитывает общую стоимость.
         """
-        user_id = request.user.id
-        cart_items = rd.hgetall(f'cart:{user_id}')
-        cart_data = []
-        total_price = Decimal("0.00")
-        for dish_id, quantity in cart_items.items():
-
-            dish = Dish.objects.get(id=dish_id)
-            quantity = int(quantity)
-            item_total_price = dish.price * quantity
-            total_price += item_total_price
-            cart_data.append({
-                'dish_id': dish.id,
-                'name': dish.name,
-                'quantity': quantity,
-                'price': item_total_price,
-            })
-        return Response({'total_price': total_price, 'positions': cart_data})
+        priced = CartPricing(rd).price_cart(request.user.id)
+        return Response({'total_price': priced.total, 'positions': priced.positions})
 
     @action(detail=False, methods=['post'], url_path='dish/add')
     def add(self, request) -> Response:
@@ -111,10 +165,10 @@ class CartViewSet(viewsets.ViewSet):
         """
         serializer = AddOrDeleteToCartSerializer(data=request.data)
         if serializer.is_valid():
-            user_id = request.user.id
-            dish_id = request.data.get('dish_id')
-            quantity = int(request.data.get('quantity'))
-            rd.hincrby(f'cart:{user_id}', dish_id, quantity)
+            dish_id = serializer.validated_data['dish_id']
+            quantity = serializer.validated_data['quantity']
+            if CartStore(rd).add(request.user.id, dish_id, quantity) is None:
+                return Response({'dish_id': ['Dish not found']}, status=status.HTTP_400_BAD_REQUEST)
             return Response(status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -126,77 +180,178 @@ class CartViewSet(viewsets.ViewSet):
         """
         serializer = AddOrDeleteToCartSerializer(data=request.data)
         if serializer.is_valid():
-            user_id = request.user.id
-            dish_id = request.data.get('dish_id')
-            quantity = int(request.data.get('quantity'))
-            current_quantity = int(rd.hget(f'cart:{user_id}', dish_id))
-            if current_quantity <= quantity:
-                rd.hdel(f'cart:{user_id}', dish_id)
-            else:
-                rd.hincrby(f'cart:{user_id}', dish_id, -quantity)
+            dish_id = serializer.validated_data['dish_id']
+            quantity = serializer.validated_data['quantity']
+            if CartStore(rd).remove(request.user.id, dish_id, quantity) is None:
+                return Response({'detail': 'Блюдо отсутствует в корзине'}, status=status.HTTP_404_NOT_FOUND)
             return Response(status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request) -> Response:
+        """
+        Применение набора операций add/remove/set к корзине пользователя одним запросом.
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        if serializer.is_valid():
+            cart = CartStore(rd).apply(request.user.id, serializer.validated_data['operations'])
+            positions = [{'dish_id': dish_id, 'quantity': quantity} for dish_id, quantity in cart.items()]
+            return Response({'positions': positions}, status=status.HTTP_200_OK)
 
-class OrderViewSet(viewsets.ViewSet):
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class OrderViewSet(ReplicaReadMixin, viewsets.ViewSet):
 
     def list(self, request) -> Response:
         """
-        Получение последних 10 заказов пользователя и расчёт общей стоимости.
+        Получение страницы последних заказов пользователя (по умолчанию 10) и расчёт их общей стоимости.
+        Следующая страница запрашивается по курсору из поля next.
         """
-        orders = Order.objects.filter(user__id=request.user.id).prefetch_related('items__dish').annotate(
-            total_price=Sum(F('items__quantity') * F('items__dish__price'))
-        ).order_by('-created_at')[:10]
+        # цены позиций и итог заказа зафиксированы при оформлении, поэтому чтение истории
+        # обходится без соединения с блюдами и агрегации; страница материализуется один раз
+        paginator = OrderPagination()
+        orders = paginator.paginate_queryset(
+            Order.objects.filter(user__id=request.user.id).prefetch_related('items'),
+            request,
+        )
         serializer = OrderSerializer(orders, many=True)
-        total_count = orders.count()
-        total_sum = sum(order.total_price for order in orders)
+        total_count = len(orders)
+        total_sum = sum(order.total for order in orders)
         response_data = {
             "total_count": total_count,
             "total_sum": total_sum,
-            "last_orders": serializer.data
+            "last_orders": serializer.data,
+            "next": paginator.get_next_link(),
         }
         return Response(response_data)
 
-    @transaction.atomic
     def create(self, request) -> Response:
         """
-        Создание на основе данных корзины пользователя заказа и списание средств в счёт оплаты заказа
+        Создание на основе данных корзины пользователя заказа и списание средств в счёт оплаты заказа.
+        С заголовком Idempotency-Key повтор запроса возвращает ответ первого запроса без повторного оформления
+        """
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return self.checkout(request)
+        return IdempotentRequest(rd, request.user.id, key).run(lambda: self.checkout(request))
+
+    def checkout(self, request) -> Response:
+        """
+        Оформление заказа из корзины пользователя в режиме CHECKOUT_MODE
         """
+        if settings.CHECKOUT_MODE == 'queue':
+            return self.create_queued(request)
+
+        # ошибки Redis и базы обрабатывает api.exceptions.exception_handler, здесь - только отказы в оформлении
         try:
             user_id = request.user.id
-            cart_items = rd.hgetall(f'cart:{user_id}')
-            if not cart_items:
-                raise Exception('Нет позиций в корзине для создания заказа')
-
-            total_price = Decimal("0.00")
-            order_items = []
-            for dish_id, quantity in cart_items.items():
-                dish = Dish.objects.get(id=dish_id)
-                quantity = int(quantity)
-                item_total_price = dish.price * quantity
-                total_price += item_total_price
-                order_items.append({
-                    'dish_id': dish.id,
-                    'quantity': quantity,
-                })
-
-            order = Order.objects.create(user=request.user)
-            for item in order_items:
-                order.items.create(
-                    dish_id=item['dish_id'],
-                    quantity=item['quantity'],
-                )
-
-            request.user.write_off_balance(total_price)
+            # цены берутся из снимка корзины или кэша каталога до начала транзакции,
+            # чтобы не держать блокировку записи; база читается только для блюд не из кэша
+            priced = CartPricing(rd).price_cart(user_id)
+            if not priced.quantities:
+                raise CheckoutError('Нет позиций в корзине для создания заказа')
+            if len(priced.dishes) != len(priced.quantities):
+                raise CheckoutError('Некоторые блюда из корзины больше недоступны')
+
+            quantities, dishes, total_price = priced.quantities, priced.dishes, priced.total
+
+            with transaction.atomic():
+                order = Order.objects.create(user=request.user, total=total_price)
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order=order,
+                        dish_id=dish_id,
+                        quantity=quantity,
+                        unit_price=dishes[dish_id].price,
+                        dish_name=dishes[dish_id].name,
+                    )
+                    for dish_id, quantity in quantities.items()
+                ])
+                record_orders([order])
+                if not request.user.debit_balance(total_price):
+                    raise CheckoutError('Сумма списания превышает средства на балансе')
 
             # выполняем очистку корзины только после успешного списания средств с баланса,
             # остальную атомарность покрывает transaction.atomic
-            rd.delete(f'cart:{user_id}')
+            rd.delete(cart_key(user_id))
 
-        except Exception as e:
-            transaction.set_rollback(True)
+        except CheckoutError as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return Response(status=status.HTTP_200_OK)
 
+    def create_queued(self, request) -> Response:
+        """
+        Оформление с отложенной записью: средства списываются сразу, а заказ записывается в базу
+        обработчиком process_orders. Клиент получает номер оформления для запроса статуса
+        """
+        try:
+            reference = QueuedCheckout(rd).submit(request.user)
+        except CheckoutError as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({'order': reference, 'status': 'pending'}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'status/(?P<reference>[0-9a-f]{32})')
+    def order_status(self, request, reference: str) -> Response:
+        """
+        Статус заказа, оформленного с отложенной записью
+        """
+        order_status = get_order_status(rd, reference, request.user.id)
+        if order_status is None:
+            raise NotFound(detail='Заказ не найден')
+        return Response(order_status)
+
+    @action(detail=False, methods=['get'], url_path='stats')
+    def stats(self, request) -> Response:
+        """
+        Число и сумма заказов пользователя по дням за период date_from - date_to из дневных агрегатов,
+        объём чтения зависит от числа дней, а не от числа заказов
+        """
+        period = StatsPeriodSerializer(data=request.query_params)
+        period.is_valid(raise_exception=True)
+        days = list(
+            UserDailyStats.objects
+            .filter(user_id=request.user.id, day__range=(period.validated_data['date_from'],
+                                                         period.validated_data['date_to']))
+            .order_by('day')
+        )
+        return Response({
+            **period.data,
+            'orders_count': sum(day.orders_count for day in days),
+            'total': sum((day.total for day in days), Decimal("0.00")),
+            'days': UserDailyStatsSerializer(days, many=True).data,
+        })
+
+
+class RestaurantStatsView(ReplicaReadMixin, APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request) -> Response:
+        """
+        Заказы блюд ресторанов по дням за период date_from - date_to и итоги по каждому ресторану,
+        параметр restaurant ограничивает выборку одним рестораном
+        """
+        period = RestaurantStatsPeriodSerializer(data=request.query_params)
+        period.is_valid(raise_exception=True)
+        queryset = RestaurantDailyStats.objects.filter(
+            day__range=(period.validated_data['date_from'], period.validated_data['date_to']),
+        )
+        if 'restaurant' in period.validated_data:
+            queryset = queryset.filter(restaurant_id=period.validated_data['restaurant'])
+        days = list(queryset.order_by('day', 'restaurant_id'))
+
+        totals = {}
+        for day in days:
+            total = totals.setdefault(day.restaurant_id, {
+                'restaurant': day.restaurant_id, 'orders_count': 0, 'items_count': 0, 'total': Decimal("0.00"),
+            })
+            total['orders_count'] += day.orders_count
+            total['items_count'] += day.items_count
+            total['total'] += day.total
+        return Response({
+            **period.data,
+            'restaurants': sorted(totals.values(), key=lambda total: total['total'], reverse=True),
+            'days': RestaurantDailyStatsSerializer(days, many=True).data,
+        })
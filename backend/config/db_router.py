@@ -0,0 +1,66 @@
+"""
+Маршрутизация запросов между основной базой и репликой для чтения
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+replica_reads: ContextVar[bool] = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def read_from_replica() -> Iterator[None]:
+    """
+    Направляет чтения внутри блока в реплику, если она настроена (DATABASE_REPLICA_URL).
+    Значение хранится в contextvar, поэтому действует и в потоках sync_to_async
+    """
+    token = replica_reads.set(True)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+@contextmanager
+def read_from_primary() -> Iterator[None]:
+    """
+    Возвращает чтения внутри блока в основную базу, в том числе внутри read_from_replica:
+    например, для данных, которые будут закэшированы и не должны отставать на время задержки реплики
+    """
+    token = replica_reads.set(False)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Запись всегда идёт в основную базу, чтение - в реплику только внутри read_from_replica.
+
+    Чтения внутри открытой транзакции основной базы остаются в ней, чтобы не читать
+    из реплики данные старее только что записанных
+    """
+
+    def db_for_read(self, model, **hints) -> str | None:
+        if not replica_reads.get() or REPLICA_DB_ALIAS not in settings.DATABASES:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints) -> str:
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool | None:
+        # реплика содержит те же данные, что и основная база
+        databases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,191 @@
+"""
+Метрики производительности запросов: счётчики SQL, Redis и сериализации в рамках запроса
+и скользящая гистограмма задержек по точкам входа
+"""
+
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+current_metrics: ContextVar['RequestMetrics | None'] = ContextVar('current_metrics', default=None)
+
+
+def percentile(sorted_values: list[float], share: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга
+    :param sorted_values: отсортированные значения
+    :param share: доля от 0 до 1
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(share * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+class RequestMetrics:
+    """
+    Счётчики одного запроса. Хранится в contextvar, поэтому доступен и из потоков sync_to_async
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.redis_count = 0
+        self.redis_time = 0.0
+        self.serializer_time = 0.0
+        self._serializing = False
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.started_at
+
+    def server_timing(self) -> str:
+        """
+        Значение заголовка Server-Timing, длительности в миллисекундах
+        """
+        return ', '.join([
+            f'total;dur={self.duration * 1000:.2f}',
+            f'sql;dur={self.sql_time * 1000:.2f};desc="{self.sql_count} queries"',
+            f'redis;dur={self.redis_time * 1000:.2f};desc="{self.redis_count} commands"',
+            f'serializer;dur={self.serializer_time * 1000:.2f}',
+        ])
+
+
+@contextmanager
+def collect_metrics() -> Iterator[RequestMetrics]:
+    """
+    Включает сбор счётчиков для кода внутри блока
+    """
+    metrics = RequestMetrics()
+    token = current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        metrics.finish()
+        current_metrics.reset(token)
+
+
+@contextmanager
+def redis_timer(commands: int = 1) -> Iterator[None]:
+    """
+    Учитывает время обращения к Redis. Пайплайн учитывается как commands команд за одно обращение
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.redis_time += time.perf_counter() - started_at
+        metrics.redis_count += commands
+
+
+@contextmanager
+def serializer_timer() -> Iterator[None]:
+    """
+    Учитывает время сериализации ответа, вложенные сериализаторы не считаются повторно
+    """
+    metrics = current_metrics.get()
+    if metrics is None or metrics._serializing:
+        yield
+        return
+    metrics._serializing = True
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += time.perf_counter() - started_at
+        metrics._serializing = False
+
+
+def query_timer(execute, sql, params, many, context):
+    """
+    Обёртка выполнения SQL (connection.execute_wrapper): считает запросы текущего запроса
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_time += time.perf_counter() - started_at
+        metrics.sql_count += 1
+
+
+def install_query_timer(connection, **kwargs) -> None:
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+def install_query_timers() -> None:
+    """
+    Подключает учёт SQL к уже открытым соединениям текущего потока
+    """
+    for connection in connections.all(initialized_only=True):
+        install_query_timer(connection)
+
+
+connection_created.connect(install_query_timer, dispatch_uid='config.metrics.install_query_timer')
+
+
+class LatencyHistogram:
+    """
+    Потокобезопасное скользящее окно последних замеров по каждой точке входа
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._errors = defaultdict(lambda: deque(maxlen=self.window))
+
+    def record(self, endpoint: str, metrics: RequestMetrics, status_code: int) -> None:
+        sample = (metrics.duration, metrics.sql_count, metrics.sql_time, metrics.redis_count,
+                  metrics.redis_time, metrics.serializer_time)
+        with self._lock:
+            self._samples[endpoint].append(sample)
+            self._errors[endpoint].append(status_code >= 500)
+
+    def snapshot(self) -> dict:
+        """
+        Сводка по окну: число замеров, перцентили задержки (мс) и средние значения счётчиков
+        """
+        with self._lock:
+            samples = {endpoint: list(values) for endpoint, values in self._samples.items()}
+            errors = {endpoint: sum(values) for endpoint, values in self._errors.items()}
+
+        report = {}
+        for endpoint, values in sorted(samples.items()):
+            count = len(values)
+            durations = sorted(value[0] for value in values)
+            columns = list(zip(*values))
+            report[endpoint] = {
+                'count': count,
+                'p50': round(percentile(durations, 0.50) * 1000, 2),
+                'p95': round(percentile(durations, 0.95) * 1000, 2),
+                'p99': round(percentile(durations, 0.99) * 1000, 2),
+                'max': round(durations[-1] * 1000, 2),
+                'error_rate': round(errors[endpoint] / count, 4),
+                'sql_queries': round(sum(columns[1]) / count, 2),
+                'sql_ms': round(sum(columns[2]) / count * 1000, 2),
+                'redis_commands': round(sum(columns[3]) / count, 2),
+                'redis_ms': round(sum(columns[4]) / count * 1000, 2),
+                'serializer_ms': round(sum(columns[5]) / count * 1000, 2),
+            }
+        return report
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._errors.clear()
@@ -2,10 +2,264 @@
 Настройки Redis
 """
 
+import threading
+import time
+import weakref
+from functools import partial
+
 from django.conf import settings
-from redis import ConnectionPool, Redis
+from django_redis.pool import ConnectionFactory
+from redis import BlockingConnectionPool, ConnectionError as RedisConnectionError, Redis, ResponseError
+from redis import TimeoutError as RedisTimeoutError
+from redis import asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff, NoBackoff
+from redis.client import Pipeline
+from redis.retry import Retry
+
+from config.metrics import redis_timer
+
+# Ошибки, означающие недоступность Redis: на них повторяется команда и считаются отказы размыкателя цепи
+CONNECTION_ERRORS = (RedisConnectionError, RedisTimeoutError)
+
+# Команды только для чтения: повтор после ошибки соединения безопасен. Команды записи и скрипты (EVALSHA)
+# Redis мог выполнить до потери ответа, поэтому они не повторяются: повтор добавил бы блюдо в корзину дважды
+# или не нашёл бы уже перенесённую в резерв корзину
+READ_ONLY_COMMANDS = frozenset({
+    'EXISTS', 'GET', 'MGET', 'STRLEN', 'TTL', 'PTTL', 'TYPE', 'SCAN', 'PING', 'MEMORY USAGE',
+    'HGET', 'HMGET', 'HGETALL', 'HEXISTS', 'HLEN', 'HKEYS', 'HVALS', 'HSCAN',
+    'SISMEMBER', 'SMISMEMBER', 'SMEMBERS', 'SCARD', 'SSCAN',
+    'ZSCORE', 'ZCARD', 'ZRANGE', 'ZRANGEBYSCORE', 'ZREVRANGE', 'ZREVRANGEBYSCORE', 'ZSCAN',
+    'XLEN', 'XRANGE', 'XPENDING',
+})
+
+
+def pool_options() -> dict:
+    """
+    Параметры пула подключений: ограничение числа соединений и ожидания свободного соединения,
+    таймауты сокета и проверка соединения перед использованием после простоя
+    """
+    return {
+        'max_connections': settings.REDIS_MAX_CONNECTIONS,
+        'timeout': settings.REDIS_POOL_TIMEOUT,
+        'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': settings.REDIS_CONNECT_TIMEOUT,
+        'health_check_interval': settings.REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+def retry_backoff() -> ExponentialBackoff:
+    return ExponentialBackoff(cap=settings.REDIS_RETRY_BACKOFF_CAP, base=settings.REDIS_RETRY_BACKOFF_BASE)
+
+
+def is_read_only(command: str) -> bool:
+    return command.upper() in READ_ONLY_COMMANDS
+
+
+def create_connection_pool(url: str, **options) -> BlockingConnectionPool:
+    """
+    Ограниченный пул подключений: при исчерпании соединений запрос ждёт свободное не дольше
+    REDIS_POOL_TIMEOUT секунд. Сам пул команды не повторяет: повторяются только команды чтения
+    в InstrumentedRedis, пайплайны не повторяются
+    :param options: параметры, заменяющие pool_options
+    """
+    return BlockingConnectionPool.from_url(url, retry=Retry(NoBackoff(), 0), **{**pool_options(), **options})
+
+
+def create_async_connection_pool(url: str) -> aioredis.BlockingConnectionPool:
+    return aioredis.BlockingConnectionPool.from_url(url, retry=AsyncRetry(NoBackoff(), 0), **pool_options())
+
+
+class ResilientConnectionFactory(ConnectionFactory):
+    """
+    Фабрика подключений django-redis с теми же ограничением пула и таймаутами, что и у клиента данных.
+    Как и там, повторяются только команды чтения. Параметры из CONNECTION_POOL_KWARGS имеют приоритет
+    """
+
+    def __init__(self, options: dict):
+        super().__init__(options)
+        self.pool_cls = BlockingConnectionPool
+        self.pool_cls_kwargs = {
+            'retry': Retry(NoBackoff(), 0),
+            **pool_options(),
+            **self.pool_cls_kwargs,
+        }
+
+
+class CircuitOpenError(RedisConnectionError):
+    """
+    Команда отклонена без обращения к Redis: размыкатель цепи считает Redis недоступным
+    """
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи для пула подключений Redis.
+
+    После failure_threshold отказов соединения подряд (уже с учётом повторов) команды в течение
+    reset_timeout секунд сразу завершаются CircuitOpenError, не занимая соединение из пула и не дожидаясь
+    таймаутов, поэтому время ответа при недоступном Redis остаётся ограниченным. Затем пропускается
+    одна пробная команда: успех замыкает цепь, отказ снова размыкает её на reset_timeout секунд
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if not self.trial and time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError('Redis недоступен, команда отклонена размыкателем цепи')
+            self.trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.trial = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """
+        Снимает пробную команду, завершившуюся ошибкой до обращения к Redis
+        """
+        with self._lock:
+            self.trial = False
+
+    def call(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except CONNECTION_ERRORS:
+            self.record_failure()
+            raise
+        except ResponseError:
+            # Redis ответил, значит доступен
+            self.record_success()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+        return result
 
-redis_connection_pool = ConnectionPool.from_url(settings.URL_REDIS)
+    async def acall(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except CONNECTION_ERRORS:
+            self.record_failure()
+            raise
+        except ResponseError:
+            self.record_success()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+        return result
+
+
+_breakers = weakref.WeakKeyDictionary()
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(pool) -> CircuitBreaker:
+    """
+    Размыкатель цепи пула подключений: все клиенты и пайплайны одного пула разделяют его состояние
+    """
+    breaker = _breakers.get(pool)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(
+                pool, CircuitBreaker(settings.REDIS_CIRCUIT_FAILURES, settings.REDIS_CIRCUIT_RESET_TIMEOUT),
+            )
+    return breaker
+
+
+redis_connection_pool = create_connection_pool(settings.URL_REDIS)
+async_redis_connection_pool = create_async_connection_pool(settings.URL_REDIS)
+
+
+class InstrumentedPipeline(Pipeline):
+    """
+    Пайплайн, учитывающий отправку пачки команд в метриках текущего запроса и в размыкателе цепи пула
+    """
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        with redis_timer(len(self.command_stack)):
+            return circuit_breaker(self.connection_pool).call(super().execute, raise_on_error)
+
+
+class InstrumentedRedis(Redis):
+    """
+    Клиент Redis, учитывающий число и время команд в метриках текущего запроса (config.metrics).
+    Вне запроса накладные расходы сводятся к чтению contextvar.
+    Команды проходят через размыкатель цепи пула подключений (CircuitBreaker), команды чтения при ошибке
+    соединения повторяются REDIS_RETRIES раз с экспоненциальной паузой
+    """
+
+    def execute_command(self, *args, **options):
+        execute = super().execute_command
+        if is_read_only(args[0]):
+            retry = Retry(retry_backoff(), settings.REDIS_RETRIES, supported_errors=CONNECTION_ERRORS)
+            command = partial(retry.call_with_retry, lambda: execute(*args, **options), lambda error: None)
+        else:
+            command = partial(execute, *args, **options)
+        with redis_timer():
+            return circuit_breaker(self.connection_pool).call(command)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncInstrumentedPipeline(aioredis.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True) -> list:
+        with redis_timer(len(self.command_stack)):
+            return await circuit_breaker(self.connection_pool).acall(super().execute, raise_on_error)
+
+
+class AsyncInstrumentedRedis(aioredis.Redis):
+    """
+    Асинхронный вариант InstrumentedRedis
+    """
+
+    async def execute_command(self, *args, **options):
+        execute = super().execute_command
+        if is_read_only(args[0]):
+            retry = AsyncRetry(retry_backoff(), settings.REDIS_RETRIES, supported_errors=CONNECTION_ERRORS)
+            command = partial(retry.call_with_retry, lambda: execute(*args, **options), self._no_failure)
+        else:
+            command = partial(execute, *args, **options)
+        with redis_timer():
+            return await circuit_breaker(self.connection_pool).acall(command)
+
+    @staticmethod
+    async def _no_failure(error: Exception) -> None:
+        pass
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> AsyncInstrumentedPipeline:
+        return AsyncInstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
 
 
 def get_redis_client() -> Redis:
@@ -25,4 +279,28 @@ def get_redis_client() -> Redis:
     Возвращает:
         Redis: Экземпляр клиента Redis, подключенный с использованием заранее определенного пула подключений.
     """
-    return Redis(connection_pool=redis_connection_pool)
+    return InstrumentedRedis(connection_pool=redis_connection_pool)
+
+
+def get_blocking_redis_client(block: float) -> Redis:
+    """
+    Клиент Redis на отдельном пуле для блокирующих команд (XREADGROUP ... BLOCK): таймаут сокета больше
+    времени блокировки, поэтому ожидание без новых данных не считается таймаутом и отказом в размыкателе
+    цепи общего пула
+    :param block: сколько секунд команда может ждать ответа Redis
+    """
+    pool = create_connection_pool(settings.URL_REDIS, socket_timeout=block + settings.REDIS_SOCKET_TIMEOUT)
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def get_async_redis_client() -> aioredis.Redis:
+    """
+    Создает и возвращает экземпляр асинхронного клиента Redis (redis.asyncio) на общем пуле подключений.
+
+    Используется асинхронными представлениями под ASGI, чтобы обращения к Redis
+    не блокировали цикл событий и не уходили в пул потоков.
+
+    Возвращает:
+        redis.asyncio.Redis: Экземпляр асинхронного клиента Redis.
+    """
+    return AsyncInstrumentedRedis(connection_pool=async_redis_connection_pool)
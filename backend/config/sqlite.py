@@ -0,0 +1,29 @@
+"""
+Настройка соединений SQLite
+"""
+
+from django.conf import settings
+
+
+def apply_pragmas(connection, pragmas: dict) -> None:
+    """
+    Выполняет PRAGMA на соединении sqlite3
+    :param connection: соединение sqlite3 (не обёртка Django)
+    :param pragmas: имя -> значение, применяются в порядке словаря
+    """
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_sqlite(sender, connection, **kwargs) -> None:
+    """
+    Обработчик connection_created: включает WAL и остальные PRAGMA из SQLITE_PRAGMAS на каждом новом соединении.
+
+    В режиме WAL читатели не ждут окончания пишущей транзакции, synchronous=NORMAL убирает fsync
+    на каждом коммите (в WAL это безопасно для целостности, при сбое питания теряются лишь последние коммиты),
+    mmap_size и cache_size уменьшают число системных вызовов чтения, busy_timeout задаёт ожидание блокировки
+    записи вместо немедленной ошибки database is locked
+    """
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS_ENABLED:
+        return
+    apply_pragmas(connection.connection, settings.SQLITE_PRAGMAS)
@@ -25,7 +25,7 @@ class OrderItemInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'created_at')
+    list_display = ('id', 'user', 'total', 'created_at')
     search_fields = ('user__username',)
     list_filter = ('created_at',)
     ordering = ('id',)
@@ -34,7 +34,7 @@ class OrderAdmin(admin.ModelAdmin):
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ('id', 'order', 'dish', 'quantity')
+    list_display = ('id', 'order', 'dish', 'unit_price', 'quantity')
     search_fields = ('order__id', 'dish__name')
     list_filter = ('order', 'dish')
     ordering = ('id',)
\ No newline at end of file
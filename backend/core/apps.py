@@ -5,3 +5,11 @@ class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
     verbose_name = "Настройка приложения"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from config.sqlite import configure_sqlite
+        from . import signals  # noqa: F401
+
+        connection_created.connect(configure_sqlite, dispatch_uid='config.sqlite.configure_sqlite')
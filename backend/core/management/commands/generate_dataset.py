@@ -0,0 +1,107 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from redis import RedisError
+
+from config.redis import get_redis_client
+from core.models import Dish, Order, OrderItem, Restaurant
+from core.services.cart import CATALOG_KEY, DISH_IDS_KEY
+from core.services.order_stats import record_orders
+from users.models import CustomUser
+
+ADJECTIVES = [
+    'Острый', 'Сливочный', 'Домашний', 'Фирменный', 'Классический', 'Пряный', 'Копчёный',
+    'Spicy', 'Crispy', 'Grilled', 'Royal', 'Veggie', 'Double', 'Golden',
+]
+NOUNS = [
+    'бургер', 'суп', 'салат', 'вок', 'ролл', 'пирог', 'стейк', 'плов', 'борщ', 'пельмени',
+    'pizza', 'pasta', 'taco', 'ramen', 'curry', 'sushi', 'burrito', 'noodles',
+]
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "Генерирует набор данных для нагрузочного тестирования: рестораны, блюда, пользователей и историю заказов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=100, help='Количество ресторанов')
+        parser.add_argument('--dishes', type=int, default=30, help='Количество блюд в каждом ресторане')
+        parser.add_argument('--users', type=int, default=100, help='Количество пользователей')
+        parser.add_argument('--orders', type=int, default=20, help='Количество заказов у каждого пользователя')
+        parser.add_argument('--balance', type=Decimal, default=Decimal('1000000.00'), help='Баланс пользователей')
+        parser.add_argument('--password', default='bench', help='Пароль пользователей')
+        parser.add_argument('--prefix', default='bench', help='Префикс имён пользователей и ресторанов')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        with transaction.atomic():
+            restaurants = Restaurant.objects.bulk_create(
+                [Restaurant(name=f"{prefix} {i}") for i in range(options['restaurants'])],
+                batch_size=BATCH_SIZE,
+            )
+            dishes = Dish.objects.bulk_create(
+                [
+                    Dish(
+                        name=f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}",
+                        price=Decimal(rng.randrange(100, 100000)) / 100,
+                        restaurant=restaurant,
+                    )
+                    for restaurant in restaurants
+                    for i in range(options['dishes'])
+                ],
+                batch_size=BATCH_SIZE,
+            )
+            # хэш пароля считается один раз, иначе генерация упирается в PBKDF2
+            password = make_password(options['password'])
+            users = CustomUser.objects.bulk_create(
+                [
+                    CustomUser(username=f"{prefix}_{i}", password=password, balance=options['balance'])
+                    for i in range(options['users'])
+                ],
+                batch_size=BATCH_SIZE,
+            )
+            self.create_orders(rng, users, dishes, options['orders'])
+
+        self.reset_caches()
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано ресторанов: {len(restaurants)}, блюд: {len(dishes)}, пользователей: {len(users)}, "
+            f"заказов: {len(users) * max(options['orders'], 0) if dishes else 0}"
+        ))
+
+    def create_orders(self, rng: random.Random, users: list, dishes: list, orders_per_user: int) -> None:
+        if not dishes or orders_per_user <= 0:
+            return
+        users_per_batch = max(BATCH_SIZE // orders_per_user, 1)
+        for start in range(0, len(users), users_per_batch):
+            batch_users = users[start:start + users_per_batch]
+            lines = []
+            orders = []
+            for user in batch_users:
+                for _ in range(orders_per_user):
+                    order_lines = [(rng.choice(dishes), rng.randint(1, 3)) for _ in range(rng.randint(1, 5))]
+                    orders.append(Order(user=user, total=sum(dish.price * quantity for dish, quantity in order_lines)))
+                    lines.append(order_lines)
+            orders = Order.objects.bulk_create(orders)
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=order, dish=dish, quantity=quantity, unit_price=dish.price, dish_name=dish.name)
+                    for order, order_lines in zip(orders, lines)
+                    for dish, quantity in order_lines
+                ],
+                batch_size=BATCH_SIZE,
+            )
+            # дневные агрегаты ведёт оформление заказа, а bulk_create его обходит
+            record_orders(orders)
+
+    def reset_caches(self) -> None:
+        # bulk_create не отправляет сигналы, поэтому индексы кэшей сбрасываются вручную
+        try:
+            get_redis_client().delete(CATALOG_KEY, DISH_IDS_KEY)
+        except RedisError as e:
+            self.stderr.write(f"Кэши не сброшены, Redis недоступен: {e}")
@@ -0,0 +1,86 @@
+import signal
+import socket
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections
+from redis import RedisError
+
+from config.redis import get_blocking_redis_client
+from core.services.checkout import OrderWriter, QueuedCheckout
+
+
+class Command(BaseCommand):
+    help = (
+        "Обработчик отложенной записи заказов (CHECKOUT_MODE=queue): читает поток оформленных заказов "
+        "из Redis и записывает их в базу пачками"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Сколько заказов записывать одной транзакцией')
+        parser.add_argument('--block', type=int, default=1000, help='Сколько миллисекунд ждать новых заказов')
+        parser.add_argument('--claim-idle', type=int, default=60000,
+                            help='Через сколько миллисекунд забирать заказы, не подтверждённые другими обработчиками')
+        parser.add_argument('--reconcile-after', type=int, default=settings.CHECKOUT_RESERVATION_TIMEOUT,
+                            help='Через сколько секунд отменять оформления, не поставленные в очередь')
+        parser.add_argument('--consumer', default=f'{socket.gethostname()}-{os.getpid()}',
+                            help='Имя обработчика в группе потребителей')
+        parser.add_argument('--once', action='store_true', help='Обработать накопившиеся заказы и завершиться')
+
+    def handle(self, *args, **options):
+        block = None if options['once'] else options['block']
+        client = get_blocking_redis_client((block or 0) / 1000)
+        writer = OrderWriter(client, options['consumer'], options['batch_size'])
+        checkout = QueuedCheckout(client)
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        processed, idle, connected = 0, True, False
+        while self.running:
+            try:
+                if not connected:
+                    writer.ensure_group()
+                    connected = True
+                if idle:
+                    # при запуске и в простое: забираем зависшие заказы упавших обработчиков,
+                    # отменяем прерванные оформления и обновляем соединение с базой
+                    writer.claim(options['claim_idle'])
+                    self.reconcile(checkout, options['reconcile_after'])
+                    close_old_connections()
+                count = writer.process(block=block)
+            except RedisError as e:
+                if options['once']:
+                    raise CommandError(f'Redis недоступен: {e}')
+                # обработчик не завершается: после паузы чтение повторяется, неподтверждённые записи доставятся снова
+                self.stderr.write(f'Redis недоступен: {e}')
+                time.sleep(options['block'] / 1000)
+                idle, connected = True, False
+                continue
+            except DatabaseError as e:
+                if options['once']:
+                    raise CommandError(f'База недоступна: {e}')
+                # неподтверждённая пачка доставится снова, в простое сбрасывается сломанное соединение с базой
+                self.stderr.write(f'База недоступна: {e}')
+                time.sleep(options['block'] / 1000)
+                idle = True
+                continue
+            processed += count
+            idle = not count
+            if count:
+                self.stdout.write(f'Записано заказов: {count}')
+            elif options['once']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'Обработка завершена, всего записей: {processed}'))
+
+    def reconcile(self, checkout: QueuedCheckout, max_age: int) -> None:
+        cancelled = checkout.reconcile(max_age)
+        if cancelled:
+            self.stdout.write(f'Отменено незавершённых оформлений: {cancelled}')
+
+    def stop(self, signum, frame):
+        # текущая пачка дописывается, следующая уже не читается
+        self.running = False
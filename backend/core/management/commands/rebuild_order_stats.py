@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.services.order_stats import rebuild_order_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересобирает с нуля дневные агрегаты заказов по пользователям и ресторанам, "
+        "читая заказы частями по возрастанию id"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Сколько заказов читать и учитывать одной транзакцией')
+
+    def handle(self, *args, **options):
+        processed = rebuild_order_stats(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Агрегаты пересобраны, учтено заказов: {processed}'))
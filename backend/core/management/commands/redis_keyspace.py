@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django_redis import get_redis_connection
+from redis import RedisError
+
+from config.redis import get_redis_client
+from core.services.keyspace import compact_carts, keyspace_report
+
+
+class Command(BaseCommand):
+    help = (
+        "Обходит ключи Redis командой SCAN и выводит число ключей, занятую память и число ключей "
+        "без времени жизни по шаблонам ключей. С --compact перед отчётом выполняет проход сжатия корзин"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--match', default='*', help='Шаблон отбора ключей')
+        parser.add_argument('--count', type=int, default=1000, help='Сколько ключей запрашивать за итерацию SCAN')
+        parser.add_argument('--cache', action='store_true', help='Обойти Redis кэша Django вместо Redis данных')
+        parser.add_argument('--compact', action='store_true',
+                            help='Очистить корзины, назначить им время жизни и удалить осиротевшие снимки цен')
+
+    def handle(self, *args, **options):
+        client = get_redis_connection('default') if options['cache'] else get_redis_client()
+        try:
+            if options['compact']:
+                if options['cache']:
+                    raise CommandError('Сжатие выполняется только для Redis данных')
+                result = compact_carts(client, options['count'])
+                self.stdout.write(
+                    f'Корзин: {result.carts}, удалено позиций: {result.removed_items}, '
+                    f'назначено время жизни: {result.expire_set}, удалено снимков цен: {result.removed_snapshots}'
+                )
+            report = keyspace_report(client, options['match'], options['count'])
+        except RedisError as e:
+            raise CommandError(f'Redis недоступен: {e}')
+
+        width = max([len('pattern'), *map(len, report)])
+        self.stdout.write(f"{'pattern':<{width}} {'keys':>10} {'memory, KB':>12} {'no ttl':>10}")
+        for pattern, stats in sorted(report.items(), key=lambda item: (-(item[1].memory or 0), -item[1].keys)):
+            memory = '-' if stats.memory is None else f'{stats.memory / 1024:.1f}'
+            self.stdout.write(f'{pattern:<{width}} {stats.keys:>10} {memory:>12} {stats.no_ttl:>10}')
@@ -0,0 +1,179 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from config.metrics import percentile
+from config.sqlite import apply_pragmas
+
+SCHEMA = """
+CREATE TABLE restaurant (id INTEGER PRIMARY KEY, name TEXT NOT NULL, created_at REAL NOT NULL);
+CREATE TABLE dish (id INTEGER PRIMARY KEY, restaurant_id INTEGER NOT NULL REFERENCES restaurant (id),
+                   name TEXT NOT NULL, price NUMERIC NOT NULL);
+CREATE INDEX dish_restaurant ON dish (restaurant_id);
+CREATE TABLE user (id INTEGER PRIMARY KEY, balance NUMERIC NOT NULL);
+CREATE TABLE "order" (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id),
+                      created_at REAL NOT NULL, total NUMERIC NOT NULL);
+CREATE INDEX order_user ON "order" (user_id, created_at);
+CREATE TABLE order_item (id INTEGER PRIMARY KEY, order_id INTEGER NOT NULL REFERENCES "order" (id),
+                         dish_id INTEGER NOT NULL REFERENCES dish (id), quantity INTEGER NOT NULL,
+                         unit_price NUMERIC NOT NULL, dish_name TEXT NOT NULL);
+CREATE INDEX order_item_order ON order_item (order_id);
+"""
+
+ORDER_HISTORY = 'SELECT id, created_at, total FROM "order" WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 10'
+ORDER_ITEMS = 'SELECT order_id, dish_id, quantity, unit_price, dish_name FROM order_item WHERE order_id IN ({})'
+RESTAURANTS = 'SELECT id, name FROM restaurant ORDER BY created_at, id LIMIT 20'
+DISHES = 'SELECT id, restaurant_id, name, price FROM dish WHERE restaurant_id IN ({})'
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность SQLite при смешанной нагрузке чтения (меню, история заказов) "
+        "и оформления заказов с настройками SQLite по умолчанию и с PRAGMA из SQLITE_PRAGMAS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4, help='Число потоков чтения')
+        parser.add_argument('--writers', type=int, default=2, help='Число потоков оформления заказов')
+        parser.add_argument('--duration', type=float, default=5.0, help='Длительность прогона каждого режима, секунды')
+        parser.add_argument('--restaurants', type=int, default=200)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=20000, help='Число заказов в начальных данных')
+
+    def handle(self, *args, **options):
+        modes = {
+            # как у Django без настройки: журнал отката, synchronous=FULL и таймаут 5 секунд у sqlite3.connect
+            'default': {},
+            'tuned': settings.SQLITE_PRAGMAS,
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for mode, pragmas in modes.items():
+                path = os.path.join(directory, f'{mode}.sqlite3')
+                self.populate(path, options)
+                result = self.run_mode(path, pragmas, options)
+                self.stdout.write(
+                    f"{mode:<8} reads/s {result['reads']:>9.1f}  checkouts/s {result['writes']:>8.1f}  "
+                    f"read p95 {result['read_p95']:>7.2f} ms  checkout p95 {result['write_p95']:>7.2f} ms  "
+                    f"busy errors {result['errors']}"
+                )
+
+    def populate(self, path: str, options: dict) -> None:
+        rng = random.Random(0)
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.executescript(SCHEMA)
+            now = time.time()
+            connection.executemany(
+                'INSERT INTO restaurant (id, name, created_at) VALUES (?, ?, ?)',
+                [(i, f'Restaurant {i}', now + i) for i in range(1, options['restaurants'] + 1)],
+            )
+            connection.executemany(
+                'INSERT INTO dish (restaurant_id, name, price) VALUES (?, ?, ?)',
+                [(i, f'Dish {i}-{j}', rng.randint(100, 2000) / 10)
+                 for i in range(1, options['restaurants'] + 1) for j in range(30)],
+            )
+            connection.executemany(
+                'INSERT INTO user (id, balance) VALUES (?, ?)',
+                [(i, 10 ** 9) for i in range(1, options['users'] + 1)],
+            )
+            connection.executemany(
+                'INSERT INTO "order" (user_id, created_at, total) VALUES (?, ?, ?)',
+                [(rng.randint(1, options['users']), now - i, 100) for i in range(options['orders'])],
+            )
+            connection.execute(
+                'INSERT INTO order_item (order_id, dish_id, quantity, unit_price, dish_name) '
+                'SELECT id, 1 + id % 100, 1, 100, \'Dish\' FROM "order"'
+            )
+        connection.close()
+
+    def run_mode(self, path: str, pragmas: dict, options: dict) -> dict:
+        stop = threading.Event()
+        lock = threading.Lock()
+        read_latencies, write_latencies = [], []
+        errors = [0]
+
+        def connect() -> sqlite3.Connection:
+            connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            apply_pragmas(connection, pragmas)
+            return connection
+
+        def reader(seed: int) -> None:
+            rng = random.Random(seed)
+            connection = connect()
+            latencies = []
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    if rng.random() < 0.5:
+                        user_id = rng.randint(1, options['users'])
+                        order_ids = [row[0] for row in connection.execute(ORDER_HISTORY, (user_id,))]
+                        if order_ids:
+                            placeholders = ','.join('?' * len(order_ids))
+                            connection.execute(ORDER_ITEMS.format(placeholders), order_ids).fetchall()
+                    else:
+                        ids = [row[0] for row in connection.execute(RESTAURANTS)]
+                        connection.execute(DISHES.format(','.join('?' * len(ids))), ids).fetchall()
+                except sqlite3.OperationalError:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+            connection.close()
+            with lock:
+                read_latencies.extend(latencies)
+
+        def writer(seed: int) -> None:
+            rng = random.Random(seed)
+            connection = connect()
+            latencies = []
+            while not stop.is_set():
+                user_id = rng.randint(1, options['users'])
+                started = time.perf_counter()
+                try:
+                    # как оформление заказа: транзакция с заказом, позициями и списанием баланса
+                    with connection:
+                        cursor = connection.execute(
+                            'INSERT INTO "order" (user_id, created_at, total) VALUES (?, ?, ?)',
+                            (user_id, time.time(), 300),
+                        )
+                        connection.executemany(
+                            'INSERT INTO order_item (order_id, dish_id, quantity, unit_price, dish_name) '
+                            'VALUES (?, ?, 1, 100, \'Dish\')',
+                            [(cursor.lastrowid, rng.randint(1, 100)) for _ in range(3)],
+                        )
+                        connection.execute(
+                            'UPDATE user SET balance = balance - 300 WHERE id = ? AND balance >= 300', (user_id,),
+                        )
+                except sqlite3.OperationalError:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+            connection.close()
+            with lock:
+                write_latencies.extend(latencies)
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(options['readers'])]
+        threads += [threading.Thread(target=writer, args=(100 + i,)) for i in range(options['writers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return {
+            'reads': len(read_latencies) / elapsed,
+            'writes': len(write_latencies) / elapsed,
+            'read_p95': percentile(sorted(read_latencies), 0.95) * 1000,
+            'write_p95': percentile(sorted(write_latencies), 0.95) * 1000,
+            'errors': errors[0],
+        }
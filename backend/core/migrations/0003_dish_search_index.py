@@ -0,0 +1,56 @@
+from django.db import migrations
+
+# Полнотекстовый индекс названий блюд на SQLite FTS5: внешняя таблица содержимого core_dish,
+# синхронизация триггерами, unicode61 приводит к нижнему регистру в том числе кириллицу
+FORWARD_SQL = [
+    """
+    CREATE VIRTUAL TABLE core_dish_fts USING fts5(
+        name, content='core_dish', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER core_dish_fts_insert AFTER INSERT ON core_dish BEGIN
+        INSERT INTO core_dish_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER core_dish_fts_delete AFTER DELETE ON core_dish BEGIN
+        INSERT INTO core_dish_fts(core_dish_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    """,
+    """
+    CREATE TRIGGER core_dish_fts_update AFTER UPDATE OF name ON core_dish BEGIN
+        INSERT INTO core_dish_fts(core_dish_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO core_dish_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    "INSERT INTO core_dish_fts(core_dish_fts) VALUES ('rebuild')",
+]
+
+REVERSE_SQL = [
+    "DROP TRIGGER IF EXISTS core_dish_fts_update",
+    "DROP TRIGGER IF EXISTS core_dish_fts_delete",
+    "DROP TRIGGER IF EXISTS core_dish_fts_insert",
+    "DROP TABLE IF EXISTS core_dish_fts",
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        # на других СУБД поиск выполняется без полнотекстового индекса
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(FORWARD_SQL), run_sqlite(REVERSE_SQL)),
+    ]
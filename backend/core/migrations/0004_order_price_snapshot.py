@@ -0,0 +1,62 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_snapshots(apps, schema_editor):
+    """
+    Для существующих позиций фиксирует текущие цену и название блюда, других данных о цене на момент заказа нет
+    """
+    Dish = apps.get_model("core", "Dish")
+    Order = apps.get_model("core", "Order")
+    OrderItem = apps.get_model("core", "OrderItem")
+
+    dishes = Dish.objects.filter(id=OuterRef("dish_id"))
+    OrderItem.objects.update(
+        unit_price=Subquery(dishes.values("price")[:1]),
+        dish_name=Subquery(dishes.values("name")[:1]),
+    )
+    totals = (
+        OrderItem.objects.filter(order_id=OuterRef("id"))
+        .values("order_id")
+        .annotate(total=Sum(F("quantity") * F("unit_price")))
+        .values("total")
+    )
+    Order.objects.update(total=Coalesce(Subquery(totals), 0, output_field=models.DecimalField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_dish_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="total",
+            field=models.DecimalField(
+                decimal_places=2, default=0, max_digits=12, verbose_name="Сумма заказа"
+            ),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="unit_price",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                default=0,
+                max_digits=10,
+                verbose_name="Цена за единицу",
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="dish_name",
+            field=models.CharField(
+                blank=True, max_length=100, verbose_name="Название блюда"
+            ),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_order_price_snapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="reference",
+            field=models.UUIDField(
+                blank=True, editable=False, null=True, unique=True, verbose_name="Номер оформления"
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.14 on 2026-10-18 04:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Число заказов')),
+                ('items_count', models.PositiveIntegerField(default=0, verbose_name='Число блюд')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.restaurant', verbose_name='Заведение')),
+            ],
+            options={
+                'verbose_name': 'Статистика ресторана за день',
+                'verbose_name_plural': 'Статистика ресторанов по дням',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Число заказов')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма заказов')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Статистика пользователя за день',
+                'verbose_name_plural': 'Статистика пользователей по дням',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='restaurantdailystats',
+            constraint=models.UniqueConstraint(fields=('restaurant', 'day'), name='restaurant_daily_stats_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='userdailystats',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='user_daily_stats_unique'),
+        ),
+    ]
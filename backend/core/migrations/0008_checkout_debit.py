@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-18 04:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_order_daily_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutDebit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.UUIDField(unique=True, verbose_name='Номер оформления')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Сумма списания')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата списания')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Списание за оформляемый заказ',
+                'verbose_name_plural': 'Списания за оформляемые заказы',
+            },
+        ),
+    ]
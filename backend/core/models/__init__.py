@@ -2,3 +2,5 @@ from .dish import Dish
 from .order import Order
 from .restaurant import Restaurant
 from .order_item import OrderItem
+from .order_stats import RestaurantDailyStats, UserDailyStats
+from .checkout_debit import CheckoutDebit
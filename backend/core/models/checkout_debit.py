@@ -0,0 +1,23 @@
+from django.db import models
+from django.utils.translation import gettext as _
+
+from users.models import CustomUser
+
+
+class CheckoutDebit(models.Model):
+    """
+    Списание средств за заказ, оформленный с отложенной записью (CHECKOUT_MODE=queue), ещё не записанный в базу.
+    Создаётся в одной транзакции со списанием и удаляется либо при записи заказа, либо при возврате средств,
+    поэтому заказ не может быть одновременно записан и возвращён
+    """
+    reference = models.UUIDField(unique=True, verbose_name="Номер оформления")
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Сумма списания")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата списания")
+
+    class Meta:
+        verbose_name = _("Списание за оформляемый заказ")
+        verbose_name_plural = _("Списания за оформляемые заказы")
+
+    def __str__(self):
+        return f"Списание {self.amount} по оформлению {self.reference}"
@@ -13,6 +13,10 @@ class Dish(models.Model):
     class Meta:
         verbose_name = _("Блюда")
         verbose_name_plural = _("Блюда")
+        indexes = [
+            # меню ресторана и поиск блюда по названию в пределах ресторана
+            models.Index(fields=['restaurant', 'name'], name='dish_restaurant_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -6,10 +6,17 @@ from users.models import CustomUser
 class Order(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Пользователь")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата добавления")
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Сумма заказа")
+    # идентификатор, выдаваемый клиенту при отложенной записи заказа (CHECKOUT_MODE=queue)
+    reference = models.UUIDField(null=True, blank=True, unique=True, editable=False, verbose_name="Номер оформления")
 
     class Meta:
         verbose_name = _("Заказ")
         verbose_name_plural = _("Заказы")
+        indexes = [
+            # история заказов пользователя: фильтр по user и курсор (created_at, id) по убыванию
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Заказ № {self.id} от {self.created_at}"
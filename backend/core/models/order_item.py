@@ -9,11 +9,25 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     dish = models.ForeignKey(Dish, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    # цена и название блюда фиксируются на момент оформления заказа
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, verbose_name="Цена за единицу")
+    dish_name = models.CharField(max_length=100, blank=True, verbose_name="Название блюда")
 
     class Meta:
         verbose_name = _("Позиция")
         verbose_name_plural = _("Позиции")
 
     def __str__(self):
-        return f"{self.quantity} {self.dish}"
+        return f"{self.quantity} {self.dish_name or self.dish}"
 
+    def save(self, *args, **kwargs):
+        # позиции, созданные не через оформление заказа (например, в админке), берут текущие данные блюда
+        if self.unit_price is None:
+            self.unit_price = self.dish.price
+        if not self.dish_name:
+            self.dish_name = self.dish.name
+        super().save(*args, **kwargs)
+
+    @property
+    def price(self):
+        return self.quantity * self.unit_price
@@ -0,0 +1,46 @@
+from django.db import models
+from django.utils.translation import gettext as _
+
+from users.models import CustomUser
+from .restaurant import Restaurant
+
+
+class UserDailyStats(models.Model):
+    """
+    Заказы пользователя за день, обновляются при оформлении заказа (core.services.order_stats)
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+    day = models.DateField(verbose_name="День")
+    orders_count = models.PositiveIntegerField(default=0, verbose_name="Число заказов")
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Сумма заказов")
+
+    class Meta:
+        verbose_name = _("Статистика пользователя за день")
+        verbose_name_plural = _("Статистика пользователей по дням")
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='user_daily_stats_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.day}: {self.orders_count} на {self.total}"
+
+
+class RestaurantDailyStats(models.Model):
+    """
+    Заказы блюд ресторана за день, обновляются при оформлении заказа (core.services.order_stats)
+    """
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, verbose_name="Заведение")
+    day = models.DateField(verbose_name="День")
+    orders_count = models.PositiveIntegerField(default=0, verbose_name="Число заказов")
+    items_count = models.PositiveIntegerField(default=0, verbose_name="Число блюд")
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Выручка")
+
+    class Meta:
+        verbose_name = _("Статистика ресторана за день")
+        verbose_name_plural = _("Статистика ресторанов по дням")
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'day'], name='restaurant_daily_stats_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant} {self.day}: {self.orders_count} на {self.total}"
@@ -9,6 +9,10 @@ class Restaurant(models.Model):
     class Meta:
         verbose_name = _("Ресторан")
         verbose_name_plural = _("Рестораны")
+        indexes = [
+            # упорядоченный список ключей пагинации (created_at, id) читается только из индекса
+            models.Index(fields=['created_at', 'id'], name='restaurant_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
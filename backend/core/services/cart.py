@@ -0,0 +1,630 @@
+"""
+Работа с корзиной пользователя и расчёт её стоимости
+"""
+
+import json
+import logging
+from decimal import Decimal
+from typing import Iterable, NamedTuple
+
+from django.conf import settings
+from redis import Redis, RedisError
+from redis.asyncio import Redis as AsyncRedis
+
+from core.models import Dish
+
+logger = logging.getLogger(__name__)
+
+# Хэш с кэшем цен и названий блюд: dish_id -> {"name": ..., "price": ..., "restaurant_id": ...}
+CATALOG_KEY = 'catalog:dishes'
+# Версия каталога цен: увеличивается при каждом изменении или удалении блюда любого ресторана.
+# Защищает запись в кэш цен и позволяет не читать версии ресторанов, пока каталог не менялся вовсе
+CATALOG_VERSION_KEY = 'catalog:version'
+# Множество ID существующих блюд, по нему скрипты корзины проверяют блюдо без обращения к базе
+DISH_IDS_KEY = 'catalog:dish_ids'
+
+# Коды возврата скриптов корзины
+DISH_NOT_FOUND = -1
+DISH_IDS_COLD = -2
+
+# Скрипты изменения корзины продлевают её время жизни (ARGV[3] - CART_TTL), брошенные корзины истекают сами
+
+# KEYS[1] - корзина, KEYS[2] - множество ID блюд; ARGV[1] - ID блюда, ARGV[2] - количество, ARGV[3] - время жизни
+ADD_TO_CART_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return -2
+end
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 0 then
+    return -1
+end
+local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return quantity
+"""
+
+# KEYS[1] - корзина; ARGV[1] - ID блюда, ARGV[2] - количество, ARGV[3] - время жизни
+REMOVE_FROM_CART_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+if not current then
+    return -1
+end
+local quantity = tonumber(ARGV[2])
+local remaining = 0
+if current <= quantity then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+else
+    remaining = redis.call('HINCRBY', KEYS[1], ARGV[1], -quantity)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return remaining
+"""
+
+# Записывает блюда в кэш цен, только если версия каталога не изменилась с момента чтения из базы,
+# иначе параллельно изменённое блюдо вернулось бы в кэш со старой ценой.
+# Время жизни назначается кэшу при создании и не продлевается: сброс цены, потерянный при недоступности Redis,
+# перестаёт действовать не позже чем через CATALOG_CACHE_TTL
+# KEYS[1] - кэш цен, KEYS[2] - версия каталога; ARGV[1] - прочитанная версия, ARGV[2] - время жизни кэша,
+# далее пары ID блюда и данные блюда
+CACHE_DISHES_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+if redis.call('TTL', KEYS[1]) == -1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+# Добавляет ID только в уже прогретое множество, иначе оно бы считалось полным с одним элементом
+ADD_DISH_ID_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def cart_key(user_id: int) -> str:
+    return f'cart:{user_id}'
+
+
+def restaurant_version_key(restaurant_id: int) -> str:
+    """
+    Версия блюд ресторана: увеличивается при изменении или удалении его блюда,
+    по ней проверяются снимки цен корзин с блюдами этого ресторана
+    """
+    return f'catalog:version:{restaurant_id}'
+
+
+def priced_cart_key(user_id: int) -> str:
+    return f'cart:priced:{user_id}'
+
+
+class DishInfo(NamedTuple):
+    id: int
+    name: str
+    price: Decimal
+    restaurant_id: int
+
+
+class CartSnapshot(NamedTuple):
+    catalog_version: int
+    versions: dict[int, int]
+    dishes: dict[int, DishInfo]
+
+
+class PricedCart(NamedTuple):
+    quantities: dict[int, int]
+    dishes: dict[int, DishInfo]
+    total: Decimal
+    positions: list[dict]
+
+
+def parse_cart(cart_items: dict) -> dict[int, int]:
+    return {int(dish_id): int(quantity) for dish_id, quantity in cart_items.items()}
+
+
+def decode_dish(dish_id: int, raw: bytes) -> DishInfo | None:
+    data = json.loads(raw)
+    if 'restaurant_id' not in data:
+        # запись, закэшированная до появления версий ресторанов, перечитывается из базы
+        return None
+    return DishInfo(dish_id, data['name'], Decimal(data['price']), data['restaurant_id'])
+
+
+def encode_dish(name: str, price: Decimal, restaurant_id: int) -> str:
+    return json.dumps({'name': name, 'price': str(price), 'restaurant_id': restaurant_id})
+
+
+def parse_version(raw: bytes | None) -> int:
+    return int(raw or 0)
+
+
+def cart_restaurant_ids(dishes: dict[int, DishInfo]) -> list[int]:
+    return sorted({dish.restaurant_id for dish in dishes.values()})
+
+
+def encode_snapshot(catalog_version: int, versions: dict[int, int], quantities: dict[int, int],
+                    dishes: dict[int, DishInfo]) -> str:
+    """
+    Снимок цен корзины: версии каталога и ресторанов её блюд, по которым она рассчитана,
+    состав корзины и цены её блюд
+    """
+    return json.dumps({
+        'catalog_version': catalog_version,
+        'versions': versions,
+        'dish_ids': sorted(quantities),
+        'dishes': {dish.id: [dish.name, str(dish.price), dish.restaurant_id] for dish in dishes.values()},
+    })
+
+
+def decode_snapshot(raw: bytes | None, quantities: dict[int, int]) -> CartSnapshot | None:
+    """
+    Разбирает снимок цен, если он рассчитан для тех же блюд. Изменение только количества блюд снимок не сбрасывает,
+    актуальность цен проверяет snapshot_is_current
+    :return: снимок или None, если снимок отсутствует или рассчитан для другого набора блюд
+    """
+    if raw is None:
+        return None
+    snapshot = json.loads(raw)
+    if 'versions' not in snapshot or snapshot['dish_ids'] != sorted(quantities):
+        return None
+    return CartSnapshot(
+        snapshot['catalog_version'],
+        {int(restaurant_id): version for restaurant_id, version in snapshot['versions'].items()},
+        {
+            int(dish_id): DishInfo(int(dish_id), name, Decimal(price), restaurant_id)
+            for dish_id, (name, price, restaurant_id) in snapshot['dishes'].items()
+        },
+    )
+
+
+def snapshot_version_keys(snapshot: CartSnapshot, catalog_version: int) -> list[str]:
+    """
+    Ключи версий ресторанов, которые нужно прочитать для проверки снимка: пока каталог не менялся вовсе, никакие
+    """
+    if snapshot.catalog_version == catalog_version:
+        return []
+    return [restaurant_version_key(restaurant_id) for restaurant_id in snapshot.versions]
+
+
+def snapshot_is_current(snapshot: CartSnapshot, catalog_version: int, versions: list[bytes | None]) -> bool:
+    """
+    Снимок актуален, если с его расчёта не менялись блюда ресторанов из корзины.
+    Изменения блюд других ресторанов снимок не сбрасывают
+    :param versions: версии ресторанов по ключам snapshot_version_keys
+    """
+    if snapshot.catalog_version == catalog_version:
+        return True
+    return [parse_version(raw) for raw in versions] == list(snapshot.versions.values())
+
+
+def fresh_snapshot(catalog_version: int, restaurant_ids: list[int], raw_versions: list[bytes | None],
+                   quantities: dict[int, int], dishes: dict[int, DishInfo]) -> str | None:
+    """
+    Снимок для сохранения после расчёта цен. Версии ресторанов читаются уже после цен, поэтому соответствуют им,
+    только если версия каталога за время расчёта не изменилась; иначе снимок не сохраняется
+    :param raw_versions: версия каталога и версии ресторанов restaurant_ids, прочитанные после цен
+    :return: снимок или None
+    """
+    raw_catalog_version, *raw_versions = raw_versions
+    if parse_version(raw_catalog_version) != catalog_version:
+        return None
+    versions = dict(zip(restaurant_ids, map(parse_version, raw_versions)))
+    return encode_snapshot(catalog_version, versions, quantities, dishes)
+
+
+def split_cached_dishes(dish_ids: list[int], cached: list[bytes | None]) -> tuple[dict[int, DishInfo], list[int]]:
+    """
+    Разбирает ответ HMGET кэша цен
+    :return: найденные в кэше блюда и ID блюд, которые нужно прочитать из базы
+    """
+    dishes = {}
+    for dish_id, raw in zip(dish_ids, cached):
+        dish = decode_dish(dish_id, raw) if raw else None
+        if dish is not None:
+            dishes[dish_id] = dish
+    return dishes, [dish_id for dish_id in dish_ids if dish_id not in dishes]
+
+
+def catalog_mapping(dishes: Iterable[DishInfo]) -> list:
+    """
+    Аргументы CACHE_DISHES_SCRIPT после версии и времени жизни: пары ID блюда и данные блюда
+    """
+    args = []
+    for dish in dishes:
+        args += [dish.id, encode_dish(dish.name, dish.price, dish.restaurant_id)]
+    return args
+
+
+def build_positions(quantities: dict[int, int], dishes: dict[int, DishInfo]) -> tuple[Decimal, list[dict]]:
+    """
+    Рассчитывает стоимость позиций корзины, позиции с удалёнными блюдами пропускаются
+    :param quantities: количество по ID блюд
+    :param dishes: сведения о блюдах
+    :return: общая стоимость и список позиций
+    """
+    total_price = Decimal("0.00")
+    positions = []
+    for dish_id, quantity in quantities.items():
+        dish = dishes.get(dish_id)
+        if dish is None:
+            continue
+        item_total_price = dish.price * quantity
+        total_price += item_total_price
+        positions.append({
+            'dish_id': dish.id,
+            'name': dish.name,
+            'quantity': quantity,
+            'price': item_total_price,
+        })
+    return total_price, positions
+
+
+def priced_cart(quantities: dict[int, int], dishes: dict[int, DishInfo]) -> PricedCart:
+    total_price, positions = build_positions(quantities, dishes)
+    return PricedCart(quantities, dishes, total_price, positions)
+
+
+def queue_cart_operations(pipe, user_id: int, operations: list[dict]) -> None:
+    """
+    Добавляет в конвейер (синхронный или redis.asyncio) команды операций над корзиной, продление её времени жизни
+    и чтение результата последней командой
+    """
+    key = cart_key(user_id)
+    for operation in operations:
+        dish_id, quantity = operation['dish_id'], operation['quantity']
+        if operation['op'] == 'add':
+            pipe.hincrby(key, dish_id, quantity)
+        elif operation['op'] == 'remove':
+            pipe.eval(REMOVE_FROM_CART_SCRIPT, 1, key, dish_id, quantity, settings.CART_TTL)
+        elif quantity:
+            pipe.hset(key, dish_id, quantity)
+        else:
+            pipe.hdel(key, dish_id)
+    pipe.expire(key, settings.CART_TTL)
+    pipe.hgetall(key)
+
+
+def changed_dish_ids(dish_ids: list[int], current: set[int]) -> tuple[set[int], set[int]]:
+    """
+    Блюда, созданные и удалённые после чтения dish_ids для прогрева множества ID блюд
+    :param dish_ids: ID блюд, из которых собрано множество
+    :param current: ID блюд, прочитанные из базы после подмены множества
+    :return: созданные и удалённые ID блюд
+    """
+    return current.difference(dish_ids), set(dish_ids).difference(current)
+
+
+def queue_dish_ids_fixup(pipe, created: set[int], deleted: set[int]) -> None:
+    """
+    Добавляет в пайплайн исправление прогретого множества ID блюд
+    """
+    if created:
+        pipe.sadd(DISH_IDS_KEY, *created)
+    if deleted:
+        pipe.srem(DISH_IDS_KEY, *deleted)
+
+
+class CartPricing:
+    """
+    Расчёт стоимости корзины без обращения к базе в типичном случае.
+
+    Цены и названия блюд берутся из хэша CATALOG_KEY, отсутствующие в кэше блюда
+    подгружаются из базы одним запросом и записываются в кэш, если версия каталога
+    за это время не изменилась. Рассчитанные цены корзины сохраняются снимком с версиями
+    каталога и ресторанов её блюд: пока каталог и набор блюд в корзине не изменились, повторный расчёт
+    обходится одним конвейером команд Redis, а после изменения блюд других ресторанов - ещё одним MGET
+    их версий.
+    """
+
+    def __init__(self, client: Redis):
+        self.client = client
+        self._cache_dishes = client.register_script(CACHE_DISHES_SCRIPT)
+
+    def resolve_dishes(self, dish_ids: Iterable[int], version: int | None = None) -> dict[int, DishInfo]:
+        """
+        Возвращает сведения о блюдах по их ID, блюда, которых нет в базе, в результат не попадают
+        :param dish_ids: ID блюд
+        :param version: версия каталога, прочитанная до обращения к кэшу; None - прочитать вместе с кэшем
+        :return: словарь dish_id -> DishInfo
+        """
+        dish_ids = list(dish_ids)
+        if not dish_ids:
+            return {}
+
+        if version is None:
+            with self.client.pipeline(transaction=False) as pipe:
+                pipe.get(CATALOG_VERSION_KEY)
+                pipe.hmget(CATALOG_KEY, dish_ids)
+                raw_version, cached = pipe.execute()
+            version = parse_version(raw_version)
+        else:
+            cached = self.client.hmget(CATALOG_KEY, dish_ids)
+        dishes, missing = split_cached_dishes(dish_ids, cached)
+
+        if missing:
+            fetched = [
+                DishInfo(*row)
+                for row in Dish.objects.filter(id__in=missing).values_list('id', 'name', 'price', 'restaurant_id')
+            ]
+            dishes.update({dish.id: dish for dish in fetched})
+            if fetched:
+                self._cache_dishes(
+                    keys=[CATALOG_KEY, CATALOG_VERSION_KEY],
+                    args=[version, settings.CATALOG_CACHE_TTL, *catalog_mapping(fetched)],
+                )
+        return dishes
+
+    def price(self, cart_items: dict) -> tuple[Decimal, list[dict]]:
+        """
+        Рассчитывает стоимость позиций корзины, позиции с удалёнными блюдами пропускаются
+        :param cart_items: содержимое хэша корзины dish_id -> quantity
+        :return: общая стоимость и список позиций
+        """
+        quantities = parse_cart(cart_items)
+        return build_positions(quantities, self.resolve_dishes(quantities))
+
+    def price_cart(self, user_id: int) -> PricedCart:
+        """
+        Рассчитывает корзину пользователя, используя снимок цен, если он не устарел.
+        Просмотр корзины продлевает её время жизни
+        """
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(cart_key(user_id))
+            pipe.get(CATALOG_VERSION_KEY)
+            pipe.get(priced_cart_key(user_id))
+            pipe.expire(cart_key(user_id), settings.CART_TTL)
+            cart_items, raw_version, snapshot, _ = pipe.execute()
+        return self.price_snapshot(user_id, parse_cart(cart_items), parse_version(raw_version), snapshot)
+
+    def price_quantities(self, user_id: int, quantities: dict[int, int]) -> PricedCart:
+        """
+        Рассчитывает уже прочитанное содержимое корзины пользователя, например зарезервированное при оформлении
+        """
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.get(CATALOG_VERSION_KEY)
+            pipe.get(priced_cart_key(user_id))
+            raw_version, snapshot = pipe.execute()
+        return self.price_snapshot(user_id, quantities, parse_version(raw_version), snapshot)
+
+    def price_snapshot(self, user_id: int, quantities: dict[int, int], version: int,
+                       snapshot: bytes | None) -> PricedCart:
+        cached = decode_snapshot(snapshot, quantities)
+        if cached is not None:
+            keys = snapshot_version_keys(cached, version)
+            if snapshot_is_current(cached, version, self.client.mget(keys) if keys else []):
+                return priced_cart(quantities, cached.dishes)
+
+        dishes = self.resolve_dishes(quantities, version)
+        restaurant_ids = cart_restaurant_ids(dishes)
+        if quantities:
+            raw_versions = self.client.mget([CATALOG_VERSION_KEY, *map(restaurant_version_key, restaurant_ids)])
+            fresh = fresh_snapshot(version, restaurant_ids, raw_versions, quantities, dishes)
+            if fresh is not None:
+                self.client.set(priced_cart_key(user_id), fresh, ex=settings.CART_SNAPSHOT_TTL)
+        return priced_cart(quantities, dishes)
+
+
+class AsyncCartPricing:
+    """
+    Асинхронный вариант CartPricing для redis.asyncio и асинхронного ORM
+    """
+
+    def __init__(self, client: AsyncRedis):
+        self.client = client
+        self._cache_dishes = client.register_script(CACHE_DISHES_SCRIPT)
+
+    async def resolve_dishes(self, dish_ids: Iterable[int], version: int | None = None) -> dict[int, DishInfo]:
+        dish_ids = list(dish_ids)
+        if not dish_ids:
+            return {}
+
+        if version is None:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.get(CATALOG_VERSION_KEY)
+                pipe.hmget(CATALOG_KEY, dish_ids)
+                raw_version, cached = await pipe.execute()
+            version = parse_version(raw_version)
+        else:
+            cached = await self.client.hmget(CATALOG_KEY, dish_ids)
+        dishes, missing = split_cached_dishes(dish_ids, cached)
+
+        if missing:
+            fetched = [
+                DishInfo(*row)
+                async for row in Dish.objects.filter(id__in=missing).values_list('id', 'name', 'price', 'restaurant_id')
+            ]
+            dishes.update({dish.id: dish for dish in fetched})
+            if fetched:
+                await self._cache_dishes(
+                    keys=[CATALOG_KEY, CATALOG_VERSION_KEY],
+                    args=[version, settings.CATALOG_CACHE_TTL, *catalog_mapping(fetched)],
+                )
+        return dishes
+
+    async def price(self, cart_items: dict) -> tuple[Decimal, list[dict]]:
+        quantities = parse_cart(cart_items)
+        return build_positions(quantities, await self.resolve_dishes(quantities))
+
+    async def price_cart(self, user_id: int) -> PricedCart:
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(cart_key(user_id))
+            pipe.get(CATALOG_VERSION_KEY)
+            pipe.get(priced_cart_key(user_id))
+            pipe.expire(cart_key(user_id), settings.CART_TTL)
+            cart_items, raw_version, snapshot, _ = await pipe.execute()
+        return await self.price_snapshot(user_id, parse_cart(cart_items), parse_version(raw_version), snapshot)
+
+    async def price_snapshot(self, user_id: int, quantities: dict[int, int], version: int,
+                             snapshot: bytes | None) -> PricedCart:
+        cached = decode_snapshot(snapshot, quantities)
+        if cached is not None:
+            keys = snapshot_version_keys(cached, version)
+            if snapshot_is_current(cached, version, await self.client.mget(keys) if keys else []):
+                return priced_cart(quantities, cached.dishes)
+
+        dishes = await self.resolve_dishes(quantities, version)
+        restaurant_ids = cart_restaurant_ids(dishes)
+        if quantities:
+            raw_versions = await self.client.mget([CATALOG_VERSION_KEY, *map(restaurant_version_key, restaurant_ids)])
+            fresh = fresh_snapshot(version, restaurant_ids, raw_versions, quantities, dishes)
+            if fresh is not None:
+                await self.client.set(priced_cart_key(user_id), fresh, ex=settings.CART_SNAPSHOT_TTL)
+        return priced_cart(quantities, dishes)
+
+
+class CartStore:
+    """
+    Изменение корзины серверными Lua-скриптами: проверка блюда и изменение количества
+    выполняются атомарно за один запрос к Redis
+    """
+
+    def __init__(self, client: Redis):
+        self.client = client
+        self._add = client.register_script(ADD_TO_CART_SCRIPT)
+        self._remove = client.register_script(REMOVE_FROM_CART_SCRIPT)
+
+    def add(self, user_id: int, dish_id: int, quantity: int) -> int | None:
+        """
+        Добавляет блюдо в корзину
+        :return: новое количество блюда в корзине или None, если блюдо не существует
+        """
+        keys = [cart_key(user_id), DISH_IDS_KEY]
+        result = self._add(keys=keys, args=[dish_id, quantity, settings.CART_TTL])
+        if result == DISH_IDS_COLD:
+            self.warm_dish_ids()
+            result = self._add(keys=keys, args=[dish_id, quantity, settings.CART_TTL])
+        if result in (DISH_NOT_FOUND, DISH_IDS_COLD):
+            return None
+        return result
+
+    def remove(self, user_id: int, dish_id: int, quantity: int) -> int | None:
+        """
+        Уменьшает количество блюда в корзине, удаляя позицию при достижении нуля
+        :return: оставшееся количество блюда или None, если блюда не было в корзине
+        """
+        result = self._remove(keys=[cart_key(user_id)], args=[dish_id, quantity, settings.CART_TTL])
+        if result == DISH_NOT_FOUND:
+            return None
+        return result
+
+    def apply(self, user_id: int, operations: list[dict]) -> dict[int, int]:
+        """
+        Применяет набор операций к корзине в одной транзакции Redis (MULTI/EXEC)
+        :param operations: операции вида {'op': 'add' | 'remove' | 'set', 'dish_id': ..., 'quantity': ...},
+            существование блюд должно быть проверено заранее
+        :return: содержимое корзины после применения операций
+        """
+        with self.client.pipeline() as pipe:
+            queue_cart_operations(pipe, user_id, operations)
+            cart_items = pipe.execute()[-1]
+        return parse_cart(cart_items)
+
+    def warm_dish_ids(self) -> None:
+        """
+        Заполняет множество ID блюд из базы, множество собирается во временном ключе
+        и подменяется атомарно через RENAME. Через CATALOG_CACHE_TTL множество истекает и прогревается заново,
+        поэтому изменения блюд, не дошедшие до Redis при его недоступности, не действуют бессрочно.
+
+        Блюда, созданные между чтением из базы и подменой, не попали бы в множество: пока его нет,
+        ADD_DISH_ID_SCRIPT ничего не делает, а RENAME затирает добавленное. Удалённые в этот промежуток блюда,
+        наоборот, вернулись бы в множество. Поэтому после подмены ID блюд читаются ещё раз, недостающие
+        добавляются, а удалённые убираются; блюда, созданные или удалённые позже, обновит sync_dish
+        """
+        dish_ids = list(Dish.objects.values_list('id', flat=True))
+        if not dish_ids:
+            return
+        tmp_key = f'{DISH_IDS_KEY}:warming'
+        with self.client.pipeline() as pipe:
+            pipe.delete(tmp_key)
+            for start in range(0, len(dish_ids), 10000):
+                pipe.sadd(tmp_key, *dish_ids[start:start + 10000])
+            pipe.rename(tmp_key, DISH_IDS_KEY)
+            pipe.expire(DISH_IDS_KEY, settings.CATALOG_CACHE_TTL)
+            pipe.execute()
+
+        created, deleted = changed_dish_ids(dish_ids, set(Dish.objects.values_list('id', flat=True)))
+        if created or deleted:
+            with self.client.pipeline() as pipe:
+                queue_dish_ids_fixup(pipe, created, deleted)
+                pipe.execute()
+
+
+class AsyncCartStore:
+    """
+    Асинхронный вариант CartStore для redis.asyncio, использует те же Lua-скрипты
+    """
+
+    def __init__(self, client: AsyncRedis):
+        self.client = client
+        self._add = client.register_script(ADD_TO_CART_SCRIPT)
+        self._remove = client.register_script(REMOVE_FROM_CART_SCRIPT)
+
+    async def add(self, user_id: int, dish_id: int, quantity: int) -> int | None:
+        keys = [cart_key(user_id), DISH_IDS_KEY]
+        result = await self._add(keys=keys, args=[dish_id, quantity, settings.CART_TTL])
+        if result == DISH_IDS_COLD:
+            await self.warm_dish_ids()
+            result = await self._add(keys=keys, args=[dish_id, quantity, settings.CART_TTL])
+        if result in (DISH_NOT_FOUND, DISH_IDS_COLD):
+            return None
+        return result
+
+    async def remove(self, user_id: int, dish_id: int, quantity: int) -> int | None:
+        result = await self._remove(keys=[cart_key(user_id)], args=[dish_id, quantity, settings.CART_TTL])
+        if result == DISH_NOT_FOUND:
+            return None
+        return result
+
+    async def apply(self, user_id: int, operations: list[dict]) -> dict[int, int]:
+        async with self.client.pipeline() as pipe:
+            queue_cart_operations(pipe, user_id, operations)
+            cart_items = (await pipe.execute())[-1]
+        return parse_cart(cart_items)
+
+    async def warm_dish_ids(self) -> None:
+        dish_ids = [dish_id async for dish_id in Dish.objects.values_list('id', flat=True)]
+        if not dish_ids:
+            return
+        tmp_key = f'{DISH_IDS_KEY}:warming'
+        async with self.client.pipeline() as pipe:
+            pipe.delete(tmp_key)
+            for start in range(0, len(dish_ids), 10000):
+                pipe.sadd(tmp_key, *dish_ids[start:start + 10000])
+            pipe.rename(tmp_key, DISH_IDS_KEY)
+            pipe.expire(DISH_IDS_KEY, settings.CATALOG_CACHE_TTL)
+            await pipe.execute()
+
+        current = {dish_id async for dish_id in Dish.objects.values_list('id', flat=True)}
+        created, deleted = changed_dish_ids(dish_ids, current)
+        if created or deleted:
+            async with self.client.pipeline() as pipe:
+                queue_dish_ids_fixup(pipe, created, deleted)
+                await pipe.execute()
+
+
+def sync_dish(client: Redis, dish_id: int, exists: bool, restaurant_ids: Iterable[int]) -> None:
+    """
+    Сбрасывает кэш цены блюда, увеличивает версии каталога и ресторанов блюда (снимки цен корзин
+    с блюдами этих ресторанов становятся устаревшими) и обновляет множество ID блюд,
+    ошибки Redis не должны ломать сохранение блюда: если Redis недоступен,
+    устаревшие цена и множество ID блюд истекают сами (CATALOG_CACHE_TTL, CART_SNAPSHOT_TTL)
+    :param restaurant_ids: ресторан блюда и, при переносе, ресторан, к которому оно относилось раньше
+    """
+    try:
+        with client.pipeline() as pipe:
+            pipe.hdel(CATALOG_KEY, dish_id)
+            pipe.incr(CATALOG_VERSION_KEY)
+            for restaurant_id in set(restaurant_ids):
+                pipe.incr(restaurant_version_key(restaurant_id))
+            if exists:
+                pipe.eval(ADD_DISH_ID_SCRIPT, 1, DISH_IDS_KEY, dish_id)
+            else:
+                pipe.srem(DISH_IDS_KEY, dish_id)
+            pipe.execute()
+    except RedisError:
+        logger.warning('Не удалось обновить кэш блюда %s', dish_id, exc_info=True)
@@ -0,0 +1,394 @@
+"""
+Оформление заказа с отложенной записью: корзина резервируется и ставится в поток Redis,
+а заказы записываются в базу пачками фоновым обработчиком (команда process_orders)
+"""
+
+import json
+import logging
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DataError, DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from redis import Redis, RedisError, ResponseError
+
+from core.models import CheckoutDebit, Order, OrderItem
+from core.services.cart import CartPricing, cart_key, parse_cart
+from core.services.order_stats import record_orders
+from users.models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, с которыми база отклоняет сам заказ: повторная запись не поможет, оформление отменяется
+REJECTED_ORDER_ERRORS = (IntegrityError, DataError)
+
+# Поток оформленных, но ещё не записанных в базу заказов и группа его обработчиков
+ORDER_STREAM_KEY = 'orders:stream'
+ORDER_GROUP = 'order-writers'
+
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# Незавершённые оформления: участник {user_id}:{reference}, вес - время резерва корзины.
+# Оформление снимается отсюда ровно один раз: либо вместе с постановкой заказа в поток, либо при отмене
+PENDING_CHECKOUTS_KEY = 'checkout:pending'
+
+# Переносит корзину в ключ резерва, отмечает оформление незавершённым и возвращает содержимое корзины.
+# Добавленные после резерва блюда попадают уже в новую корзину и в заказ не входят
+# KEYS[1] - корзина, KEYS[2] - резерв, KEYS[3] - незавершённые оформления;
+# ARGV[1] - участник, ARGV[2] - время резерва, ARGV[3] - время жизни резерва
+RESERVE_CART_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {}
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('ZADD', KEYS[3], ARGV[2], ARGV[1])
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# Ставит заказ в поток, если оформление ещё не отменено
+# KEYS[1] - поток, KEYS[2] - резерв, KEYS[3] - незавершённые оформления, KEYS[4] - статус;
+# ARGV[1] - участник, ARGV[2] - номер оформления, ARGV[3] - пользователь, ARGV[4] - сумма, ARGV[5] - позиции,
+# ARGV[6] - время жизни статуса
+ENQUEUE_ORDER_SCRIPT = """
+if redis.call('ZREM', KEYS[3], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('XADD', KEYS[1], '*', 'reference', ARGV[2], 'user_id', ARGV[3], 'total', ARGV[4], 'items', ARGV[5])
+redis.call('DEL', KEYS[2])
+redis.call('HSET', KEYS[4], 'status', 'pending', 'user_id', ARGV[3])
+redis.call('EXPIRE', KEYS[4], ARGV[6])
+return 1
+"""
+
+# Отменяет оформление, если заказ ещё не поставлен в поток: возвращает позиции из резерва в корзину,
+# не затирая добавленное за это время
+# KEYS[1] - корзина, KEYS[2] - резерв, KEYS[3] - незавершённые оформления; ARGV[1] - время жизни корзины,
+# ARGV[2] - участник
+RESTORE_CART_SCRIPT = """
+if redis.call('ZREM', KEYS[3], ARGV[2]) == 0 then
+    return -1
+end
+local items = redis.call('HGETALL', KEYS[2])
+for i = 1, #items, 2 do
+    redis.call('HINCRBY', KEYS[1], items[i], items[i + 1])
+end
+redis.call('DEL', KEYS[2])
+if #items > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return #items / 2
+"""
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def reserved_cart_key(reference: str) -> str:
+    return f'cart:reserved:{reference}'
+
+
+def order_status_key(reference: str) -> str:
+    return f'order:status:{reference}'
+
+
+def get_order_status(client: Redis, reference: str, user_id: int) -> dict | None:
+    """
+    Статус оформления заказа пользователя. Если статус в Redis уже истёк, заказ ищется в базе
+    :return: {'order': reference, 'status': ..., 'order_id': ...} или None, если заказ не найден
+    """
+    status = {key.decode(): value.decode() for key, value in client.hgetall(order_status_key(reference)).items()}
+    if status and int(status['user_id']) == user_id:
+        result = {'order': reference, 'status': status['status']}
+        if 'order_id' in status:
+            result['order_id'] = int(status['order_id'])
+        if 'error' in status:
+            result['error'] = status['error']
+        return result
+
+    order_id = Order.objects.filter(reference=reference, user_id=user_id).values_list('id', flat=True).first()
+    if order_id is None:
+        return None
+    return {'order': reference, 'status': STATUS_DONE, 'order_id': order_id}
+
+
+def pending_checkout(user_id: int, reference: str) -> str:
+    return f'{user_id}:{reference}'
+
+
+class QueuedCheckout:
+    """
+    Оформление заказа без записи заказа в базу в рамках запроса.
+
+    Корзина атомарно резервируется скриптом, цены берутся из кэша каталога, средства списываются
+    условным UPDATE вместе с записью CheckoutDebit (списание по-прежнему гарантировано до ответа клиенту),
+    после чего заказ ставится в поток ORDER_STREAM_KEY. При ошибке на любом шаге после резерва корзина
+    и средства возвращаются, а оформления, прерванные падением процесса, отменяет reconcile
+    """
+
+    def __init__(self, client: Redis):
+        self.client = client
+        self._reserve = client.register_script(RESERVE_CART_SCRIPT)
+        self._enqueue = client.register_script(ENQUEUE_ORDER_SCRIPT)
+        self._restore = client.register_script(RESTORE_CART_SCRIPT)
+
+    def submit(self, user: CustomUser) -> str:
+        """
+        Резервирует корзину, списывает средства и ставит заказ в очередь на запись
+        :return: номер оформления для запроса статуса
+        """
+        reference = uuid.uuid4().hex
+        reserved = self._reserve(
+            keys=[cart_key(user.id), reserved_cart_key(reference), PENDING_CHECKOUTS_KEY],
+            args=[pending_checkout(user.id, reference), time.time(), settings.CART_TTL],
+        )
+        if not reserved:
+            raise CheckoutError('Нет позиций в корзине для создания заказа')
+
+        debited = False
+        try:
+            quantities = parse_cart(dict(zip(reserved[::2], reserved[1::2])))
+            priced = CartPricing(self.client).price_quantities(user.id, quantities)
+            dishes, total_price = priced.dishes, priced.total
+            if len(dishes) != len(quantities):
+                raise CheckoutError('Некоторые блюда из корзины больше недоступны')
+
+            debited = debit_checkout(user, reference, total_price)
+            if not debited:
+                raise CheckoutError('Сумма списания превышает средства на балансе')
+
+            items = [
+                [dish_id, quantity, str(dishes[dish_id].price), dishes[dish_id].name]
+                for dish_id, quantity in quantities.items()
+            ]
+            if not self.enqueue(user.id, reference, total_price, items):
+                raise CheckoutError('Оформление заказа отменено по истечении времени')
+        except Exception:
+            # ошибки Redis и базы пробрасываются как есть, API отвечает на них 503 и 500
+            if self.cancel(user.id, reference) and debited:
+                user.balance += total_price
+            raise
+        return reference
+
+    def enqueue(self, user_id: int, reference: str, total: Decimal, items: list) -> bool:
+        """
+        Ставит заказ в поток и снимает отметку незавершённого оформления одним скриптом
+        :return: False, если оформление уже отменено
+        """
+        return bool(self._enqueue(
+            keys=[ORDER_STREAM_KEY, reserved_cart_key(reference), PENDING_CHECKOUTS_KEY, order_status_key(reference)],
+            args=[pending_checkout(user_id, reference), reference, user_id, str(total), json.dumps(items),
+                  settings.ORDER_STATUS_TTL],
+        ))
+
+    def cancel(self, user_id: int, reference: str) -> bool:
+        """
+        Отменяет незавершённое оформление: возвращает средства, если они были списаны, и корзину.
+        Средства возвращаются первыми: если это не удалось, оформление остаётся незавершённым
+        и отменяется следующим проходом reconcile. Повторная отмена ничего не меняет
+        :return: True, если средства и корзина возвращены
+        """
+        try:
+            refund_debit(reference)
+        except DatabaseError:
+            logger.exception('Не удалось вернуть средства по оформлению %s', reference)
+            return False
+        try:
+            self._restore(
+                keys=[cart_key(user_id), reserved_cart_key(reference), PENDING_CHECKOUTS_KEY],
+                args=[settings.CART_TTL, pending_checkout(user_id, reference)],
+            )
+        except RedisError:
+            logger.exception('Не удалось вернуть корзину пользователя %s', user_id)
+            return False
+        return True
+
+    def reconcile(self, max_age: float) -> int:
+        """
+        Отменяет оформления, не поставленные в поток дольше max_age секунд (процесс упал между резервом
+        корзины и постановкой заказа в очередь): возвращает средства и корзину, статус отмечается ошибкой
+        :return: число отменённых оформлений
+        """
+        cancelled = 0
+        for member in self.client.zrangebyscore(PENDING_CHECKOUTS_KEY, '-inf', time.time() - max_age):
+            user_id, reference = member.decode().split(':')
+            if not self.cancel(int(user_id), reference):
+                continue
+            cancelled += 1
+            key = order_status_key(reference)
+            with self.client.pipeline() as pipe:
+                pipe.hset(key, mapping={
+                    'status': STATUS_FAILED, 'user_id': user_id,
+                    'error': 'Оформление не завершено, средства и корзина возвращены',
+                })
+                pipe.expire(key, settings.ORDER_STATUS_TTL)
+                pipe.execute()
+        return cancelled
+
+
+def debit_checkout(user: CustomUser, reference: str, amount: Decimal) -> bool:
+    """
+    Списывает средства за оформляемый заказ и записывает списание в CheckoutDebit одной транзакцией
+    :return: True, если средства списаны
+    """
+    with transaction.atomic():
+        CheckoutDebit.objects.create(reference=uuid.UUID(reference), user_id=user.id, amount=amount)
+        if user.debit_balance(amount):
+            return True
+        transaction.set_rollback(True)
+    return False
+
+
+def refund_balance(user_id: int, amount: Decimal) -> None:
+    CustomUser.objects.filter(pk=user_id).update(balance=F('balance') + amount)
+
+
+def refund_debit(reference: str) -> Decimal | None:
+    """
+    Возвращает средства по оформлению, если заказ ещё не записан и средства ещё не возвращены.
+    Право на возврат даёт удаление записи CheckoutDebit, поэтому повторный или параллельный возврат ничего не делает
+    :return: возвращённая сумма или None
+    """
+    with transaction.atomic():
+        debit = CheckoutDebit.objects.select_for_update().filter(reference=uuid.UUID(reference)).first()
+        if debit is None or not CheckoutDebit.objects.filter(pk=debit.pk).delete()[0]:
+            return None
+        refund_balance(debit.user_id, debit.amount)
+    return debit.amount
+
+
+class OrderWriter:
+    """
+    Обработчик потока заказов: читает записи пачками через группу потребителей и записывает
+    каждую пачку в базу одной транзакцией. Запись идемпотентна по Order.reference, поэтому
+    повторная доставка после падения обработчика не создаёт дублей. Если пачка не записалась,
+    заказы записываются по одному, а незаписываемые отмечаются ошибкой с возвратом средств
+    """
+
+    def __init__(self, client: Redis, consumer: str, batch_size: int = 100):
+        self.client = client
+        self.consumer = consumer
+        self.batch_size = batch_size
+
+    def ensure_group(self) -> None:
+        try:
+            self.client.xgroup_create(ORDER_STREAM_KEY, ORDER_GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read(self, block: int | None = None) -> list[tuple[bytes, dict]]:
+        """
+        Возвращает пачку записей: сначала неподтверждённые записи этого обработчика, затем новые
+        :param block: сколько миллисекунд ждать новых записей, None - не ждать
+        """
+        for stream_id in ('0', '>'):
+            response = self.client.xreadgroup(
+                ORDER_GROUP, self.consumer, {ORDER_STREAM_KEY: stream_id}, count=self.batch_size,
+                block=block if stream_id == '>' else None,
+            )
+            entries = response[0][1] if response else []
+            if entries:
+                return entries
+        return []
+
+    def claim(self, min_idle: int) -> int:
+        """
+        Забирает себе записи, которые другие обработчики прочитали, но не подтвердили дольше min_idle мс
+        :return: число забранных записей
+        """
+        _, entries, _ = self.client.xautoclaim(
+            ORDER_STREAM_KEY, ORDER_GROUP, self.consumer, min_idle, count=self.batch_size,
+        )
+        return len(entries)
+
+    def process(self, block: int | None = None) -> int:
+        """
+        Читает и записывает одну пачку заказов. Отклонённые базой заказы (IntegrityError, DataError) отменяются
+        с возвратом средств; при остальных ошибках базы, например занятой или недоступной базе, исключение
+        пробрасывается, а записи остаются неподтверждёнными и доставляются повторно
+        :return: число обработанных записей
+        """
+        entries = self.read(block)
+        if not entries:
+            return 0
+
+        orders = [self.decode(fields) for _, fields in entries]
+        try:
+            statuses = self.write(orders)
+        except REJECTED_ORDER_ERRORS:
+            logger.warning('Не удалось записать пачку из %s заказов, запись по одному', len(orders), exc_info=True)
+            statuses = {}
+            for order in orders:
+                try:
+                    statuses.update(self.write([order]))
+                except REJECTED_ORDER_ERRORS:
+                    logger.exception('Не удалось записать заказ %s', order['reference'])
+                    refund_debit(order['reference'])
+                    statuses[order['reference']] = {
+                        'status': STATUS_FAILED, 'error': 'Заказ отклонён, средства возвращены',
+                    }
+
+        with self.client.pipeline() as pipe:
+            pipe.xack(ORDER_STREAM_KEY, ORDER_GROUP, *[entry_id for entry_id, _ in entries])
+            pipe.xdel(ORDER_STREAM_KEY, *[entry_id for entry_id, _ in entries])
+            for order in orders:
+                key = order_status_key(order['reference'])
+                pipe.hset(key, mapping={'user_id': order['user_id'], **statuses[order['reference']]})
+                pipe.expire(key, settings.ORDER_STATUS_TTL)
+            pipe.execute()
+        return len(entries)
+
+    @staticmethod
+    def decode(fields: dict) -> dict:
+        fields = {key.decode(): value.decode() for key, value in fields.items()}
+        return {
+            'reference': fields['reference'],
+            'user_id': int(fields['user_id']),
+            'total': Decimal(fields['total']),
+            'items': json.loads(fields['items']),
+        }
+
+    @staticmethod
+    def write(orders: list[dict]) -> dict[str, dict]:
+        """
+        Записывает заказы, их позиции и дневные агрегаты одной транзакцией, уже записанные заказы пропускаются.
+        Записываются только заказы с неизрасходованным списанием CheckoutDebit, оно удаляется в той же транзакции;
+        заказы, средства по которым уже возвращены при отмене оформления, отмечаются ошибкой
+        :return: статусы по номерам оформления
+        """
+        with transaction.atomic():
+            references = [uuid.UUID(order['reference']) for order in orders]
+            written = dict(Order.objects.filter(reference__in=references).values_list('reference', 'id'))
+            paid = set(
+                CheckoutDebit.objects.select_for_update()
+                .filter(reference__in=[reference for reference in references if reference not in written])
+                .values_list('reference', flat=True)
+            )
+            new_orders = [order for order in orders if uuid.UUID(order['reference']) in paid]
+            created = Order.objects.bulk_create([
+                Order(user_id=order['user_id'], total=order['total'], reference=uuid.UUID(order['reference']))
+                for order in new_orders
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=instance, dish_id=dish_id, quantity=quantity, unit_price=Decimal(price),
+                          dish_name=name)
+                for order, instance in zip(new_orders, created)
+                for dish_id, quantity, price, name in order['items']
+            ])
+            CheckoutDebit.objects.filter(reference__in=paid).delete()
+            record_orders(created)
+        written.update({instance.reference: instance.id for instance in created})
+        statuses = {}
+        for order in orders:
+            order_id = written.get(uuid.UUID(order['reference']))
+            statuses[order['reference']] = (
+                {'status': STATUS_DONE, 'order_id': order_id} if order_id is not None
+                else {'status': STATUS_FAILED, 'error': 'Оформление отменено, средства возвращены'}
+            )
+        return statuses
@@ -0,0 +1,68 @@
+"""
+Поиск блюд по названию
+"""
+
+import re
+
+from django.db import connections
+from django.db.models import Prefetch, QuerySet
+from django.db.models.expressions import RawSQL
+
+from core.models import Dish
+
+FTS_TABLE = 'core_dish_fts'
+
+
+def build_match_query(text: str) -> str:
+    """
+    Преобразует пользовательский ввод в запрос FTS5: каждое слово ищется по префиксу,
+    кавычки экранируют спецсимволы синтаксиса FTS5
+    """
+    return ' '.join(f'"{token}"*' for token in re.findall(r'\w+', text))
+
+
+def search_dishes(text: str, using: str, restaurant_id: int | None = None) -> QuerySet:
+    """
+    Ищет блюда по названию без учёта регистра с поиском по началу слов. Найденные блюда отбираются
+    подзапросом к полнотекстовому индексу без общего ограничения выдачи, поэтому поиск сочетается
+    с постраничным выводом ресторанов
+    :param text: поисковый запрос
+    :param using: база, в которой выполняется поиск (основная или реплика, по маршрутизатору)
+    :param restaurant_id: ограничить поиск блюдами ресторана
+    :return: блюда, отсортированные по релевантности
+    """
+    queryset = Dish.objects.using(using)
+    if restaurant_id is not None:
+        queryset = queryset.filter(restaurant_id=restaurant_id)
+
+    if connections[using].vendor != 'sqlite':
+        return queryset.filter(name__icontains=text).order_by('id')
+
+    query = build_match_query(text)
+    if not query:
+        return queryset.none()
+
+    dish_table = Dish._meta.db_table
+    found = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [query])
+    # ранг считается только для блюд подгружаемой страницы ресторанов
+    rank = RawSQL(
+        f'SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {dish_table}.id',
+        [query],
+    )
+    return queryset.filter(id__in=found).order_by(rank.asc(), 'id')
+
+
+def filter_by_dish_name(queryset: QuerySet, text: str, restaurant_id: int | None = None) -> QuerySet:
+    """
+    Оставляет рестораны, в которых есть найденные блюда, и подгружает только эти блюда
+    в порядке релевантности
+    :param queryset: рестораны
+    :param text: поисковый запрос
+    :param restaurant_id: ограничить поиск блюдами ресторана
+    """
+    dishes = search_dishes(text, queryset.db, restaurant_id)
+    return queryset.filter(
+        id__in=dishes.order_by().values('restaurant_id')
+    ).prefetch_related(
+        Prefetch("dishes", queryset=dishes)
+    )
@@ -0,0 +1,114 @@
+"""
+Учёт памяти Redis по шаблонам ключей и сжатие пространства ключей корзин
+"""
+
+import re
+from dataclasses import dataclass
+
+from django.conf import settings
+from redis import Redis, ResponseError
+
+from core.services.cart import DISH_IDS_KEY, cart_key, priced_cart_key
+
+# Изменяемая часть ключа: числовой ID или длинный идентификатор (UUID, ключ сессии, ключ идемпотентности)
+VARIABLE_SEGMENT = re.compile(r'^(\d+|[\w-]{16,})$')
+
+# Удаляет из корзины позиции с некорректным количеством и удалёнными блюдами (если множество ID
+# блюд прогрето) и назначает время жизни корзинам, созданным до его введения
+# KEYS[1] - корзина, KEYS[2] - множество ID блюд; ARGV[1] - время жизни корзины
+COMPACT_CART_SCRIPT = """
+local items = redis.call('HGETALL', KEYS[1])
+local check_dishes = redis.call('EXISTS', KEYS[2]) == 1
+local removed = 0
+for i = 1, #items, 2 do
+    local quantity = tonumber(items[i + 1])
+    if not quantity or quantity <= 0 or (check_dishes and redis.call('SISMEMBER', KEYS[2], items[i]) == 0) then
+        redis.call('HDEL', KEYS[1], items[i])
+        removed = removed + 1
+    end
+end
+local expired = 0
+if redis.call('TTL', KEYS[1]) == -1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    expired = 1
+end
+return {removed, expired}
+"""
+
+
+def key_pattern(key: str) -> str:
+    """
+    Шаблон ключа для отчёта: изменяемые части заменяются на *, например cart:42 -> cart:*
+    """
+    return ':'.join('*' if VARIABLE_SEGMENT.match(segment) else segment for segment in key.split(':'))
+
+
+@dataclass
+class PatternStats:
+    keys: int = 0
+    memory: int | None = 0
+    no_ttl: int = 0
+
+    def add(self, memory: int | None, ttl: int) -> None:
+        self.keys += 1
+        self.memory = None if self.memory is None or memory is None else self.memory + memory
+        if ttl == -1:
+            self.no_ttl += 1
+
+
+def keyspace_report(client: Redis, match: str = '*', count: int = 1000) -> dict[str, PatternStats]:
+    """
+    Обходит ключи командой SCAN, не блокируя Redis, и суммирует память (MEMORY USAGE) по шаблонам ключей.
+    Если MEMORY USAGE недоступна (например, отключена у управляемого Redis), память не учитывается
+    :param match: шаблон отбора ключей для SCAN
+    :param count: сколько ключей запрашивать за одну итерацию SCAN
+    :return: статистика по шаблонам ключей
+    """
+    report: dict[str, PatternStats] = {}
+    cursor = None
+    while cursor != 0:
+        cursor, keys = client.scan(cursor or 0, match=match, count=count)
+        if not keys:
+            continue
+        with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.memory_usage(key)
+                pipe.ttl(key)
+            results = pipe.execute(raise_on_error=False)
+        for key, memory, ttl in zip(keys, results[::2], results[1::2]):
+            if isinstance(memory, ResponseError):
+                memory = None
+            report.setdefault(key_pattern(key.decode()), PatternStats()).add(memory, ttl)
+    return report
+
+
+@dataclass
+class CompactionResult:
+    carts: int = 0
+    removed_items: int = 0
+    expire_set: int = 0
+    removed_snapshots: int = 0
+
+
+def compact_carts(client: Redis, count: int = 1000) -> CompactionResult:
+    """
+    Проход сжатия ключей корзин: чистит позиции корзин, назначает время жизни корзинам без него
+    и удаляет снимки цен корзин, которых уже нет. Каждая корзина обрабатывается атомарно скриптом,
+    поэтому проход безопасен при параллельной работе с корзинами
+    :param count: сколько ключей запрашивать за одну итерацию SCAN
+    """
+    compact = client.register_script(COMPACT_CART_SCRIPT)
+    result = CompactionResult()
+    for key in client.scan_iter(match=cart_key('*'), count=count):
+        user_id = key.decode().split(':')[1]
+        if user_id.isdigit():
+            removed, expired = compact(keys=[key, DISH_IDS_KEY], args=[settings.CART_TTL])
+            result.carts += 1
+            result.removed_items += removed
+            result.expire_set += expired
+
+    for key in client.scan_iter(match=priced_cart_key('*'), count=count):
+        user_id = key.decode().split(':')[2]
+        if user_id.isdigit() and not client.exists(cart_key(int(user_id))):
+            result.removed_snapshots += client.delete(key)
+    return result
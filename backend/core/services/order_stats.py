@@ -0,0 +1,115 @@
+"""
+Дневные агрегаты заказов по пользователям и ресторанам: обновляются инкрементально при записи
+заказов и пересобираются командой rebuild_order_stats
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.models import Dish, Order, OrderItem, RestaurantDailyStats, UserDailyStats
+
+
+def quoted_names() -> dict[str, str]:
+    quote = connection.ops.quote_name
+    return {
+        'user_stats': quote(UserDailyStats._meta.db_table),
+        'restaurant_stats': quote(RestaurantDailyStats._meta.db_table),
+        'item': quote(OrderItem._meta.db_table),
+        'dish': quote(Dish._meta.db_table),
+        'order': quote(Order._meta.db_table),
+    }
+
+
+# Прибавляет заказы пользователя к агрегату дня (INSERT ... ON CONFLICT есть и в SQLite, и в PostgreSQL)
+USER_STATS_UPSERT = """
+INSERT INTO {user_stats} (user_id, day, orders_count, total) VALUES (%s, %s, %s, %s)
+ON CONFLICT (user_id, day) DO UPDATE SET
+    orders_count = {user_stats}.orders_count + excluded.orders_count,
+    total = {user_stats}.total + excluded.total
+"""
+
+# Прибавляет позиции заказов к агрегатам ресторанов за день; ресторан определяется по блюду позиции,
+# поэтому позиции должны быть уже записаны. WHERE обязателен: без него SQLite не отличит ON CONFLICT от ON соединения
+RESTAURANT_STATS_UPSERT = """
+INSERT INTO {restaurant_stats} (restaurant_id, day, orders_count, items_count, total)
+SELECT dish.restaurant_id, %s, COUNT(DISTINCT item.order_id), SUM(item.quantity), SUM(item.quantity * item.unit_price)
+FROM {item} item INNER JOIN {dish} dish ON dish.id = item.dish_id
+WHERE item.order_id IN ({placeholders})
+GROUP BY dish.restaurant_id
+ON CONFLICT (restaurant_id, day) DO UPDATE SET
+    orders_count = {restaurant_stats}.orders_count + excluded.orders_count,
+    items_count = {restaurant_stats}.items_count + excluded.items_count,
+    total = {restaurant_stats}.total + excluded.total
+"""
+
+
+def record_orders(orders: Iterable[Order]) -> None:
+    """
+    Прибавляет заказы к дневным агрегатам пользователей и ресторанов двумя запросами на каждый день заказов.
+    Вызывается в той же транзакции, что и запись заказов и их позиций, поэтому агрегаты не расходятся с заказами
+    :param orders: записанные заказы с id, user_id, created_at и total
+    """
+    by_day = defaultdict(list)
+    for order in orders:
+        by_day[timezone.localdate(order.created_at)].append(order)
+    if not by_day:
+        return
+
+    names = quoted_names()
+    with connection.cursor() as cursor:
+        for day, day_orders in by_day.items():
+            users = defaultdict(lambda: [0, Decimal("0.00")])
+            for order in day_orders:
+                users[order.user_id][0] += 1
+                users[order.user_id][1] += order.total
+            cursor.executemany(
+                USER_STATS_UPSERT.format(**names),
+                [(user_id, day, count, total) for user_id, (count, total) in users.items()],
+            )
+            order_ids = [order.id for order in day_orders]
+            # SQLite ограничивает число параметров запроса, один параметр занимает день
+            batch_size = (connection.features.max_query_params or len(order_ids) + 1) - 1
+            for start in range(0, len(order_ids), batch_size):
+                batch = order_ids[start:start + batch_size]
+                cursor.execute(
+                    RESTAURANT_STATS_UPSERT.format(placeholders=', '.join(['%s'] * len(batch)), **names),
+                    [day, *batch],
+                )
+
+
+def rebuild_order_stats(chunk_size: int = 1000) -> int:
+    """
+    Пересобирает агрегаты с нуля, читая заказы частями по возрастанию id, каждая часть - своя транзакция.
+    Заказы, оформленные во время пересборки, учитываются самим оформлением и повторно не прибавляются.
+    Пока пересборка не завершена, агрегаты неполные
+    :return: число учтённых заказов
+    """
+    with transaction.atomic():
+        # Сброс агрегатов и чтение последнего id ждут фиксации уже начатых транзакций с заказами и не пускают новые:
+        # иначе заказ с id не больше last_id, зафиксированный после сброса, учло бы и оформление, и пересборка.
+        # В SQLite то же самое даёт единственная блокировка записи, которую берёт DELETE
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('LOCK TABLE {order} IN SHARE MODE'.format(**quoted_names()))
+        UserDailyStats.objects.all().delete()
+        RestaurantDailyStats.objects.all().delete()
+        last_id = Order.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+    processed, cursor = 0, 0
+    while cursor < last_id:
+        chunk = list(
+            Order.objects.filter(id__gt=cursor, id__lte=last_id).order_by('id')
+            .only('id', 'user_id', 'created_at', 'total')[:chunk_size]
+        )
+        if not chunk:
+            break
+        with transaction.atomic():
+            record_orders(chunk)
+        processed += len(chunk)
+        cursor = chunk[-1].id
+    return processed
@@ -0,0 +1,42 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from config.redis import get_redis_client
+from core.models import Dish
+from core.services.cart import sync_dish
+
+
+@receiver(pre_save, sender=Dish)
+def dish_saving(sender, instance: Dish, **kwargs) -> None:
+    """
+    Запоминает ресторан, к которому блюдо относилось до сохранения: при переносе блюда
+    нужно сбросить снимки цен и перестроить меню обоих ресторанов
+    """
+    instance._previous_restaurant_id = None
+    if not instance._state.adding and instance.pk is not None:
+        instance._previous_restaurant_id = (
+            Dish.objects.filter(pk=instance.pk).values_list('restaurant_id', flat=True).first()
+        )
+
+
+def dish_restaurant_ids(instance: Dish) -> set[int]:
+    restaurant_ids = {instance.restaurant_id, getattr(instance, '_previous_restaurant_id', None)}
+    restaurant_ids.discard(None)
+    return restaurant_ids
+
+
+@receiver(post_save, sender=Dish)
+def sync_saved_dish(sender, instance: Dish, **kwargs) -> None:
+    """
+    Обновляет кэш блюда после фиксации транзакции, чтобы не закэшировать
+    данные из транзакции, которая может быть откачена
+    """
+    transaction.on_commit(partial(sync_dish, get_redis_client(), instance.id, True, dish_restaurant_ids(instance)))
+
+
+@receiver(post_delete, sender=Dish)
+def sync_deleted_dish(sender, instance: Dish, **kwargs) -> None:
+    transaction.on_commit(partial(sync_dish, get_redis_client(), instance.id, False, dish_restaurant_ids(instance)))
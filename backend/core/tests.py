@@ -1,5 +1,31 @@
-from django.test import TestCase
-from core.models import Dish, Order, OrderItem, Restaurant
+import json
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+import fakeredis
+from redis import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from redis.client import Pipeline
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from config.redis import get_blocking_redis_client
+from core.models import CheckoutDebit, Dish, Order, OrderItem, Restaurant, RestaurantDailyStats, UserDailyStats
+from core.services.cart import (
+    CATALOG_KEY, DISH_IDS_KEY, CartPricing, CartStore, cart_key, priced_cart_key, sync_dish,
+)
+from core.services.checkout import ORDER_STREAM_KEY, OrderWriter, order_status_key
+from core.services.keyspace import key_pattern, keyspace_report
+from core.services.order_stats import record_orders
 from users.models import CustomUser
 from decimal import Decimal
 
@@ -22,3 +48,410 @@ class CoreModelsTestCase(TestCase):
         order_item = OrderItem.objects.create(order=self.order, dish=self.dish, quantity=2)
         self.assertEqual(order_item.quantity, 2)
         self.assertEqual(order_item.dish, self.dish)
+        self.assertEqual(order_item.unit_price, Decimal('10.00'))
+        self.assertEqual(order_item.dish_name, 'Test Dish')
+        self.assertEqual(order_item.price, Decimal('20.00'))
+
+    @patch('core.signals.get_redis_client')
+    def test_dish_change_syncs_redis_cache(self, mock_client):
+        redis_client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        mock_client.return_value = redis_client
+        redis_client.hset(CATALOG_KEY, self.dish.id, '{"name": "Test Dish", "price": "10.00"}')
+        redis_client.sadd(DISH_IDS_KEY, self.dish.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish.price = Decimal('12.00')
+            self.dish.save()
+            new_dish = Dish.objects.create(name='New Dish', price=Decimal('5.00'), restaurant=self.restaurant)
+        self.assertFalse(redis_client.hexists(CATALOG_KEY, self.dish.id))
+        self.assertTrue(redis_client.sismember(DISH_IDS_KEY, new_dish.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish.delete()
+        self.assertEqual(redis_client.smembers(DISH_IDS_KEY), {str(new_dish.id).encode()})
+
+
+class OrderWriterTest(TransactionTestCase):
+
+    def setUp(self):
+        signals_redis = patch('core.signals.get_redis_client', return_value=fakeredis.FakeRedis())
+        signals_redis.start()
+        self.addCleanup(signals_redis.stop)
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        self.restaurant = Restaurant.objects.create(name='Test Restaurant')
+        self.dish = Dish.objects.create(name='Test Dish', price=Decimal('10.00'), restaurant=self.restaurant)
+        self.user = CustomUser.objects.create_user(username='testuser', password='password', balance=Decimal('0.00'))
+        self.writer = OrderWriter(self.redis, 'test', batch_size=10)
+        self.writer.ensure_group()
+
+    def enqueue(self, dish_id: int, quantity: int = 1, paid: bool = True) -> str:
+        reference = uuid.uuid4().hex
+        if paid:
+            CheckoutDebit.objects.create(reference=uuid.UUID(reference), user=self.user, amount=Decimal('10.00'))
+        self.redis.xadd(ORDER_STREAM_KEY, {
+            'reference': reference,
+            'user_id': self.user.id,
+            'total': '10.00',
+            'items': json.dumps([[dish_id, quantity, '10.00', 'Test Dish']]),
+        })
+        return reference
+
+    def test_batch_written_in_one_pass(self):
+        references = [self.enqueue(self.dish.id) for _ in range(3)]
+        self.assertEqual(self.writer.process(), 3)
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.assertEqual(self.redis.xlen(ORDER_STREAM_KEY), 0)
+        for reference in references:
+            self.assertEqual(self.redis.hget(order_status_key(reference), 'status'), b'done')
+        user_stats = UserDailyStats.objects.get(user=self.user)
+        self.assertEqual((user_stats.orders_count, user_stats.total), (3, Decimal('30.00')))
+        restaurant_stats = RestaurantDailyStats.objects.get(restaurant=self.restaurant)
+        self.assertEqual((restaurant_stats.orders_count, restaurant_stats.items_count), (3, 3))
+
+    def test_redelivered_order_not_duplicated(self):
+        reference = self.enqueue(self.dish.id)
+        entries = self.writer.read()
+        self.writer.write([self.writer.decode(fields) for _, fields in entries])
+
+        # обработчик упал до подтверждения: запись доставляется повторно и не создаёт второй заказ
+        self.assertEqual(self.writer.process(), 1)
+        self.assertEqual(Order.objects.filter(reference=reference).count(), 1)
+        self.assertEqual(UserDailyStats.objects.get(user=self.user).orders_count, 1)
+
+    def test_failed_order_refunded(self):
+        good = self.enqueue(self.dish.id)
+        bad = self.enqueue(self.dish.id + 100)
+        with self.assertLogs('core.services.checkout', level='WARNING'):
+            self.assertEqual(self.writer.process(), 2)
+
+        self.assertTrue(Order.objects.filter(reference=good).exists())
+        self.assertFalse(Order.objects.filter(reference=bad).exists())
+        self.assertEqual(self.redis.hget(order_status_key(bad), 'status'), b'failed')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('10.00'))
+        self.assertFalse(CheckoutDebit.objects.exists())
+
+    def test_transient_database_error_redelivers(self):
+        reference = self.enqueue(self.dish.id)
+        with patch.object(OrderWriter, 'write', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.writer.process()
+        # заказ не отменён: списание на месте, запись ждёт повторной доставки
+        self.assertTrue(CheckoutDebit.objects.exists())
+        self.assertIsNone(self.redis.hget(order_status_key(reference), 'status'))
+
+        self.assertEqual(self.writer.process(), 1)
+        self.assertEqual(self.redis.hget(order_status_key(reference), 'status'), b'done')
+        self.assertTrue(Order.objects.filter(reference=reference).exists())
+
+    def test_refunded_checkout_not_written(self):
+        # средства по оформлению уже возвращены при его отмене: заказ не записывается
+        paid = self.enqueue(self.dish.id)
+        refunded = self.enqueue(self.dish.id, paid=False)
+        self.assertEqual(self.writer.process(), 2)
+
+        self.assertEqual(list(Order.objects.values_list('reference', flat=True)), [uuid.UUID(paid)])
+        self.assertEqual(self.redis.hget(order_status_key(refunded), 'status'), b'failed')
+        self.assertFalse(CheckoutDebit.objects.exists())
+
+
+class ProcessOrdersCommandTest(TransactionTestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        patcher = patch('core.management.commands.process_orders.get_blocking_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_socket_timeout_exceeds_block(self):
+        client = get_blocking_redis_client(1.0)
+        self.assertEqual(client.connection_pool.connection_kwargs['socket_timeout'],
+                         1.0 + settings.REDIS_SOCKET_TIMEOUT)
+
+    def test_survives_redis_errors(self):
+        class Stop(Exception):
+            pass
+
+        with patch('core.services.checkout.OrderWriter.process',
+                   side_effect=[RedisTimeoutError('Timeout reading from socket'), 0, Stop]) as process, \
+                patch('core.management.commands.process_orders.time.sleep') as sleep, \
+                patch('signal.signal'), self.assertRaises(Stop):
+            call_command('process_orders', '--block', '100', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(process.call_count, 3)
+        sleep.assert_called_once_with(0.1)
+
+    def test_survives_database_errors(self):
+        class Stop(Exception):
+            pass
+
+        with patch('core.services.checkout.OrderWriter.process',
+                   side_effect=[OperationalError('database is locked'), 0, Stop]) as process, \
+                patch('core.management.commands.process_orders.time.sleep') as sleep, \
+                patch('signal.signal'), self.assertRaises(Stop):
+            call_command('process_orders', '--block', '100', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(process.call_count, 3)
+        sleep.assert_called_once_with(0.1)
+
+    def test_once_reports_redis_error(self):
+        with patch('core.services.checkout.OrderWriter.process', side_effect=RedisConnectionError('refused')):
+            with self.assertRaisesMessage(CommandError, 'Redis недоступен'):
+                call_command('process_orders', '--once', stdout=StringIO())
+
+
+class SqlitePragmasTest(SimpleTestCase):
+
+    def open_connection(self) -> DatabaseWrapper:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': os.path.join(directory.name, 'db.sqlite3')})
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper: DatabaseWrapper, name: str):
+        return wrapper.connection.execute(f'PRAGMA {name}').fetchone()[0]
+
+    def test_new_connection_tuned(self):
+        wrapper = self.open_connection()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), settings.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), settings.SQLITE_PRAGMAS['cache_size'])
+
+    @override_settings(SQLITE_PRAGMAS_ENABLED=False)
+    def test_tuning_disabled(self):
+        wrapper = self.open_connection()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('sqlite_benchmark', duration=0.2, readers=1, writers=1, restaurants=5, users=5, orders=50,
+                     stdout=out)
+        modes = [line.split()[0] for line in out.getvalue().splitlines()]
+        self.assertEqual(modes, ['default', 'tuned'])
+
+
+class OrderStatsTest(TestCase):
+
+    def setUp(self):
+        self.pizzeria = Restaurant.objects.create(name='Pizzeria')
+        self.sushi = Restaurant.objects.create(name='Sushi')
+        self.pizza = Dish.objects.create(name='Pizza', price=Decimal('10.00'), restaurant=self.pizzeria)
+        self.roll = Dish.objects.create(name='Roll', price=Decimal('4.50'), restaurant=self.sushi)
+        self.alice = CustomUser.objects.create_user(username='alice', password='password')
+        self.bob = CustomUser.objects.create_user(username='bob', password='password')
+
+    def create_order(self, user: CustomUser, days_ago: int, items: list[tuple[Dish, int]]) -> Order:
+        order = Order.objects.create(user=user, total=sum((dish.price * quantity for dish, quantity in items),
+                                                          Decimal('0.00')))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, dish=dish, quantity=quantity, unit_price=dish.price, dish_name=dish.name)
+            for dish, quantity in items
+        ])
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        order.refresh_from_db()
+        return order
+
+    def stats(self) -> tuple[list, list]:
+        return (
+            list(UserDailyStats.objects.order_by('user_id', 'day').values_list('user_id', 'day', 'orders_count',
+                                                                                'total')),
+            list(RestaurantDailyStats.objects.order_by('restaurant_id', 'day').values_list(
+                'restaurant_id', 'day', 'orders_count', 'items_count', 'total')),
+        )
+
+    def test_incremental_matches_rebuild(self):
+        orders = [
+            self.create_order(self.alice, 0, [(self.pizza, 2), (self.roll, 1)]),
+            self.create_order(self.alice, 0, [(self.pizza, 1)]),
+            self.create_order(self.alice, 1, [(self.roll, 4)]),
+            self.create_order(self.bob, 0, [(self.roll, 2)]),
+        ]
+        # часть заказов учитывается пачкой, как у обработчика отложенной записи
+        record_orders(orders[:3])
+        record_orders(orders[3:])
+        incremental = self.stats()
+
+        today = timezone.localdate()
+        self.assertIn((self.alice.id, today, 2, Decimal('34.50')), incremental[0])
+        self.assertIn((self.sushi.id, today, 2, 3, Decimal('13.50')), incremental[1])
+        self.assertEqual(len(incremental[1]), 3)
+
+        out = StringIO()
+        call_command('rebuild_order_stats', chunk_size=3, stdout=out)
+        self.assertIn('учтено заказов: 4', out.getvalue())
+        self.assertEqual(self.stats(), incremental)
+
+    def test_record_orders_within_query_params_limit(self):
+        orders = [self.create_order(self.alice, 0, [(self.pizza, 1), (self.roll, quantity)]) for quantity in (1, 2, 3)]
+        orders.append(self.create_order(self.bob, 0, [(self.roll, 2)]))
+        # позиции ресторанов одного дня учитываются несколькими запросами по два заказа
+        with patch.object(connection.features, 'max_query_params', 3), \
+                CaptureQueriesContext(connection) as queries:
+            record_orders(orders)
+        self.assertEqual(sum(sql['sql'].count('IN (') for sql in queries.captured_queries), 2)
+        incremental = self.stats()
+
+        call_command('rebuild_order_stats', stdout=StringIO())
+        self.assertEqual(self.stats(), incremental)
+        self.assertIn((self.sushi.id, timezone.localdate(), 4, 8, Decimal('36.00')), incremental[1])
+
+
+class CartKeyspaceTest(TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        self.redis.sadd(DISH_IDS_KEY, 1, 2)
+
+    @override_settings(CART_TTL=600)
+    def test_cart_changes_extend_ttl(self):
+        store = CartStore(self.redis)
+        store.add(1, 1, 2)
+        self.assertEqual(self.redis.ttl(cart_key(1)), 600)
+
+        self.redis.expire(cart_key(1), 10)
+        store.remove(1, 1, 1)
+        self.assertEqual(self.redis.ttl(cart_key(1)), 600)
+
+        self.redis.expire(cart_key(1), 10)
+        store.apply(1, [{'op': 'set', 'dish_id': 2, 'quantity': 3}])
+        self.assertEqual(self.redis.ttl(cart_key(1)), 600)
+
+    @override_settings(CATALOG_CACHE_TTL=300)
+    def test_catalog_keys_expire(self):
+        # сброс цены мог не дойти до недоступного Redis: кэш цен живёт не дольше CATALOG_CACHE_TTL с заполнения
+        restaurant = Restaurant.objects.create(name='Test Restaurant')
+        dishes = [Dish.objects.create(name=f'Dish {i}', price=Decimal('10.00'), restaurant=restaurant)
+                  for i in range(2)]
+        pricing = CartPricing(self.redis)
+        pricing.resolve_dishes([dishes[0].id])
+        self.assertEqual(self.redis.ttl(CATALOG_KEY), 300)
+
+        self.redis.expire(CATALOG_KEY, 10)
+        pricing.resolve_dishes([dishes[1].id])
+        self.assertEqual(self.redis.ttl(CATALOG_KEY), 10)
+
+        CartStore(self.redis).warm_dish_ids()
+        self.assertEqual(self.redis.ttl(DISH_IDS_KEY), 300)
+
+    def test_warm_keeps_dishes_created_meanwhile(self):
+        restaurant = Restaurant.objects.create(name='Test Restaurant')
+        Dish.objects.create(name='Old Dish', price=Decimal('10.00'), restaurant=restaurant)
+        created = []
+        execute = Pipeline.execute
+
+        def create_then_execute(pipe, *args, **kwargs):
+            # блюдо создано после чтения ID из базы, но до подмены множества: sync_dish пишет в старое множество
+            if not created:
+                created.append(Dish.objects.create(name='New Dish', price=Decimal('5.00'), restaurant=restaurant))
+                sync_dish(self.redis, created[0].id, True, [restaurant.id])
+            return execute(pipe, *args, **kwargs)
+
+        with patch.object(Pipeline, 'execute', autospec=True, side_effect=create_then_execute):
+            CartStore(self.redis).warm_dish_ids()
+        self.assertTrue(self.redis.sismember(DISH_IDS_KEY, created[0].id))
+        self.assertEqual(self.redis.scard(DISH_IDS_KEY), 2)
+
+    def test_warm_drops_dishes_deleted_meanwhile(self):
+        restaurant = Restaurant.objects.create(name='Test Restaurant')
+        kept = Dish.objects.create(name='Kept Dish', price=Decimal('10.00'), restaurant=restaurant)
+        deleted = Dish.objects.create(name='Deleted Dish', price=Decimal('5.00'), restaurant=restaurant)
+        deleted_id = deleted.id
+        execute = Pipeline.execute
+
+        def delete_then_execute(pipe, *args, **kwargs):
+            # блюдо удалено после чтения ID из базы, но до подмены множества: sync_dish убирает его из старого
+            if Dish.objects.filter(id=deleted_id).exists():
+                deleted.delete()
+                sync_dish(self.redis, deleted_id, False, [restaurant.id])
+            return execute(pipe, *args, **kwargs)
+
+        with patch.object(Pipeline, 'execute', autospec=True, side_effect=delete_then_execute):
+            CartStore(self.redis).warm_dish_ids()
+        self.assertFalse(self.redis.sismember(DISH_IDS_KEY, deleted_id))
+        self.assertEqual(self.redis.smembers(DISH_IDS_KEY), {str(kept.id).encode()})
+
+    def test_key_pattern(self):
+        self.assertEqual(key_pattern('cart:42'), 'cart:*')
+        self.assertEqual(key_pattern('cart:reserved:0f8e6c52d4b94b3c9a4b3d1e2f6a7b8c'), 'cart:reserved:*')
+        self.assertEqual(key_pattern(':1:menu:restaurant:7'), ':*:menu:restaurant:*')
+        self.assertEqual(key_pattern('catalog:dishes'), 'catalog:dishes')
+
+    def test_report_memory_by_pattern(self):
+        self.redis.hset(cart_key(1), 1, 1)
+        self.redis.hset(cart_key(2), 2, 1)
+        self.redis.expire(cart_key(2), 60)
+        # fakeredis не поддерживает MEMORY USAGE, вместо памяти ключа считаем единицу
+        with patch.object(Pipeline, 'memory_usage', lambda pipe, key: pipe.exists(key)):
+            report = keyspace_report(self.redis, count=1)
+        self.assertEqual(report['cart:*'].keys, 2)
+        self.assertEqual(report['cart:*'].memory, 2)
+        self.assertEqual(report['cart:*'].no_ttl, 1)
+        self.assertEqual(report[DISH_IDS_KEY].keys, 1)
+
+    def test_report_without_memory_usage(self):
+        self.redis.hset(cart_key(1), 1, 1)
+        self.assertIsNone(keyspace_report(self.redis)['cart:*'].memory)
+
+    @override_settings(CART_TTL=600)
+    def test_compact_command(self):
+        # корзина без времени жизни с удалённым блюдом и некорректным количеством
+        self.redis.hset(cart_key(1), mapping={1: 2, 3: 1, 2: 0})
+        self.redis.set(priced_cart_key(1), '{}')
+        self.redis.set(priced_cart_key(5), '{}')
+        self.redis.hset('cart:reserved:0f8e6c52d4b94b3c9a4b3d1e2f6a7b8c', 1, 1)
+
+        out = StringIO()
+        with patch('core.management.commands.redis_keyspace.get_redis_client', return_value=self.redis):
+            call_command('redis_keyspace', compact=True, stdout=out)
+        self.assertIn('Корзин: 1, удалено позиций: 2, назначено время жизни: 1, удалено снимков цен: 1',
+                      out.getvalue())
+        self.assertIn('cart:priced:*', out.getvalue())
+        self.assertEqual(self.redis.hgetall(cart_key(1)), {b'1': b'2'})
+        self.assertEqual(self.redis.ttl(cart_key(1)), 600)
+        self.assertTrue(self.redis.exists(priced_cart_key(1)))
+        self.assertFalse(self.redis.exists(priced_cart_key(5)))
+        self.assertTrue(self.redis.exists('cart:reserved:0f8e6c52d4b94b3c9a4b3d1e2f6a7b8c'))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'план запроса проверяется в формате EXPLAIN QUERY PLAN SQLite')
+class HotQueryPlanTest(TestCase):
+    """
+    Горячие запросы API должны использовать индексы, а не полный просмотр таблиц и сортировку во временном B-дереве
+    """
+
+    def assertUsesIndex(self, queryset, index: str):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('USE TEMP B-TREE', plan)
+
+    def test_order_history_page(self):
+        created_at = timezone.now()
+        queryset = (
+            Order.objects.filter(user_id=1)
+            .filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=100))
+            .order_by('-created_at', '-id')[:11]
+        )
+        self.assertUsesIndex(queryset, 'order_user_created_idx')
+
+    def test_order_items_prefetch(self):
+        self.assertUsesIndex(OrderItem.objects.filter(order_id__in=[1, 2, 3]), 'core_orderitem_order_id')
+
+    def test_restaurant_dishes(self):
+        # для меню подходит и индекс внешнего ключа, и префикс составного индекса
+        self.assertUsesIndex(Dish.objects.filter(restaurant_id__in=[1, 2]), 'USING INDEX')
+        self.assertUsesIndex(
+            Dish.objects.filter(restaurant_id=1, name='Pizza').order_by('name'), 'dish_restaurant_name_idx',
+        )
+
+    def test_restaurant_pagination_keys(self):
+        queryset = Restaurant.objects.order_by('created_at', 'id').values_list('created_at', 'id')
+        self.assertUsesIndex(queryset, 'COVERING INDEX restaurant_created_idx')
+        # страница после курсора тоже читается только из индекса
+        created_at = timezone.now()
+        page = (
+            Restaurant.objects.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=1))
+            .order_by('created_at', 'id').values_list('created_at', 'id')[:21]
+        )
+        self.assertUsesIndex(page, 'COVERING INDEX restaurant_created_idx')
@@ -0,0 +1,43 @@
+"""
+Настройки gunicorn для production-запуска (run.sh в режимах wsgi и asgi), значения берутся из переменных окружения
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("SERVER_BIND", "0.0.0.0:8000")
+
+# По умолчанию 2 * CPU + 1 процесса; асинхронным воркерам uvicorn хватает по одному на ядро
+if os.environ.get("SERVER_MODE") == "asgi":
+    worker_class = "uvicorn.workers.UvicornWorker"
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+else:
+    worker_class = "gthread"
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+    threads = int(os.environ.get("SERVER_THREADS", 4))
+
+# Приложение загружается в мастер-процессе до fork: воркеры разделяют память кода копированием при записи.
+# Соединения с базой и Redis открываются лениво, уже в воркерах
+preload_app = os.environ.get("SERVER_PRELOAD", "true").lower() == "true"
+
+# Перезапуск воркера после max_requests запросов (со случайным разбросом, чтобы воркеры не перезапускались разом)
+# ограничивает рост памяти от утечек и фрагментации
+max_requests = int(os.environ.get("SERVER_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("SERVER_MAX_REQUESTS_JITTER", 200))
+
+timeout = int(os.environ.get("SERVER_TIMEOUT", 30))
+# Сколько секунд воркер дорабатывает текущие запросы после SIGTERM или SIGHUP
+graceful_timeout = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("SERVER_KEEPALIVE", 5))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("SERVER_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # соединения с базой, открытые в мастере при preload_app, не должны разделяться между процессами;
+    # пулы redis-py сами пересоздают соединения после fork по смене PID
+    from django.db import connections
+
+    connections.close_all()
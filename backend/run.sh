@@ -1,5 +1,24 @@
 #!/bin/sh
+# Режим запуска SERVER_MODE: dev - runserver Django, wsgi - gunicorn с потоковыми воркерами,
+# asgi - gunicorn с воркерами uvicorn; параметры воркеров в gunicorn.conf.py
+set -e
+
 python manage.py collectstatic --noinput
 python manage.py migrate
-#python -m gunicorn -w 4 wsgi:application --bind 0.0.0.0:8000
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+
+# прогрев кэшей меню, каталога блюд и проверка доступности базы и Redis до приёма трафика
+python manage.py warmup
+
+case "${SERVER_MODE:-dev}" in
+  wsgi)
+    exec python -m gunicorn wsgi:application
+    ;;
+  asgi)
+    # под ASGI Django не закрывает устаревшие соединения потоков исполнителя, постоянные соединения по умолчанию отключены
+    export DB_CONN_MAX_AGE="${DB_CONN_MAX_AGE:-0}"
+    exec python -m gunicorn asgi:application
+    ;;
+  *)
+    exec python manage.py runserver 0.0.0.0:8000
+    ;;
+esac
@@ -0,0 +1,50 @@
+import copy
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.backends import ModelBackend
+from redis import RedisError
+
+from config.redis import get_redis_client
+from .sessions import is_fresh, local_users, user_version_key
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend, который держит снимок пользователя в локальном кэше процесса,
+    чтобы аутентификация по сессии не выполняла запрос к базе на каждый запрос.
+
+    Снимок используется, только пока версия пользователя в Redis не изменилась: forget_user
+    после выхода или смены пароля в любом процессе меняет версию. Версия сверяется не чаще раза
+    в SESSION_LOCAL_RECHECK_INTERVAL секунд, в промежутке запрос не обращается ни к Redis, ни к базе,
+    поэтому другие процессы замечают смену пароля с этой задержкой. Остальные поля снимка могут отставать
+    от базы на SESSION_LOCAL_CACHE_TTL, поэтому изменение баланса выполняется условным UPDATE в базе,
+    а не по значению из снимка.
+    """
+
+    def get_user(self, user_id):
+        if local_users.ttl <= 0:
+            return super().get_user(user_id)
+        cached = local_users.get(user_id)
+        if cached is not None and is_fresh(cached[2]):
+            return copy.copy(cached[1])
+        try:
+            version = get_redis_client().get(user_version_key(user_id))
+        except RedisError:
+            # без Redis нельзя проверить, не сброшен ли снимок в другом процессе
+            return super().get_user(user_id)
+
+        if cached is not None and cached[0] == version:
+            user = cached[1]
+        else:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+        local_users.set(user_id, (version, user, time.monotonic()))
+        # каждый запрос получает свою копию, общий снимок не изменяется
+        return copy.copy(user)
+
+    async def aget_user(self, user_id):
+        # начиная с Django 5.1 request.auser() вызывает aget_user бэкенда, без него асинхронные представления
+        # читали бы пользователя мимо снимка и проверки его версии
+        return await sync_to_async(self.get_user)(user_id)
@@ -1,20 +1,47 @@
+from functools import partial
+
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from _decimal import Decimal
 
+from .sessions import forget_user
+
 
 class CustomUser(AbstractUser):
     balance = models.DecimalField(
         max_digits=10, decimal_places=2, default=0.0, verbose_name="Баланс"
     )
 
+    def save(self, *args, **kwargs):
+        password_changed = self._password is not None
+        super().save(*args, **kwargs)
+        # после смены пароля снимок пользователя в локальном кэше не должен проходить проверку сессии.
+        # Сброс после фиксации транзакции: иначе другой процесс успеет перечитать из базы старый пароль
+        # и закэшировать его под новой версией
+        if password_changed:
+            transaction.on_commit(partial(forget_user, self.pk))
+
+    def debit_balance(self, amount: Decimal) -> bool:
+        """
+        Атомарно списывает сумму с баланса одним условным UPDATE без чтения и блокировок.
+        Списание происходит только если на балансе в базе достаточно средств,
+        поэтому параллельные списания не могут увести баланс в минус или потерять обновление
+        :param amount: сумма списания
+        :return: True, если средства списаны
+        """
+        debited = type(self).objects.filter(pk=self.pk, balance__gte=amount).update(
+            balance=F('balance') - amount
+        )
+        if debited:
+            self.balance -= amount
+        return bool(debited)
+
     def write_off_balance(self, total_price: Decimal) -> None:
         """
         Проверяет возможность списания суммы с баланса пользователя и списывает её
         :param total_price: сумма списания с баланса
         :return: None
         """
-        if self.balance < total_price:
+        if not self.debit_balance(total_price):
             raise Exception("Сумма списания превышает средства на балансе")
-        self.balance -= total_price
-        self.save()
@@ -0,0 +1,130 @@
+"""
+Хранилище сессий в Redis с локальным кэшем декодированных сессий
+"""
+
+import copy
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError, SessionBase, UpdateError
+from redis import RedisError
+
+from config.local_cache import LocalCache
+from config.redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'session:'
+
+# Декодированные сессии и снимки пользователей этого процесса. В пределах SESSION_LOCAL_RECHECK_INTERVAL
+# запись используется без обращения к Redis и базе, затем сверяется с Redis одной командой GET: выход и смена пароля
+# в другом процессе действуют не позже чем через SESSION_LOCAL_RECHECK_INTERVAL, а сверка не декодирует сессию
+# и не читает пользователя из базы
+local_sessions = LocalCache(settings.SESSION_LOCAL_CACHE_SIZE, settings.SESSION_LOCAL_CACHE_TTL)
+local_users = LocalCache(settings.SESSION_LOCAL_CACHE_SIZE, settings.SESSION_LOCAL_CACHE_TTL)
+
+
+def user_version_key(user_id: int) -> str:
+    return f'user:version:{user_id}'
+
+
+def is_fresh(checked_at: float) -> bool:
+    """
+    Сверена ли запись локального кэша с Redis не раньше SESSION_LOCAL_RECHECK_INTERVAL секунд назад
+    """
+    return time.monotonic() - checked_at < settings.SESSION_LOCAL_RECHECK_INTERVAL
+
+
+class SessionStore(SessionBase):
+    """
+    Сессии хранятся в Redis через общий пул подключений config.redis, срок жизни задаётся TTL ключа
+    """
+
+    key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._client = get_redis_client()
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self) -> str:
+        return self.key_prefix + self._get_or_create_session_key()
+
+    def load(self) -> dict:
+        cached = local_sessions.get(self.session_key)
+        if cached is not None and is_fresh(cached[2]):
+            return copy.deepcopy(cached[1])
+
+        session_data = self._client.get(self.cache_key)
+        if session_data is None:
+            local_sessions.delete(self.session_key)
+            self._session_key = None
+            return {}
+        # локальная копия верна, только пока сессия в Redis не изменена и не удалена другим процессом
+        if cached is not None and cached[0] == session_data:
+            local_sessions.set(self.session_key, (session_data, cached[1], time.monotonic()))
+            return copy.deepcopy(cached[1])
+        session = self.decode(session_data.decode())
+        local_sessions.set(self.session_key, (session_data, copy.deepcopy(session), time.monotonic()))
+        return session
+
+    def create(self) -> None:
+        for i in range(100):
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+        raise RuntimeError("Unable to create a new session key.")
+
+    def save(self, must_create: bool = False) -> None:
+        if self.session_key is None:
+            return self.create()
+        session = self._get_session(no_load=must_create)
+        session_data = self.encode(session).encode()
+        # для существующей сессии XX не даёт воскресить удалённую параллельным logout сессию
+        result = self._client.set(
+            self.cache_key,
+            session_data,
+            ex=max(self.get_expiry_age(), 1),
+            nx=must_create,
+            xx=not must_create,
+        )
+        if not result:
+            raise CreateError if must_create else UpdateError
+        local_sessions.set(self.session_key, (session_data, copy.deepcopy(session), time.monotonic()))
+
+    def exists(self, session_key: str) -> bool:
+        return bool(session_key) and bool(self._client.exists(self.key_prefix + session_key))
+
+    def delete(self, session_key: str | None = None) -> None:
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        local_sessions.delete(session_key)
+        self._client.delete(self.key_prefix + session_key)
+
+    @classmethod
+    def clear_expired(cls) -> None:
+        # просроченные сессии удаляет сам Redis по TTL
+        pass
+
+
+def forget_user(user_id: int) -> None:
+    """
+    Сбрасывает снимок пользователя в локальном кэше этого процесса, а новой версией пользователя в Redis -
+    и в остальных процессах. Версия - случайный токен: вернуться к значению, с которым снимок был закэширован,
+    она не может, и ключу достаточно пережить локальные записи
+    """
+    local_users.delete(user_id)
+    if local_users.ttl <= 0:
+        return
+    try:
+        get_redis_client().set(user_version_key(user_id), uuid.uuid4().hex, ex=int(local_users.ttl) + 1)
+    except RedisError:
+        logger.warning('Не удалось сбросить снимок пользователя %s в других процессах', user_id, exc_info=True)
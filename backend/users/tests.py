@@ -1,6 +1,23 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from decimal import Decimal
-from django.test import TestCase
+
+from unittest.mock import patch
+
+import fakeredis
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from redis import ConnectionError as RedisConnectionError
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase
+
+from config.local_cache import LocalCache
+from users.backends import CachedModelBackend
 from users.models import CustomUser
+from users.sessions import SessionStore, forget_user, user_version_key
 
 
 class CustomUserModelTest(TestCase):
@@ -18,3 +35,246 @@ class CustomUserModelTest(TestCase):
         with self.assertRaises(Exception) as context:
             self.user.write_off_balance(Decimal('150.00'))
         self.assertEqual(str(context.exception), 'Сумма списания превышает средства на балансе')
+
+    def test_write_off_balance_updates_only_balance(self):
+        stale = CustomUser.objects.get(pk=self.user.pk)
+        self.user.email = 'changed@example.com'
+        self.user.write_off_balance(Decimal('30.00'))
+        stale.write_off_balance(Decimal('30.00'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('40.00'))
+        self.assertEqual(self.user.email, '')
+
+    def test_debit_balance_stale_instance(self):
+        stale = CustomUser.objects.get(pk=self.user.pk)
+        self.assertTrue(self.user.debit_balance(Decimal('80.00')))
+        # у устаревшего экземпляра баланс в памяти 100, но в базе осталось только 20
+        self.assertFalse(stale.debit_balance(Decimal('80.00')))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('20.00'))
+
+
+class DebitBalanceConcurrencyTest(TransactionTestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='testuser', password='password123', balance=Decimal('100.00')
+        )
+
+    def test_concurrent_debits_never_overdraw(self):
+        amount = Decimal('7.00')
+        attempts = 40
+        barrier = threading.Barrier(8)
+
+        def debit() -> bool:
+            # общая in-memory база тестов не ждёт снятия блокировки, как busy_timeout у файловой,
+            # поэтому повторяем попытку вручную
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        user = CustomUser.objects.get(pk=self.user.pk)
+                        return user.debit_balance(amount)
+                    except OperationalError:
+                        continue
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: debit(), range(attempts)))
+
+        self.user.refresh_from_db()
+        self.assertGreaterEqual(self.user.balance, Decimal('0.00'))
+        self.assertEqual(results.count(True), 14)
+        self.assertEqual(self.user.balance, Decimal('100.00') - amount * results.count(True))
+
+
+@override_settings(SESSION_LOCAL_RECHECK_INTERVAL=0)
+class RedisSessionStoreTest(TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        patcher = patch('users.sessions.get_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        local_patcher = patch('users.sessions.local_sessions', LocalCache(maxsize=100, ttl=60))
+        local_patcher.start()
+        self.addCleanup(local_patcher.stop)
+
+    def test_session_round_trip(self):
+        session = SessionStore()
+        session['user_id'] = 42
+        session.save()
+        self.assertGreater(self.redis.ttl(f'session:{session.session_key}'), 0)
+
+        loaded = SessionStore(session.session_key)
+        self.assertEqual(loaded['user_id'], 42)
+        self.assertTrue(loaded.exists(session.session_key))
+
+    def test_repeat_load_served_locally(self):
+        session = SessionStore()
+        session['user_id'] = 42
+        session.save()
+        with patch.object(SessionStore, 'decode') as decode:
+            self.assertEqual(SessionStore(session.session_key)['user_id'], 42)
+        decode.assert_not_called()
+
+    def test_session_changed_elsewhere_not_served_locally(self):
+        session = SessionStore()
+        session['user_id'] = 42
+        session.save()
+        # другой процесс изменил сессию, а затем удалил её при выходе
+        other = SessionStore(session.session_key)
+        other['user_id'] = 7
+        self.redis.set(f'session:{session.session_key}', other.encode(other._get_session()))
+        self.assertEqual(SessionStore(session.session_key)['user_id'], 7)
+
+        self.redis.delete(f'session:{session.session_key}')
+        self.assertNotIn('user_id', SessionStore(session.session_key))
+
+    def test_fresh_copy_served_without_redis(self):
+        session = SessionStore()
+        session['user_id'] = 42
+        session.save()
+        self.redis.delete(f'session:{session.session_key}')
+        with override_settings(SESSION_LOCAL_RECHECK_INTERVAL=60), patch.object(self.redis, 'get') as get:
+            self.assertEqual(SessionStore(session.session_key)['user_id'], 42)
+        get.assert_not_called()
+
+    def test_delete_drops_local_copy(self):
+        session = SessionStore()
+        session['user_id'] = 42
+        session.save()
+        session.delete()
+        loaded = SessionStore(session.session_key)
+        self.assertNotIn('user_id', loaded)
+        self.assertFalse(loaded.exists(session.session_key))
+
+
+@override_settings(SESSION_LOCAL_RECHECK_INTERVAL=0)
+class CachedModelBackendTest(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123')
+        patcher = patch('users.sessions.local_users', LocalCache(maxsize=100, ttl=60))
+        self.local_users = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('users.backends.local_users', self.local_users)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        for target in ('users.sessions.get_redis_client', 'users.backends.get_redis_client'):
+            patcher = patch(target, return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_get_user_served_locally(self):
+        backend = CachedModelBackend()
+        first = backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            second = backend.get_user(self.user.pk)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+    def test_password_change_drops_snapshot(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        self.user.set_password('new-password')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.user.save()
+            # до фиксации транзакции другие процессы ещё читают из базы старый пароль
+            self.assertIsNone(self.redis.get(user_version_key(self.user.pk)))
+        self.assertEqual(len(callbacks), 1)
+        with self.assertNumQueries(1):
+            user = backend.get_user(self.user.pk)
+        self.assertTrue(user.check_password('new-password'))
+
+    def test_snapshot_forgotten_in_other_process_reloaded(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        # выход в другом процессе сбрасывает только его локальный кэш, а здесь меняется версия в Redis
+        with patch('users.sessions.local_users', LocalCache(maxsize=100, ttl=60)):
+            forget_user(self.user.pk)
+        self.assertGreater(self.redis.ttl(user_version_key(self.user.pk)), 0)
+        with self.assertNumQueries(1):
+            backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            backend.get_user(self.user.pk)
+
+    def test_fresh_snapshot_served_without_redis(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        self.redis.set(user_version_key(self.user.pk), 'other-process')
+        with override_settings(SESSION_LOCAL_RECHECK_INTERVAL=60), patch.object(self.redis, 'get') as get, \
+                self.assertNumQueries(0):
+            backend.get_user(self.user.pk)
+        get.assert_not_called()
+
+    def test_snapshot_not_used_without_redis(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        with patch.object(self.redis, 'get', side_effect=RedisConnectionError('Connection refused')), \
+                self.assertNumQueries(1):
+            user = backend.get_user(self.user.pk)
+        self.assertEqual(user, self.user)
+
+    async def test_async_get_user_checks_version(self):
+        backend = CachedModelBackend()
+        await backend.aget_user(self.user.pk)
+        # версию сменил другой процесс
+        self.redis.set(user_version_key(self.user.pk), 'other-process')
+        with patch.object(ModelBackend, 'get_user', autospec=True, return_value=self.user) as load:
+            user = await backend.aget_user(self.user.pk)
+        load.assert_called_once()
+        self.assertEqual(user, self.user)
+
+
+@override_settings(SESSION_ENGINE='users.sessions', SESSION_LOCAL_RECHECK_INTERVAL=60)
+class RedisSessionAuthenticationTest(APITestCase):
+    """
+    Аутентификация запросов через сессии в Redis с включённым локальным кэшем процесса
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', password='password123')
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        for target in ('users.sessions.get_redis_client', 'users.backends.get_redis_client'):
+            patcher = patch(target, return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        stack = self.local_caches()
+        self.addCleanup(stack.close)
+
+    @staticmethod
+    def local_caches() -> ExitStack:
+        """
+        Подменяет локальные кэши сессий и пользователей, как в отдельном процессе
+        """
+        stack = ExitStack()
+        local_users = LocalCache(maxsize=100, ttl=60)
+        stack.enter_context(patch('users.sessions.local_sessions', LocalCache(maxsize=100, ttl=60)))
+        stack.enter_context(patch('users.sessions.local_users', local_users))
+        stack.enter_context(patch('users.backends.local_users', local_users))
+        return stack
+
+    def test_logout_in_other_process_applied_after_recheck(self):
+        url = reverse('order-list')
+        self.client.login(username='testuser', password='password123')
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with patch.object(self.redis, 'get', wraps=self.redis.get) as get, self.assertNumQueries(1):
+            # сессия и пользователь из локального кэша, запрос к базе - только список заказов
+            self.assertEqual(self.client.get(url).status_code, 200)
+        get.assert_not_called()
+
+        # выход с той же сессией в другом процессе со своим локальным кэшем
+        other = APIClient()
+        other.cookies[settings.SESSION_COOKIE_NAME] = session_key
+        with self.local_caches():
+            self.assertEqual(other.post(reverse('logout')).status_code, 200)
+        self.assertFalse(self.redis.exists(f'session:{session_key}'))
+
+        # до сверки с Redis этот процесс ещё принимает сессию, после неё - нет
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with override_settings(SESSION_LOCAL_RECHECK_INTERVAL=0):
+            self.assertEqual(self.client.get(url).status_code, 403)